@@ -2,7 +2,25 @@
 # Date: 06/19/2021
 # Description: Project 1
 
-from statistics import mean, median, mode
+import os
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from statistics import StatisticsError
+
+# NumPy is only needed for the StudentRoster fast path
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# A roster's int grades are counted with bincount when they span at most this many values
+BINCOUNT_RANGE = 1 << 24
+
+# basic_stats_parallel splits grade files into pieces of about this many bytes
+CHUNK_BYTES = 1 << 24
 
 
 class Student:
@@ -14,23 +32,445 @@ class Student:
         self._name = name
         self._grade = grade
 
+    def get_name(self):
+        """Returns the name of the Student"""
+        return self._name
+
     def get_grade(self):
         """Returns the grade of the Student"""
         return self._grade
 
 
+class StudentRoster:
+    """A list of students kept column-wise: a list of names and an array of grades. Grades are stored as 64-bit
+    ints until a grade that is not an int is added, and as floats after that."""
+
+    def __init__(self, students=()):
+        """Returns a StudentRoster holding the given Students"""
+        self._names = []
+        self._grades = array("q")
+        for student in students:
+            self.add_student(student)
+
+    def add(self, name, grade):
+        """Adds a student with the given name and grade"""
+        if self._grades.typecode == "q" and not isinstance(grade, int):
+            self._grades = array("d", self._grades)
+        self._names.append(name)
+        self._grades.append(grade)
+
+    def add_student(self, student):
+        """Adds a Student"""
+        self.add(student.get_name(), student.get_grade())
+
+    def get_names(self):
+        """Returns the list of names"""
+        return self._names
+
+    def get_grades(self):
+        """Returns the array of grades, in the same order as the names"""
+        return self._grades
+
+    def __len__(self):
+        """Returns the number of students"""
+        return len(self._names)
+
+    def __iter__(self):
+        """Iterates over the students as Student objects"""
+        for name, grade in zip(self._names, self._grades):
+            yield Student(name, grade)
+
+
+class GradeAccumulator:
+    """Keeps the mean, median and mode of a collection of grades as grades are added and removed, without storing
+    the grades themselves. The results are the same as the statistics module's mean, median and mode would give for
+    a list of the grades in the order they were added, with two differences. Equal grades such as 7 and 7.0 are
+    counted as one grade, in whichever form was seen first, so the mean of 7 and 7.0 is 7 where statistics.mean
+    gives 7.0. And a tie for the mode goes to the grade first seen among every grade added, even one since removed,
+    so after adding 80, 90 and 80 and removing an 80 the mode is 80 where statistics.mode([90, 80]) gives 90.
+    Accumulators can be pickled and merged, so parts of the grades can be accumulated separately, even in other
+    processes, and combined exactly."""
+
+    def __init__(self, grades=()):
+        """Returns a GradeAccumulator holding the given grades or Students"""
+        self._count = 0
+        self._grade_counts = dict()  # grade -> how many times it was added, in the order first seen
+        self._sorted_grades = None  # the distinct grades in order, or None until they are next needed
+        self.update(grades)
+
+    def add(self, grade, count=1):
+        """Adds a grade, or a Student's grade, count times"""
+        if isinstance(grade, Student):
+            grade = grade.get_grade()
+        grade_count = self._grade_counts.get(grade)
+        if grade_count is None:
+            # The distinct grades are sorted again when they are next needed, so adding many new ones stays linear
+            self._sorted_grades = None
+            self._grade_counts[grade] = count
+        else:
+            self._grade_counts[grade] = grade_count + count
+        self._count += count
+
+    def update(self, grades):
+        """Adds every grade or Student's grade from an iterable in one pass"""
+        # Same as calling add for each grade, with grades already seen handled inline
+        grade_counts = self._grade_counts
+        count = 0
+        for grade in grades:
+            if isinstance(grade, Student):
+                grade = grade.get_grade()
+            if grade in grade_counts:
+                grade_counts[grade] += 1
+                count += 1
+            else:
+                self.add(grade)
+        self._count += count
+
+    def remove(self, grade):
+        """Removes one occurrence of a grade, or of a Student's grade. A grade that is removed and added again keeps
+        its place in the order grades were first seen unless none of it was left."""
+        if isinstance(grade, Student):
+            grade = grade.get_grade()
+        count = self._grade_counts.get(grade)
+        if count is None:
+            raise ValueError("grade not in accumulator: " + repr(grade))
+        if count == 1:
+            del self._grade_counts[grade]
+            if self._sorted_grades is not None:
+                del self._sorted_grades[bisect_left(self._sorted_grades, grade)]
+        else:
+            self._grade_counts[grade] = count - 1
+        self._count -= 1
+
+    def merge(self, other):
+        """Adds every grade from another GradeAccumulator, as if they had been added to this one after its own"""
+        for grade, count in other._grade_counts.items():
+            self.add(grade, count)
+
+    def get_count(self):
+        """Returns how many grades there are"""
+        return self._count
+
+    def get_mean(self):
+        """Returns the mean of the grades, as statistics.mean would"""
+        if self._count == 0:
+            raise StatisticsError("mean requires at least one data point")
+
+        # ints are summed as they are; anything else is summed exactly as ratios, like the statistics module does
+        int_total = 0
+        partials = dict()  # denominator -> sum of numerators
+        for grade, count in self._grade_counts.items():
+            if isinstance(grade, int):
+                int_total += grade * count
+            else:
+                numerator, denominator = grade.as_integer_ratio()
+                partials[denominator] = partials.get(denominator, 0) + numerator * count
+
+        total = Fraction(int_total)
+        for denominator, numerator in partials.items():
+            total += Fraction(numerator, denominator)
+        mean = total / self._count
+        if not partials and mean.denominator == 1:
+            return int(mean)
+        return float(mean)
+
+    def get_median(self):
+        """Returns the median of the grades, as statistics.median would"""
+        if self._count == 0:
+            raise StatisticsError("no median for empty data")
+
+        # Walk the distinct grades in order until passing the grade at index middle of the sorted grades, noting the
+        # one before it for an even number of grades
+        middle = self._count // 2
+        seen = 0
+        lower = None
+        for grade in self._get_sorted_grades():
+            seen += self._grade_counts[grade]
+            if lower is None and seen >= middle:
+                lower = grade
+            if seen > middle:
+                if self._count % 2 == 1:
+                    return grade
+                return (lower + grade) / 2
+
+    def get_mode(self):
+        """Returns the most common grade, or the first seen of those that are most common, as statistics.mode
+        would"""
+        if self._count == 0:
+            raise StatisticsError("no mode for empty data")
+        mode = None
+        mode_count = 0
+        for grade, count in self._grade_counts.items():
+            if count > mode_count:
+                mode = grade
+                mode_count = count
+        return mode
+
+    def get_percentile(self, percent):
+        """Returns the grade that the given percent of grades are below, interpolating between grades. A whole percent
+        from 1 to 99 gives the same result as statistics.quantiles(grades, n=100, method="inclusive")[percent - 1],
+        and 0 and 100 give the lowest and highest grades."""
+        if self._count == 0:
+            raise StatisticsError("no percentile for empty data")
+        if not 0 <= percent <= 100:
+            raise ValueError("percent must be from 0 to 100")
+        position = percent * (self._count - 1)
+        index = int(position // 100)
+        delta = position - index * 100
+        # Case where the percent is 0 or 100, or there is only one grade, so the grade is not interpolated
+        if position == 0 or index == self._count - 1:
+            return self._get_sorted_grade(index)
+        return (self._get_sorted_grade(index) * (100 - delta) + self._get_sorted_grade(index + 1) * delta) / 100
+
+    def _get_sorted_grade(self, index):
+        """Returns the grade at the given index of the grades in sorted order"""
+        seen = 0
+        for grade in self._get_sorted_grades():
+            seen += self._grade_counts[grade]
+            if seen > index:
+                return grade
+        raise IndexError("grade index out of range")
+
+    def _get_sorted_grades(self):
+        """Returns the distinct grades in order, sorting them first if grades have been added since they last were"""
+        if self._sorted_grades is None:
+            self._sorted_grades = sorted(self._grade_counts)
+        return self._sorted_grades
+
+
+class GroupedStats:
+    """Keeps a GradeAccumulator for every group of students, where a group is the students with the same values for
+    each of a list of key functions, such as [get_term, get_course, get_section] from the broadest key to the
+    narrowest. Group keys are tuples of those values. Groups can be rolled up into broader ones, such as sections into
+    courses, by merging their accumulators instead of going over the students again. Ties for the mode in a
+    rolled-up group go to the grade seen first in the first group it includes."""
+
+    def __init__(self, key_functions, get_grade=None, students=()):
+        """Returns a GroupedStats for the given key functions holding the given students. get_grade takes a student and
+        returns their grade; by default it is the Student's grade, or the value itself for anything else."""
+        self._key_functions = list(key_functions)
+        self._get_grade = get_grade
+        self._accumulators = dict()  # group key -> GradeAccumulator, in the order groups were first seen
+        self.update(students)
+
+    def update(self, students):
+        """Adds every student from an iterable to their group's accumulator in one pass"""
+        accumulators = self._accumulators
+        key_functions = self._key_functions
+        get_grade = self._get_grade
+        for student in students:
+            key = tuple([key_function(student) for key_function in key_functions])
+            accumulator = accumulators.get(key)
+            if accumulator is None:
+                accumulator = GradeAccumulator()
+                accumulators[key] = accumulator
+            if get_grade is None:
+                accumulator.add(student)
+            else:
+                accumulator.add(get_grade(student))
+
+    def merge(self, other):
+        """Adds every group from another GroupedStats with the same key functions"""
+        for key, other_accumulator in other._accumulators.items():
+            if key not in self._accumulators:
+                self._accumulators[key] = GradeAccumulator()
+            self._accumulators[key].merge(other_accumulator)
+
+    def get_accumulators(self, level=None):
+        """Returns a dict of group key -> GradeAccumulator for groups made from the first level key functions, such as
+        1 for terms or 0 for everyone. By default the groups use every key function."""
+        if level is None or level >= len(self._key_functions):
+            return self._accumulators
+        return self.get_rollups()[level]
+
+    def get_rollups(self):
+        """Returns a list of the group key -> GradeAccumulator dicts for each level, from 0 (everyone) to every key
+        function. Each level is made by merging the groups of the level after it."""
+        rollups = [self._accumulators]
+        for level in range(len(self._key_functions) - 1, -1, -1):
+            broader = dict()
+            for key, accumulator in rollups[0].items():
+                if key[:level] not in broader:
+                    broader[key[:level]] = GradeAccumulator()
+                broader[key[:level]].merge(accumulator)
+            rollups.insert(0, broader)
+        return rollups
+
+    def get_stats(self, level=None, percentiles=()):
+        """Returns a dict of group key -> {"count", "mean", "median", "mode", "percentiles"} for the groups at the
+        given level (see get_accumulators), where "percentiles" maps each of the given percents to its percentile"""
+        stats = dict()
+        for key, accumulator in self.get_accumulators(level).items():
+            stats[key] = {"count": accumulator.get_count(),
+                          "mean": accumulator.get_mean(),
+                          "median": accumulator.get_median(),
+                          "mode": accumulator.get_mode(),
+                          "percentiles": {percent: accumulator.get_percentile(percent) for percent in percentiles}}
+        return stats
+
+
+def grouped_basic_stats(students, key_functions, percentiles=(), get_grade=None):
+    """Takes an iterable of students and a list of key functions and returns the stats of each group of students with
+    the same keys, as GroupedStats.get_stats does, going over the students only once"""
+    return GroupedStats(key_functions, get_grade, students).get_stats(percentiles=percentiles)
+
+
+def get_exact_sum(grades):
+    """Returns the exact sum of a NumPy array of grades, as an int for int grades or a Fraction for float grades"""
+    if grades.dtype.kind != "f":
+        # Summed as 64-bit ints when no total along the way can overflow, and as Python ints otherwise
+        largest = max(abs(int(grades.min())), abs(int(grades.max())))
+        if largest * len(grades) < 1 << 63:
+            return int(grades.sum(dtype=numpy.int64))
+        return sum(grades.tolist())
+
+    # Each float is a 53-bit int times a power of two. Grades with the same power are summed as ints, split into
+    # 27-bit halves so the sums can't overflow.
+    mantissas, exponents = numpy.frexp(grades)
+    mantissas = (mantissas * (1 << 53)).astype(numpy.int64)
+    total = Fraction(0)
+    for exponent in numpy.unique(exponents):
+        same_exponent = mantissas[exponents == exponent]
+        high = int((same_exponent >> 27).sum())
+        low = int((same_exponent & ((1 << 27) - 1)).sum())
+        total += Fraction((high << 27) + low) * Fraction(2) ** (int(exponent) - 53)
+    return total
+
+
+def get_first_of(grades, candidates):
+    """Returns whichever of the candidate grades comes first in a NumPy array of grades"""
+    return grades[numpy.flatnonzero(numpy.isin(grades, candidates))[0]].item()
+
+
+def roster_basic_stats(grades):
+    """Returns the mean, median and mode of a non-empty NumPy array of grades, as the statistics module would"""
+    count = len(grades)
+
+    # Mean, from the exact sum converted the way statistics.mean converts it
+    total = get_exact_sum(grades)
+    if grades.dtype.kind == "f":
+        mean = float(total / count)
+    elif total % count == 0:
+        mean = total // count
+    else:
+        mean = total / count
+
+    # Median, partitioning around the middle instead of sorting
+    middle = count // 2
+    if count % 2 == 1:
+        median = numpy.partition(grades, middle)[middle].item()
+    else:
+        partitioned = numpy.partition(grades, [middle - 1, middle])
+        median = (partitioned[middle - 1].item() + partitioned[middle].item()) / 2
+
+    # Mode, with ties going to the grade seen first like statistics.mode
+    low = grades.min()
+    if grades.dtype.kind != "f" and int(grades.max()) - int(low) < BINCOUNT_RANGE:
+        counts = numpy.bincount(grades - low)
+        candidates = numpy.flatnonzero(counts == counts.max()) + low
+    else:
+        values, counts = numpy.unique(grades, return_counts=True)
+        candidates = values[counts == counts.max()]
+    if len(candidates) == 1:
+        mode = candidates[0].item()
+    else:
+        mode = get_first_of(grades, candidates)
+    return mean, median, mode
+
+
 def basic_stats(list_of_students):
-    """Takes as a parameter a list of Student objects and returns a tuple containing the mean, median, and mode of all
-    the grades"""
-    # initialize an empty list
-    grades = list()
+    """Takes as a parameter an iterable of Student objects or grades and returns a tuple containing the mean, median,
+    and mode of all the grades. The iterable is only read once, so it can be a generator. A StudentRoster's grades
+    are worked on as a NumPy array when NumPy is installed."""
+    if isinstance(list_of_students, StudentRoster):
+        grades = list_of_students.get_grades()
+        if numpy is not None and len(grades) > 0:
+            return roster_basic_stats(numpy.frombuffer(grades, dtype=grades.typecode))
+        list_of_students = grades
+
+    accumulator = GradeAccumulator(list_of_students)
+    return accumulator.get_mean(), accumulator.get_median(), accumulator.get_mode()
+
+
+def parse_grade(text):
+    """Returns an int or float grade from a string or bytes"""
+    # Checking for digits is much cheaper than letting int() fail on grades with decimals
+    if text.isdigit():
+        return int(text)
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def accumulate_file_chunk(path, start, end):
+    """Returns a GradeAccumulator of the grades on the lines of a file that start from byte start up to byte end.
+    Each line is a grade, or comma-separated fields ending in a grade such as name,grade."""
+    with open(path, "rb") as grade_file:
+        # Case where the chunk starts partway through a line, which belongs to the chunk before
+        if start > 0:
+            grade_file.seek(start - 1)
+            grade_file.readline()
+        data = b""
+        if grade_file.tell() < end:
+            data = grade_file.read(end - grade_file.tell())
+            # Case where the chunk ends partway through a line, which belongs to this chunk
+            if not data.endswith(b"\n"):
+                data += grade_file.readline()
+
+    if b"," in data:
+        fields = [line.rsplit(b",", 1)[-1].strip() for line in data.splitlines()]
+    else:
+        fields = data.split()
+
+    # The distinct strings are counted first, in the order they are first seen, so each is only parsed once
+    accumulator = GradeAccumulator()
+    for text, count in Counter(fields).items():
+        if text:
+            try:
+                accumulator.add(parse_grade(text), count)
+            except ValueError:
+                raise ValueError("not a grade in " + str(path) + ": " + repr(text.decode(errors="replace")))
+    return accumulator
+
+
+def accumulate_chunk(chunk):
+    """Returns a GradeAccumulator of a (path, start, end) file chunk or of an iterable of Students or grades"""
+    if isinstance(chunk, tuple) and len(chunk) == 3 and isinstance(chunk[0], (str, bytes, os.PathLike)):
+        return accumulate_file_chunk(*chunk)
+    return GradeAccumulator(chunk)
+
+
+def get_chunks(paths_or_iterables, chunk_bytes=CHUNK_BYTES):
+    """Yields (path, start, end) for pieces of each file path and the iterables as they are"""
+    for path_or_iterable in paths_or_iterables:
+        if isinstance(path_or_iterable, (str, bytes, os.PathLike)):
+            size = os.path.getsize(path_or_iterable)
+            for start in range(0, max(size, 1), chunk_bytes):
+                yield path_or_iterable, start, min(start + chunk_bytes, size)
+        else:
+            yield path_or_iterable
+
+
+def accumulate_parallel(paths_or_iterables, workers=None, chunk_bytes=CHUNK_BYTES):
+    """Returns a GradeAccumulator of every grade in the given files and iterables, accumulating pieces of them in a
+    pool of workers processes (one per CPU by default). Files are split into pieces of about chunk_bytes. Iterables
+    are sent to the workers, so they must be picklable, such as lists."""
+    accumulator = GradeAccumulator()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Pieces are merged in order so the result is the same as accumulating everything in one process
+        for chunk_accumulator in executor.map(accumulate_chunk, get_chunks(paths_or_iterables, chunk_bytes)):
+            accumulator.merge(chunk_accumulator)
+    return accumulator
 
-    # iterate through list_of_students, appending each student's grade to grades list
-    for student in list_of_students:
-        grades.append(student.get_grade())
 
-    # return a tuple containing the mean, median, and mode of grades list
-    return mean(grades), median(grades), mode(grades)
+def basic_stats_parallel(paths_or_iterables, workers=None):
+    """Takes file paths and iterables of Students or grades and returns a tuple containing the mean, median, and mode
+    of all their grades, working on pieces of them in parallel. A file has a grade on each line, or comma-separated
+    fields ending in a grade. The results are exact and the same as basic_stats would give for all the grades in
+    order."""
+    accumulator = accumulate_parallel(paths_or_iterables, workers)
+    return accumulator.get_mean(), accumulator.get_median(), accumulator.get_mode()
 
 
 def main():
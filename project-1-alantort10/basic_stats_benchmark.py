@@ -0,0 +1,77 @@
+# Author: Alan Tort
+# Date: 07/02/2021
+# Description: Benchmarks basic_stats against the original statistics module version
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from statistics import mean, median, mode
+from basic_stats import Student, StudentRoster, basic_stats, basic_stats_parallel
+
+
+def original_basic_stats(list_of_students):
+    """The original basic_stats, which copies the grades into a list for the statistics module"""
+    grades = list()
+    for student in list_of_students:
+        grades.append(student.get_grade())
+    return mean(grades), median(grades), mode(grades)
+
+
+def time_call(function, argument):
+    """Returns the result of calling function with argument and how many seconds it took"""
+    start = time.perf_counter()
+    result = function(argument)
+    return result, time.perf_counter() - start
+
+
+def compare_parallel(grades, file_count, expected):
+    """Splits the grades into file_count files and times basic_stats_parallel on them with more and more workers"""
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for number in range(file_count):
+            paths.append(os.path.join(directory, "grades" + str(number) + ".txt"))
+            file_grades = grades[number * len(grades) // file_count:(number + 1) * len(grades) // file_count]
+            with open(paths[-1], "w") as grade_file:
+                grade_file.write("".join(str(grade) + "\n" for grade in file_grades))
+
+        for workers in (1, 2, 4, 8):
+            result, elapsed = time_call(lambda paths: basic_stats_parallel(paths, workers), paths)
+            print("basic_stats_parallel with", workers, "workers:", round(elapsed, 3), "seconds,",
+                  "same results" if result == expected else "DIFFERENT RESULTS " + repr(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times basic_stats on generated grades")
+    parser.add_argument("--students", type=int, default=5000000)
+    parser.add_argument("--floats", action="store_true", help="use grades with halves instead of whole numbers")
+    parser.add_argument("--distinct", action="store_true",
+                        help="use float grades that are almost all different, such as 73.40518")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--files", type=int, default=0, help="also time basic_stats_parallel on this many files")
+    args = parser.parse_args()
+
+    random_generator = random.Random(args.seed)
+    if args.distinct:
+        grades = [random_generator.random() * 100 for number in range(args.students)]
+    elif args.floats:
+        grades = [random_generator.randrange(201) / 2 for number in range(args.students)]
+    else:
+        grades = [random_generator.randrange(101) for number in range(args.students)]
+    students = [Student("Student " + str(number), grade) for number, grade in enumerate(grades)]
+    roster = StudentRoster(students)
+
+    expected, original_time = time_call(original_basic_stats, students)
+    print("statistics module:", round(original_time, 3), "seconds")
+    for name, function, argument in (("GradeAccumulator", basic_stats, students),
+                                     ("StudentRoster", basic_stats, roster)):
+        result, elapsed = time_call(function, argument)
+        print(name + ":", round(elapsed, 3), "seconds,", round(original_time / elapsed, 1), "times faster,",
+              "same results" if result == expected else "DIFFERENT RESULTS " + repr(result))
+    if args.files:
+        compare_parallel(grades, args.files, expected)
+
+
+if __name__ == "__main__":
+    main()
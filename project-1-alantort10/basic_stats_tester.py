@@ -0,0 +1,210 @@
+# Author: Alan Tort
+# Date: 06/19/2021
+# Description: Unit testing for basic_stats.py
+
+import os
+import random
+import statistics
+import tempfile
+import unittest
+from basic_stats import Student
+from basic_stats import StudentRoster
+from basic_stats import GradeAccumulator
+from basic_stats import GroupedStats
+from basic_stats import accumulate_parallel
+from basic_stats import basic_stats
+from basic_stats import basic_stats_parallel
+from basic_stats import grouped_basic_stats
+
+
+class test_basic_stats(unittest.TestCase):
+
+    def test_basic_stats(self):
+        """Testing that basic_stats gives the same results as the statistics module"""
+        generator = random.Random(162)
+        grade_lists = [[73, 74, 78, 74],
+                       [5],
+                       [7, 7.0, 8, 8, 7.5],
+                       [generator.randrange(101) for number in range(1000)],
+                       [generator.randrange(201) / 2 for number in range(1000)],
+                       [generator.random() * 100 for number in range(1000)]]
+        for grades in grade_lists:
+            expected = (statistics.mean(grades), statistics.median(grades), statistics.mode(grades))
+            self.assertEqual(basic_stats([Student("Name", grade) for grade in grades]), expected)
+            self.assertEqual(basic_stats(grade for grade in grades), expected)  # a generator is read once
+
+    def test_grade_accumulator(self):
+        """Testing that a GradeAccumulator keeps up with grades being added and removed between results"""
+        generator = random.Random(162)
+        accumulator = GradeAccumulator()
+        grades = []
+        for round_number in range(50):
+            for number in range(generator.randrange(1, 20)):
+                grade = generator.choice([generator.randrange(10), generator.random() * 10])
+                accumulator.add(Student("Name", grade))
+                grades.append(grade)
+            for number in range(min(generator.randrange(5), len(grades) - 1)):
+                grade = grades.pop(generator.randrange(len(grades)))
+                accumulator.remove(grade)
+            self.assertEqual(accumulator.get_count(), len(grades))
+            self.assertEqual(accumulator.get_mean(), statistics.mean(grades))
+            self.assertEqual(accumulator.get_median(), statistics.median(grades))
+            # after removals, a tie for the mode can go to a different grade than statistics.mode picks
+            self.assertIn(accumulator.get_mode(), statistics.multimode(grades))
+
+        self.assertRaises(ValueError, accumulator.remove, 11)
+        self.assertRaises(statistics.StatisticsError, GradeAccumulator().get_median)
+        self.assertRaises(statistics.StatisticsError, GradeAccumulator().get_mean)
+
+    def test_grade_accumulator_differences(self):
+        """Testing the two ways a GradeAccumulator's results differ from the statistics module's"""
+        # equal int and float grades are one grade, in the form seen first
+        accumulator = GradeAccumulator([7, 7.0])
+        self.assertEqual(statistics.mean([7, 7.0]), 7.0)
+        self.assertIs(type(accumulator.get_mean()), int)
+        self.assertEqual(accumulator.get_mean(), 7)
+        self.assertIs(type(GradeAccumulator([7.0, 7]).get_mean()), float)
+
+        # a tie for the mode goes to the grade seen first among every grade added, including removed ones
+        accumulator = GradeAccumulator([80, 90, 80])
+        accumulator.remove(80)
+        self.assertEqual(accumulator.get_mode(), 80)
+        self.assertEqual(statistics.mode([90, 80]), 90)
+        accumulator.remove(80)
+        accumulator.add(80)
+        self.assertEqual(accumulator.get_mode(), 90)  # none of it was left, so 80 is now seen after 90
+
+    def test_student_roster(self):
+        """Testing that a StudentRoster gives the same results as a list of the same Students"""
+        generator = random.Random(162)
+        grade_lists = [[73, 74, 78, 74],
+                       [5],
+                       [4, 2, 3, 1],
+                       [-3, 0, -3, 9, 9],
+                       [7, 7.0, 8, 8, 7.5],
+                       [2 ** 62, 2 ** 62, 3],
+                       [-2 ** 63, 2 ** 63 - 1, 2 ** 63 - 1],
+                       [0, 2 ** 40, 5, 2 ** 40],
+                       [generator.randrange(101) for number in range(1000)],
+                       [generator.randrange(201) / 2 for number in range(1000)],
+                       [generator.random() * 100 for number in range(1000)],
+                       [generator.random() * 10 ** generator.randrange(-20, 20) for number in range(1000)]]
+        for grades in grade_lists:
+            students = [Student("Name " + str(number), grade) for number, grade in enumerate(grades)]
+            roster = StudentRoster(students)
+            self.assertEqual(len(roster), len(grades))
+            self.assertEqual(list(roster.get_grades()), grades)
+            self.assertEqual([student.get_name() for student in roster], roster.get_names())
+            result = basic_stats(roster)
+            self.assertEqual(result, basic_stats(students))
+            self.assertEqual(result, (statistics.mean(grades), statistics.median(grades), statistics.mode(grades)))
+            if roster.get_grades().typecode == "q":  # mixed grades are all stored as floats
+                self.assertEqual([type(value) for value in result], [type(value) for value in basic_stats(students)])
+
+    def test_merge(self):
+        """Testing that merging GradeAccumulators gives the same results as accumulating all the grades in one"""
+        generator = random.Random(162)
+        grades = [generator.choice([generator.randrange(20), generator.randrange(40) / 2]) for number in range(500)]
+        for pieces in [1, 2, 7, 50]:
+            accumulator = GradeAccumulator()
+            for piece in range(pieces):
+                accumulator.merge(GradeAccumulator(grades[piece::pieces]))
+            self.assertEqual(accumulator.get_count(), len(grades))
+            self.assertEqual(accumulator.get_mean(), statistics.mean(grades))
+            self.assertEqual(accumulator.get_median(), statistics.median(grades))
+
+        # Merged in order, the first grade seen wins a tie for the mode just as in a single list
+        first = GradeAccumulator([3, 3, 1])
+        first.merge(GradeAccumulator([1, 2, 2]))
+        self.assertEqual(first.get_mode(), statistics.mode([3, 3, 1, 1, 2, 2]))
+        self.assertEqual(first.get_median(), statistics.median([3, 3, 1, 1, 2, 2]))
+
+    def test_basic_stats_parallel(self):
+        """Testing that basic_stats_parallel gives the same results as basic_stats for files and lists"""
+        generator = random.Random(162)
+        int_grades = [generator.randrange(101) for number in range(300)]
+        float_grades = [generator.randrange(201) / 2 for number in range(300)]
+        with tempfile.TemporaryDirectory() as directory:
+            grade_path = os.path.join(directory, "grades.txt")
+            with open(grade_path, "w") as grade_file:
+                grade_file.write("\n".join(str(grade) for grade in int_grades) + "\n")
+            student_path = os.path.join(directory, "students.csv")
+            with open(student_path, "w") as student_file:
+                for number, grade in enumerate(float_grades):
+                    student_file.write("Name " + str(number) + "," + str(grade) + "\n")
+            empty_path = os.path.join(directory, "empty.txt")
+            open(empty_path, "w").close()
+
+            all_grades = int_grades + float_grades + int_grades[:50]
+            expected = basic_stats(all_grades)
+            self.assertEqual(expected, (statistics.mean(all_grades), statistics.median(all_grades),
+                                        statistics.mode(all_grades)))
+            paths_and_lists = [grade_path, student_path, empty_path, int_grades[:50]]
+            self.assertEqual(basic_stats_parallel(paths_and_lists, workers=2), expected)
+
+            # Pieces of a few bytes start and end partway through lines
+            for chunk_bytes in [1, 5, 64, 1000]:
+                accumulator = accumulate_parallel(paths_and_lists, workers=2, chunk_bytes=chunk_bytes)
+                self.assertEqual(accumulator.get_count(), len(all_grades))
+                self.assertEqual((accumulator.get_mean(), accumulator.get_median(), accumulator.get_mode()), expected)
+
+            with open(grade_path, "a") as grade_file:
+                grade_file.write("A+\n")
+            self.assertRaises(ValueError, basic_stats_parallel, [grade_path], 2)
+
+    def test_grouped_stats(self):
+        """Testing that GroupedStats gives each group and each rolled-up group the same results as the statistics
+        module, with percentiles matching statistics.quantiles"""
+        generator = random.Random(162)
+        rows = [(generator.choice(["Fall", "Spring"]), generator.choice(["CS 161", "CS 162", "CS 261"]),
+                 generator.randrange(1, 4), generator.choice([generator.randrange(101), generator.randrange(201) / 2]))
+                for number in range(600)]
+        key_functions = [lambda row: row[0], lambda row: row[1], lambda row: row[2]]
+        percentiles = [1, 10, 25, 50, 75, 90, 99]
+        grouped_stats = GroupedStats(key_functions, lambda row: row[3], rows)
+        rollups = grouped_stats.get_rollups()
+        self.assertEqual(len(rollups), len(key_functions) + 1)
+
+        for level in range(len(key_functions) + 1):
+            # The groups at each level, built straight from the rows
+            expected_groups = dict()
+            for row in rows:
+                expected_groups.setdefault(row[:level], []).append(row[3])
+            stats = grouped_stats.get_stats(level, percentiles)
+            self.assertEqual(list(rollups[level]), list(expected_groups))
+            self.assertEqual(list(grouped_stats.get_accumulators(level)), list(expected_groups))
+            self.assertEqual(list(stats), list(expected_groups))
+            for key, grades in expected_groups.items():
+                quantiles = statistics.quantiles(grades, n=100, method="inclusive")
+                self.assertEqual(stats[key]["count"], len(grades))
+                self.assertEqual(stats[key]["mean"], statistics.mean(grades))
+                self.assertEqual(stats[key]["median"], statistics.median(grades))
+                self.assertIn(stats[key]["mode"], statistics.multimode(grades))
+                self.assertEqual(stats[key]["percentiles"],
+                                 {percent: quantiles[percent - 1] for percent in percentiles})
+                self.assertEqual(rollups[level][key].get_percentile(0), min(grades))
+                self.assertEqual(rollups[level][key].get_percentile(100), max(grades))
+
+            # Ties for the mode only follow the order the grades were seen within the narrowest groups
+            if level == len(key_functions):
+                for key, grades in expected_groups.items():
+                    self.assertEqual(stats[key]["mode"], statistics.mode(grades))
+
+        self.assertEqual(grouped_basic_stats(rows, key_functions, percentiles, lambda row: row[3]),
+                         grouped_stats.get_stats(percentiles=percentiles))
+        self.assertRaises(ValueError, rollups[0][()].get_percentile, 101)
+
+    def test_grouped_stats_merge(self):
+        """Testing that merging GroupedStats gives the same groups as adding all the students to one"""
+        generator = random.Random(162)
+        students = [Student(generator.choice(["Ann", "Bo", "Cy"]), generator.randrange(101)) for number in range(300)]
+        key_functions = [Student.get_name]
+        grouped_stats = GroupedStats(key_functions, students=students[:100])
+        grouped_stats.merge(GroupedStats(key_functions, students=students[100:]))
+        expected = GroupedStats(key_functions, students=students)
+        for level in [0, 1]:
+            self.assertEqual(grouped_stats.get_stats(level, [25, 50, 75]), expected.get_stats(level, [25, 50, 75]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+# Author: Alan Tort
+# Date: 7/19/2021
+# Description: Opt-in call counts, latency histograms and outcome counts for an object's methods
+
+import functools
+import json
+import threading
+import time
+
+
+class Instrumentation:
+    """Records how an object's public methods are used: how many times each was called, a histogram of
+    how long the calls took, and how many calls ended in each outcome. A method that returns a string
+    has that string as its outcome (such as "item on hold by other patron"), one that raises has the
+    exception's name, and anything else counts as "ok". Nothing is recorded, and the object runs at full
+    speed, unless instrument has been called."""
+
+    def __init__(self):
+        """Init method"""
+        self._stats = dict()  # "Class.method" -> stats dict
+        self._instrumented = []  # (object, method names) pairs that have wrappers installed
+        self._lock = threading.Lock()
+
+    def instrument(self, target, method_names=None):
+        """Starts recording calls to the given methods of target, or to all of its public methods.
+        Wrappers are installed on the target object itself, so return values are unchanged."""
+        if method_names is None:
+            method_names = [name for name in dir(target)
+                            if not name.startswith("_") and callable(getattr(target, name))]
+        for name in method_names:
+            setattr(target, name, self._wrap(type(target).__name__ + "." + name, getattr(target, name)))
+        self._instrumented.append((target, method_names))
+
+    def uninstrument(self):
+        """Removes every wrapper so the instrumented objects call their own methods directly again"""
+        for target, method_names in self._instrumented:
+            for name in method_names:
+                delattr(target, name)
+        self._instrumented = []
+
+    def reset(self):
+        """Forgets everything recorded so far"""
+        with self._lock:
+            self._stats = dict()
+
+    def snapshot(self):
+        """Returns a dict of "Class.method" -> {"calls", "total_us", "max_us", "p50_us", "p99_us",
+        "latency_histogram", "outcomes"}. The histogram maps an upper bound in microseconds to the
+        number of calls that took less than it, and the percentiles are those bucket bounds."""
+        with self._lock:
+            stats = dict()
+            for name, method_stats in self._stats.items():
+                histogram = dict()
+                for bucket, count in sorted(method_stats["buckets"].items()):
+                    histogram[2 ** bucket] = count
+                stats[name] = {"calls": method_stats["calls"],
+                               "total_us": method_stats["total_ns"] / 1000,
+                               "max_us": method_stats["max_ns"] / 1000,
+                               "p50_us": self._get_percentile(histogram, method_stats["calls"], 0.5),
+                               "p99_us": self._get_percentile(histogram, method_stats["calls"], 0.99),
+                               "latency_histogram": histogram,
+                               "outcomes": dict(method_stats["outcomes"])}
+            return stats
+
+    def export_json(self, path):
+        """Writes the snapshot to a JSON file"""
+        with open(path, "w") as export_file:
+            json.dump(self.snapshot(), export_file, indent=2)
+
+    def _get_percentile(self, histogram, calls, fraction):
+        """Returns the upper bound of the histogram bucket holding the given fraction of calls"""
+        seen = 0
+        for upper_bound, count in histogram.items():
+            seen += count
+            if seen >= fraction * calls:
+                return upper_bound
+        return 0
+
+    def _wrap(self, name, method):
+        """Returns a wrapper for a bound method that records each call"""
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                result = method(*args, **kwargs)
+            except Exception as error:
+                self._record(name, time.perf_counter_ns() - start, type(error).__name__)
+                raise
+            if isinstance(result, str):
+                self._record(name, time.perf_counter_ns() - start, result)
+            else:
+                self._record(name, time.perf_counter_ns() - start, "ok")
+            return result
+
+        return wrapper
+
+    def _record(self, name, elapsed_ns, outcome):
+        """Adds one call to a method's stats"""
+        # calls are bucketed by powers of two microseconds
+        bucket = (elapsed_ns // 1000).bit_length()
+        with self._lock:
+            method_stats = self._stats.get(name)
+            if method_stats is None:
+                method_stats = {"calls": 0, "total_ns": 0, "max_ns": 0, "buckets": dict(), "outcomes": dict()}
+                self._stats[name] = method_stats
+            method_stats["calls"] += 1
+            method_stats["total_ns"] += elapsed_ns
+            method_stats["max_ns"] = max(method_stats["max_ns"], elapsed_ns)
+            method_stats["buckets"][bucket] = method_stats["buckets"].get(bucket, 0) + 1
+            method_stats["outcomes"][outcome] = method_stats["outcomes"].get(outcome, 0) + 1
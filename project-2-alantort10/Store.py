@@ -2,11 +2,39 @@
 # Date: 6/22/2021
 # Description: Assignment #2, An Online Store Simulator
 
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Mapping
+
+# NumPy is only needed for a columnar Store
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Store.product_search indexes every substring of this many characters, and any shorter title or description
+# whole; a shorter search looks up every indexed substring that contains it
+SEARCH_GRAM_LENGTH = 3
+
+# A Store with reservations spreads its product locks over this many locks
+LOCK_STRIPES = 1024
+
+
 class InvalidCheckoutError(Exception):
     """To be raised in a try-catch block"""
     pass
 
 
+class InsufficientStockError(InvalidCheckoutError):
+    """Raised when a checkout with reservations cannot get stock for everything in the cart"""
+    pass
+
+
 class Product:
     """Product object represents a product with an ID code, title, description, price and quantity available"""
 
@@ -38,9 +66,9 @@ class Product:
         """Gets Product's available quantity"""
         return self._quantity_available
 
-    def decrease_quantity(self):
-        """Decreases the available quantity by 1"""
-        self._quantity_available -= 1
+    def decrease_quantity(self, amount=1):
+        """Decreases the available quantity by the given amount, 1 by default"""
+        self._quantity_available -= amount
 
 
 class Customer:
@@ -52,7 +80,7 @@ class Customer:
         self._name = name
         self._customer_id = customer_id
         self._premium_member = premium_member
-        self._cart = list()
+        self._cart = dict()  # product ID -> quantity
 
     def get_name(self):
         """Gets Customer's name"""
@@ -66,12 +94,12 @@ class Customer:
         """Returns whether the customer is a premium member (True or False)"""
         return self._premium_member
 
-    def add_product_to_cart(self, product_id):
-        """Takes a product ID code and adds it to the Customer's cart"""
-        self._cart.append(product_id)
+    def add_product_to_cart(self, product_id, quantity=1):
+        """Takes a product ID code and adds the given quantity of it, 1 by default, to the Customer's cart"""
+        self._cart[product_id] = self._cart.get(product_id, 0) + quantity
 
     def get_cart(self):
-        """Gets the Customer's cart"""
+        """Gets the Customer's cart as a dictionary of product ID -> quantity"""
         return self._cart
 
     def empty_cart(self):
@@ -79,25 +107,276 @@ class Customer:
         self._cart.clear()
 
 
+class ColumnarProduct(Product):
+    """A lightweight Product view whose data lives in a ColumnarInventory"""
+
+    __slots__ = ("_columns", "_slot")
+
+    def __init__(self, columns, slot):
+        """Init method"""
+        self._columns = columns
+        self._slot = slot
+
+    def __eq__(self, other):
+        """Views of the same slot in the same inventory are equal"""
+        if not isinstance(other, ColumnarProduct):
+            return NotImplemented
+        return self._columns is other._columns and self._slot == other._slot
+
+    def __hash__(self):
+        """Hashes by inventory and slot"""
+        return hash((id(self._columns), self._slot))
+
+    def get_product_id(self):
+        """Gets Product's ID"""
+        return self._columns._ids[self._slot]
+
+    def get_title(self):
+        """Gets Product's title"""
+        return self._columns._titles[self._slot]
+
+    def get_description(self):
+        """Gets Product's description"""
+        return self._columns._descriptions[self._slot]
+
+    def get_price(self):
+        """Gets Product's price"""
+        return float(self._columns._prices[self._slot])
+
+    def get_quantity_available(self):
+        """Gets Product's available quantity"""
+        return int(self._columns._quantities[self._slot])
+
+    def decrease_quantity(self, amount=1):
+        """Decreases the available quantity by the given amount, 1 by default"""
+        self._columns._quantities[self._slot] -= amount
+
+
+class ColumnarInventory(Mapping):
+    """A mapping of product ID -> Product that keeps prices and quantities available in NumPy arrays indexed
+    by slot, so they can be totalled and filtered without a Python loop. Looking up a product returns a
+    ColumnarProduct view. Prices are stored as floats."""
+
+    def __init__(self):
+        """Init method"""
+        if numpy is None:
+            raise ImportError("a columnar Store needs NumPy")
+        self._slots = dict()  # product ID -> slot
+        self._ids = []
+        self._titles = []
+        self._descriptions = []
+        self._prices = numpy.zeros(16, dtype=numpy.float64)  # only the first len(self) slots are in use
+        self._quantities = numpy.zeros(16, dtype=numpy.int64)
+
+    def __setitem__(self, product_id, product):
+        """Copies the given Product into the inventory under the given ID"""
+        # Case where the ID is new, so every column grows by one slot
+        if product_id not in self._slots:
+            if len(self._ids) == len(self._prices):
+                self._prices = numpy.concatenate((self._prices, numpy.zeros_like(self._prices)))
+                self._quantities = numpy.concatenate((self._quantities, numpy.zeros_like(self._quantities)))
+            self._slots[product_id] = len(self._ids)
+            self._ids.append(product_id)
+            self._titles.append(None)
+            self._descriptions.append(None)
+
+        slot = self._slots[product_id]
+        self._titles[slot] = product.get_title()
+        self._descriptions[slot] = product.get_description()
+        self._prices[slot] = product.get_price()
+        self._quantities[slot] = product.get_quantity_available()
+
+    def __getitem__(self, product_id):
+        """Returns a view of the Product with the given ID"""
+        return ColumnarProduct(self, self._slots[product_id])
+
+    def __contains__(self, product_id):
+        """Returns whether a product with the given ID is in the inventory"""
+        return product_id in self._slots
+
+    def __iter__(self):
+        """Iterates over the product IDs in the order they were added"""
+        return iter(self._ids)
+
+    def __len__(self):
+        """Returns the number of products in the inventory"""
+        return len(self._ids)
+
+    def get_total_stock_value(self):
+        """Returns the total price of every product's available quantity"""
+        size = len(self._ids)
+        return float(numpy.dot(self._prices[:size], self._quantities[:size]))
+
+    def get_product_ids_below(self, threshold):
+        """Returns the IDs of products with fewer than threshold available, in the order they were added"""
+        return [self._ids[slot] for slot in numpy.flatnonzero(self._quantities[:len(self._ids)] < threshold)]
+
+    def get_cart_totals(self, carts, surcharged):
+        """Takes a list of carts (product ID -> quantity dicts) and a list of whether each one pays the 7%
+        surcharge, and returns a NumPy array of their totals"""
+        cart_sizes = []
+        slots = []
+        quantities = []
+        get_slot = self._slots.__getitem__
+        for cart in carts:
+            cart_sizes.append(len(cart))
+            slots.extend(map(get_slot, cart))
+            quantities.extend(cart.values())
+        cart_numbers = numpy.repeat(numpy.arange(len(carts)), cart_sizes)
+        weights = self._prices[slots] * numpy.array(quantities, dtype=numpy.float64)
+        totals = numpy.bincount(cart_numbers, weights=weights, minlength=len(carts))
+        return totals + totals * 0.07 * numpy.array(surcharged, dtype=numpy.float64)
+
+
 class Store:
     """Store object represents a store, which has some number of products in its inventory and some number of customers
     as members"""
 
-    def __init__(self):
-        """Init method"""
-        self._inventory = dict()
+    def __init__(self, search_cache_size=0, reservation_timeout=None, clock=time.monotonic, columnar=False,
+                 order_log=None):
+        """Init method. With a search_cache_size, the results of that many of the most recent distinct
+        searches are kept until a product that could change them is added. With a reservation_timeout in
+        seconds, adding to a cart takes the stock out of the inventory until checkout or until the timeout
+        passes, and checkouts are all-or-nothing and safe to run from several threads. A columnar Store
+        keeps prices and quantities in NumPy arrays (see ColumnarInventory), which speeds up the stock and
+        cart totals; products added to it are copied, and lookups return views of the copies. Every checkout
+        is recorded in the order_log if one is given (see StoreOrderLog.OrderLog)."""
+        self._order_log = order_log
+        self._columnar = columnar
+        if columnar:
+            self._inventory = ColumnarInventory()
+        else:
+            self._inventory = dict()
         self._membership = dict()
+        self._search_texts = dict()  # product ID -> (lowercase title, lowercase description)
+        self._search_index = dict()  # lowercase SEARCH_GRAM_LENGTH character substring -> sorted product numbers
+        self._short_search_grams = dict()  # shorter search string -> _search_index keys containing it, as a set
+        self._product_numbers = dict()  # product ID -> product number, in the order products were first added
+        self._numbered_product_ids = []  # product number -> product ID
+        self._sorted_product_ids = []  # every product ID in order, for paging through search results
+        self._new_product_ids = []  # product IDs not yet merged into _sorted_product_ids
+        self._unindexed_product_ids = []  # numbers of the products from add_products not yet in _search_index
+        self._search_cache_size = search_cache_size
+        self._search_cache = OrderedDict()  # lowercase search string -> tuple of product IDs, least recent first
+        self._search_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+        self._reservation_timeout = reservation_timeout
+        self._clock = clock
+        self._reservations = dict()  # customer ID -> product ID -> (quantity, time it expires)
+        self._reservation_expiries = []  # min-heap of (time it expires, number, customer ID, product ID)
+        self._next_reservation_number = 0
+        self._reservation_lock = threading.Lock()  # never held while waiting for a product lock
+        if reservation_timeout is not None:
+            self._product_locks = [threading.Lock() for i in range(LOCK_STRIPES)]
 
     def add_product(self, product):
         """Takes a Product and adds it to the inventory dictionary"""
-        self._inventory[product.get_product_id()] = product
+        product_id = product.get_product_id()
+
+        texts = (product.get_title().lower(), product.get_description().lower())
+        self._invalidate_search_cache(texts)
+
+        # Case where a product with the same ID is being replaced
+        if product_id in self._search_texts:
+            self.index_now()
+            self._invalidate_search_cache(self._search_texts[product_id])
+            number = self._product_numbers[product_id]
+            for gram in self._get_search_grams(self._search_texts[product_id]):
+                product_numbers = self._search_index[gram]
+                del product_numbers[bisect_left(product_numbers, number)]
+                if not product_numbers:
+                    del self._search_index[gram]
+                    for short_search in self._get_short_searches(gram):
+                        del self._short_search_grams[short_search][gram]
+                        if not self._short_search_grams[short_search]:
+                            del self._short_search_grams[short_search]
+        else:
+            number = self._add_product_number(product_id)
+
+        self._inventory[product_id] = product
+        self._search_texts[product_id] = texts
+        for gram in self._get_search_grams(texts):
+            product_numbers = self._search_index.get(gram)
+            if product_numbers is None:
+                self._search_index[gram] = array("i", [number])
+                self._add_short_searches(gram)
+            # Case where the product is new, so its number is the highest and goes on the end
+            elif number > product_numbers[-1]:
+                product_numbers.append(number)
+            else:
+                product_numbers.insert(bisect_left(product_numbers, number), number)
         return "product added to Store inventory"
 
+    def add_products(self, products):
+        """Takes an iterable of Products and adds them all to the inventory, returning how many were added.
+        Much faster than calling add_product for each one when loading a large catalog, since the new
+        products are added to the search index all at once, by index_now. If index_now is not called, the
+        next search calls it and waits for the whole catalog to be indexed."""
+        inventory = self._inventory
+        search_texts = self._search_texts
+        unindexed_product_ids = self._unindexed_product_ids
+        count = 0
+        for product in products:
+            product_id = product.get_product_id()
+
+            # Case where a product is being replaced, which add_product already handles
+            if product_id in search_texts:
+                self.add_product(product)
+                count += 1
+                continue
+
+            # The texts come first so a product whose title or description isn't text is never half added
+            texts = (product.get_title().lower(), product.get_description().lower())
+            inventory[product_id] = product
+            search_texts[product_id] = texts
+            unindexed_product_ids.append(self._add_product_number(product_id))
+            count += 1
+
+        # Any cached search may be missing the new products
+        if self._search_cache:
+            self._search_cache_stats["invalidations"] += len(self._search_cache)
+            self._search_cache.clear()
+        return count
+
+    def index_now(self):
+        """Adds the products from add_products that are not yet in the search index. Call it once a bulk
+        load is done so the first search doesn't have to."""
+        if not self._unindexed_product_ids:
+            return
+        grams = dict()  # gram -> list of the new product numbers containing it, in order
+        numbered_product_ids = self._numbered_product_ids
+        search_texts = self._search_texts
+        for number in self._unindexed_product_ids:
+            for gram in self._get_search_grams(search_texts[numbered_product_ids[number]]):
+                gram_numbers = grams.get(gram)
+                if gram_numbers is None:
+                    grams[gram] = [number]
+                else:
+                    gram_numbers.append(number)
+        self._unindexed_product_ids = []
+
+        # The new products have the highest numbers, so they go on the end of each sorted list
+        for gram, gram_numbers in grams.items():
+            if gram in self._search_index:
+                self._search_index[gram].extend(gram_numbers)
+            else:
+                self._search_index[gram] = array("i", gram_numbers)
+                self._add_short_searches(gram)
+
     def add_member(self, customer):
         """Takes a Customer and adds it to the membership"""
         self._membership[customer.get_customer_id()] = customer
         return "member added to Store membership"
 
+    def add_members(self, customers):
+        """Takes an iterable of Customers and adds them all to the membership, returning how many were added"""
+        membership = self._membership
+        count = 0
+        for customer in customers:
+            membership[customer.get_customer_id()] = customer
+            count += 1
+        return count
+
     def lookup_product_from_id(self, product_id):
         """Takes a Product ID and returns the Product with the matching ID. If no matching ID is found in the inventory,
         it returns the special value None"""
@@ -118,17 +397,226 @@ class Store:
         """Takes a search string and returns a lexicographically sorted list of ID codes for every product in the
         inventory whose title or description contains the search string. The search should be case-insensitive. The
         list of codes should not contain duplicates. If the search string is not found, returns an empty list"""
-        id_codes = list()
-        for item in self._inventory:
-            title = self._inventory[item].get_title()
-            description = self._inventory[item].get_description()
-            if search.lower() in title.lower() or search.lower() in description.lower():
-                id_codes.append(item)
-        return sorted(id_codes)
-
-    def add_product_to_member_cart(self, product_id, customer_id):
-        """Takes a Product ID and a Customer ID and adds the Product corresponding to the Product ID to the Customer's
-        cart. There must be at least one of each product added to be added to the customer's cart"""
+        search = search.lower()
+        if self._search_cache_size <= 0:
+            return sorted(self._find_matches(search))
+
+        # Case where the results are cached; callers get their own copy so the cache can't be changed
+        if search in self._search_cache:
+            self._search_cache.move_to_end(search)
+            self._search_cache_stats["hits"] += 1
+            return list(self._search_cache[search])
+
+        self._search_cache_stats["misses"] += 1
+        id_codes = sorted(self._find_matches(search))
+        self._search_cache[search] = tuple(id_codes)
+        if len(self._search_cache) > self._search_cache_size:
+            self._search_cache.popitem(last=False)
+            self._search_cache_stats["evictions"] += 1
+        return id_codes
+
+    def product_search_page(self, search, limit, after=None):
+        """Takes a search string, a page size and optionally the last ID code of the previous page, and returns
+        the next limit ID codes that product_search would list after that one, without finding and sorting
+        every match"""
+        search = search.lower()
+        if limit <= 0:
+            return []
+        sorted_ids = self._get_sorted_product_ids()
+        if search:
+            postings, exact = self._get_postings(search)
+            match_count = sum(map(len, postings))  # at most this many, since the lists can share products
+        else:
+            match_count = len(sorted_ids)
+
+        # Case where matches are common: walk the IDs in order from the previous page, which finds limit
+        # matches quickly without looking at the rest
+        if match_count * match_count >= limit * len(sorted_ids):
+            page = []
+            position = 0
+            if after is not None:
+                position = bisect_right(sorted_ids, after)
+            while position < len(sorted_ids) and len(page) < limit:
+                product_id = sorted_ids[position]
+                if self._is_match(product_id, search):
+                    page.append(product_id)
+                position += 1
+            return page
+
+        # Case where matches are rare: go through the index's lists and keep only the smallest limit of them
+        if len(postings) == 1:
+            numbers = postings[0]
+        else:
+            numbers = set().union(*postings)
+        product_ids = map(self._numbered_product_ids.__getitem__, numbers)
+        if after is not None:
+            product_ids = (product_id for product_id in product_ids if product_id > after)
+        if not exact:
+            product_ids = (product_id for product_id in product_ids if self._is_match(product_id, search))
+        return heapq.nsmallest(limit, product_ids)
+
+    def iter_product_search(self, search, page_size=100):
+        """Takes a search string and lazily yields the ID codes product_search would return, a page at a time"""
+        after = None
+        while True:
+            page = self.product_search_page(search, page_size, after)
+            for product_id in page:
+                yield product_id
+            if len(page) < page_size:
+                return
+            after = page[-1]
+
+    def get_search_cache_stats(self):
+        """Returns a dict of the search cache's hits, misses, evictions, invalidations and current size"""
+        stats = dict(self._search_cache_stats)
+        stats["size"] = len(self._search_cache)
+        return stats
+
+    def _invalidate_search_cache(self, texts):
+        """Drops cached searches found in any of the given lowercase texts, since their results change when
+        a product with those texts is added or replaced"""
+        for search in list(self._search_cache):
+            for text in texts:
+                if search in text:
+                    del self._search_cache[search]
+                    self._search_cache_stats["invalidations"] += 1
+                    break
+
+    def _add_product_number(self, product_id):
+        """Gives a new product the next product number and returns it"""
+        number = len(self._numbered_product_ids)
+        self._product_numbers[product_id] = number
+        self._numbered_product_ids.append(product_id)
+        self._new_product_ids.append(product_id)
+        return number
+
+    def _add_short_searches(self, gram):
+        """Records a new _search_index key under every shorter search string it contains"""
+        for short_search in self._get_short_searches(gram):
+            grams = self._short_search_grams.get(short_search)
+            if grams is None:
+                self._short_search_grams[short_search] = {gram: None}
+            else:
+                grams[gram] = None
+
+    def _find_matches(self, search):
+        """Takes a lowercase search string and returns a set of the IDs of products whose lowercase title or
+        description contains it"""
+        candidates, exact = self._find_candidates(search)
+        if exact:
+            return set(candidates)
+        return {product_id for product_id in candidates if self._is_match(product_id, search)}
+
+    def _find_candidates(self, search):
+        """Takes a lowercase search string and returns a collection of product IDs that includes every match,
+        along with whether every one of them is known to match. The collection must not be changed."""
+        # Case where the empty string is in every title
+        if not search:
+            return self._inventory, True
+
+        # Case where a short search is in so many products that checking every product is quicker
+        postings, exact = self._get_postings(search)
+        if len(postings) > 1 and sum(map(len, postings)) >= len(self._search_texts):
+            return {product_id for product_id in self._search_texts if self._is_match(product_id, search)}, True
+
+        if len(postings) == 1:
+            numbers = postings[0]
+        else:
+            numbers = set().union(*postings)
+        return set(map(self._numbered_product_ids.__getitem__, numbers)), exact
+
+    def _get_postings(self, search):
+        """Takes a non-empty lowercase search string and returns a list of sorted arrays of product numbers from
+        the search index that between them hold every match, along with whether every product in them is known
+        to match. A search shorter than the indexed substrings gets the arrays of every indexed substring
+        containing it, which all match. A longer one gets the array of its rarest piece, since only products
+        containing every piece can match, and they all match when the search is a single piece."""
+        self.index_now()
+        if len(search) < SEARCH_GRAM_LENGTH:
+            return [self._search_index[gram] for gram in self._short_search_grams.get(search, ())], True
+
+        rarest = None
+        for start in range(len(search) - SEARCH_GRAM_LENGTH + 1):
+            product_numbers = self._search_index.get(search[start:start + SEARCH_GRAM_LENGTH], ())
+            if rarest is None or len(product_numbers) < len(rarest):
+                rarest = product_numbers
+        return [rarest], len(search) == SEARCH_GRAM_LENGTH
+
+    def _is_match(self, product_id, search):
+        """Returns whether a product's lowercase title or description contains the lowercase search string"""
+        title, description = self._search_texts[product_id]
+        return search in title or search in description
+
+    def _get_sorted_product_ids(self):
+        """Returns every product ID in sorted order, merging in any new ones first"""
+        if self._new_product_ids:
+            self._sorted_product_ids.extend(self._new_product_ids)
+            self._sorted_product_ids.sort()
+            self._new_product_ids = []
+        return self._sorted_product_ids
+
+    def _get_search_grams(self, texts):
+        """Returns the set of SEARCH_GRAM_LENGTH character substrings in any of the given texts, along with any
+        non-empty text shorter than that"""
+        grams = {text[start:start + SEARCH_GRAM_LENGTH] for text in texts
+                 for start in range(len(text) - SEARCH_GRAM_LENGTH + 1)}
+        for text in texts:
+            if 0 < len(text) < SEARCH_GRAM_LENGTH:
+                grams.add(text)
+        return grams
+
+    def _get_short_searches(self, gram):
+        """Returns the set of non-empty search strings shorter than SEARCH_GRAM_LENGTH found in a search index key"""
+        return {gram[start:start + length] for length in range(1, SEARCH_GRAM_LENGTH)
+                for start in range(len(gram) - length + 1)}
+
+    def get_total_stock_value(self):
+        """Returns the total price of every product's available quantity"""
+        if self._columnar:
+            return self._inventory.get_total_stock_value()
+        total = 0
+        for product in self._inventory.values():
+            total += product.get_price() * product.get_quantity_available()
+        return total
+
+    def get_products_below(self, threshold):
+        """Returns the IDs of products with fewer than threshold available, in the order they were added"""
+        if self._columnar:
+            return self._inventory.get_product_ids_below(threshold)
+        return [product_id for product_id, product in self._inventory.items()
+                if product.get_quantity_available() < threshold]
+
+    def get_cart_totals(self, customer_ids):
+        """Takes a list of customer IDs and returns a list of what each member's whole cart costs at current
+        prices, including the 7% charge for non-members, without checking out. Raises InvalidCheckoutError
+        if an ID does not match a member."""
+        carts = []
+        surcharged = []
+        for customer_id in customer_ids:
+            if customer_id not in self._membership:
+                raise InvalidCheckoutError
+            member = self._membership[customer_id]
+            carts.append(member.get_cart())
+            surcharged.append(member.is_premium_member() is False)
+
+        if self._columnar:
+            return self._inventory.get_cart_totals(carts, surcharged).tolist()
+        totals = []
+        for cart, is_surcharged in zip(carts, surcharged):
+            charge = 0
+            for product_id, quantity in cart.items():
+                charge += self._inventory[product_id].get_price() * quantity
+            if is_surcharged:
+                charge += (charge * 0.07)
+            totals.append(charge)
+        return totals
+
+    def add_product_to_member_cart(self, product_id, customer_id, quantity=1):
+        """Takes a Product ID, a Customer ID and optionally a quantity, and adds that many of the Product corresponding
+        to the Product ID to the Customer's cart. There must be at least one of each product added to be added to the
+        customer's cart. Raises ValueError if the quantity is not a whole number of at least 1."""
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+            raise ValueError("quantity must be a whole number of at least 1, not " + repr(quantity))
 
         if product_id not in self._inventory:
             return "product id not found"
@@ -136,8 +624,12 @@ class Store:
         if customer_id not in self._membership:
             return "member id not found"
 
+        # Case where the stock is reserved for the cart
+        if self._reservation_timeout is not None:
+            return self._reserve(product_id, customer_id, quantity)
+
         if self._inventory[product_id].get_quantity_available() > 0:
-            self._membership[customer_id].add_product_to_cart(product_id)
+            self._membership[customer_id].add_product_to_cart(product_id, quantity)
             return "product added to cart"
         else:
             return "product out of stock"
@@ -148,21 +640,154 @@ class Store:
         if customer_id not in self._membership:
             raise InvalidCheckoutError
 
+        # Case where the cart's stock is already reserved
+        if self._reservation_timeout is not None:
+            return self._check_out_reserved(customer_id)
+
         charge = 0
         member = self._membership[customer_id]
+        order = dict()  # product ID -> quantity bought
 
-        for item in member.get_cart():
+        # Each product is bought as many times as it is in the cart, or until it runs out of stock
+        for item, quantity in member.get_cart().items():
             product = self._inventory[item]
-            if product.get_quantity_available() > 0:
-                charge += product.get_price()
-                product.decrease_quantity()
+            purchased = min(quantity, product.get_quantity_available())
+            if purchased > 0:
+                # Float prices times a quantity can differ in the last bit from adding the price once per unit
+                charge += product.get_price() * purchased
+                order[item] = purchased
 
         if member.is_premium_member() is False:
             charge += (charge * 0.07)
 
+        # The order is logged before any stock is taken, so an order log that has failed changes nothing
+        if self._order_log is not None:
+            self._order_log.record(customer_id, order, charge, member.is_premium_member())
+        for item, purchased in order.items():
+            self._inventory[item].decrease_quantity(purchased)
         member.empty_cart()
         return charge
 
+    def release_expired_reservations(self):
+        """Puts the stock of reservations whose time has run out back into the inventory. The products stay
+        in the customers' carts and checkout tries to get their stock again. Returns how many reservations
+        were released."""
+        now = self._clock()
+        released = []
+        with self._reservation_lock:
+            while self._reservation_expiries and self._reservation_expiries[0][0] <= now:
+                expires_at, number, customer_id, product_id = heapq.heappop(self._reservation_expiries)
+                customer_reservations = self._reservations.get(customer_id, dict())
+
+                # Case where the reservation was checked out, or was added to and now expires later
+                if product_id not in customer_reservations or customer_reservations[product_id][1] != expires_at:
+                    continue
+
+                released.append((product_id, customer_reservations.pop(product_id)[0]))
+                if not customer_reservations:
+                    del self._reservations[customer_id]
+
+        for product_id, quantity in released:
+            with self._get_product_lock(product_id):
+                self._inventory[product_id].decrease_quantity(-quantity)
+        return len(released)
+
+    def _reserve(self, product_id, customer_id, quantity):
+        """Takes stock out of the inventory for a member's cart and returns the add_product_to_member_cart result"""
+        self.release_expired_reservations()
+        product = self._inventory[product_id]
+        with self._get_product_lock(product_id):
+            if product.get_quantity_available() < quantity:
+                return "product out of stock"
+            product.decrease_quantity(quantity)
+
+        # Adding to an existing reservation restarts its timeout
+        expires_at = self._clock() + self._reservation_timeout
+        with self._reservation_lock:
+            customer_reservations = self._reservations.setdefault(customer_id, dict())
+            reserved = customer_reservations.get(product_id, (0, 0))[0]
+            customer_reservations[product_id] = (reserved + quantity, expires_at)
+            heapq.heappush(self._reservation_expiries,
+                           (expires_at, self._next_reservation_number, customer_id, product_id))
+            self._next_reservation_number += 1
+            self._membership[customer_id].add_product_to_cart(product_id, quantity)
+        return "product added to cart"
+
+    def _check_out_reserved(self, customer_id):
+        """Checks out a member whose cart has reserved stock. Either everything in the cart is bought or, if
+        stock for an expired reservation is gone, nothing is and InsufficientStockError is raised."""
+        self.release_expired_reservations()
+        member = self._membership[customer_id]
+
+        # The cart is taken out along with its reservations, so a second checkout of the same cart at the
+        # same time finds it empty instead of buying it again
+        with self._reservation_lock:
+            reservations = self._reservations.pop(customer_id, dict())
+            cart = dict(member.get_cart())
+            member.empty_cart()
+
+        # Cart products whose reservations expired need their stock taken again
+        shortfalls = dict()
+        for product_id, quantity in cart.items():
+            reserved = reservations.get(product_id, (0, 0))[0]
+            if quantity > reserved:
+                shortfalls[product_id] = quantity - reserved
+
+        charge = 0
+        for product_id, quantity in cart.items():
+            charge += self._inventory[product_id].get_price() * quantity
+        if member.is_premium_member() is False:
+            charge += (charge * 0.07)
+
+        # Lock every product involved, in a fixed order, so the stock check and update happen together
+        log_error = None
+        stripes = sorted({hash(product_id) % LOCK_STRIPES for product_id in shortfalls})
+        for stripe in stripes:
+            self._product_locks[stripe].acquire()
+        try:
+            in_stock = True
+            for product_id, quantity in shortfalls.items():
+                if self._inventory[product_id].get_quantity_available() < quantity:
+                    in_stock = False
+
+            # The order is logged before any stock is taken, so an order log that has failed changes nothing
+            if in_stock and self._order_log is not None:
+                try:
+                    self._order_log.record(customer_id, cart, charge, member.is_premium_member())
+                except Exception as error:
+                    log_error = error
+            if in_stock and log_error is None:
+                for product_id, quantity in shortfalls.items():
+                    self._inventory[product_id].decrease_quantity(quantity)
+        finally:
+            for stripe in reversed(stripes):
+                self._product_locks[stripe].release()
+
+        # Case where something can't be bought or logged, so the live reservations and the cart go back
+        if not in_stock or log_error is not None:
+            with self._reservation_lock:
+                for product_id, quantity in cart.items():
+                    member.add_product_to_cart(product_id, quantity)
+                for product_id, reservation in reservations.items():
+                    customer_reservations = self._reservations.setdefault(customer_id, dict())
+                    # the customer may have reserved more of it since, which expires later
+                    if product_id in customer_reservations:
+                        reservation = (reservation[0] + customer_reservations[product_id][0],
+                                       customer_reservations[product_id][1])
+                    customer_reservations[product_id] = reservation
+                    # its earlier heap entry may have been skipped while it was out of _reservations
+                    heapq.heappush(self._reservation_expiries,
+                                   (reservation[1], self._next_reservation_number, customer_id, product_id))
+                    self._next_reservation_number += 1
+            if log_error is not None:
+                raise log_error
+            raise InsufficientStockError("not enough stock for the cart of " + repr(customer_id))
+        return charge
+
+    def _get_product_lock(self, product_id):
+        """Returns the lock guarding a product's stock in a Store with reservations"""
+        return self._product_locks[hash(product_id) % LOCK_STRIPES]
+
 
 def main():
     p1 = Product("BCA", "Xbox Series X", "console", 500, 2)  # Creates a product
@@ -0,0 +1,71 @@
+# Author: Alan Tort
+# Date: 8/2/2021
+# Description: Benchmarks for Store.py
+
+import argparse
+import threading
+import time
+from Store import Product
+from Store import Customer
+from Store import Store
+from Store import InsufficientStockError
+
+
+def make_contended_store(product_count, stock, customer_count):
+    """Returns a Store with reservations whose few products are wanted by many customers"""
+    myStore = Store(reservation_timeout=60)
+    for number in range(product_count):
+        myStore.add_product(Product(number, "Product " + str(number), "contended product", 10, stock))
+    for number in range(customer_count):
+        myStore.add_member(Customer("Customer " + str(number), number, number % 2 == 0))
+    return myStore
+
+
+def run_contention(thread_count, product_count, stock, operations_per_thread):
+    """Has thread_count threads add to carts and check out against the same few products. Returns the
+    operations per second and whether more stock was sold than there was."""
+    myStore = make_contended_store(product_count, stock, thread_count)
+    sold = [0] * thread_count
+
+    def shop(customer_id):
+        for operation in range(operations_per_thread):
+            product_id = (customer_id + operation) % product_count
+            if myStore.add_product_to_member_cart(product_id, customer_id) == "product added to cart":
+                try:
+                    myStore.check_out_member(customer_id)
+                    sold[customer_id] += 1
+                except InsufficientStockError:
+                    pass
+
+    threads = [threading.Thread(target=shop, args=(customer_id,)) for customer_id in range(thread_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    remaining = 0
+    for product_id in range(product_count):
+        remaining += myStore.lookup_product_from_id(product_id).get_quantity_available()
+    oversold = remaining < 0 or sum(sold) + remaining != product_count * stock
+    return thread_count * operations_per_thread / elapsed, oversold
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks concurrent checkouts of a Store with reservations")
+    parser.add_argument("--products", type=int, default=10)
+    parser.add_argument("--stock", type=int, default=20000)
+    parser.add_argument("--operations-per-thread", type=int, default=20000)
+    args = parser.parse_args()
+
+    # Threads share the interpreter lock, so this measures lock overhead and correctness more than scaling
+    for thread_count in (1, 2, 4, 8):
+        operations_per_second, oversold = run_contention(thread_count, args.products, args.stock,
+                                                         args.operations_per_thread)
+        print(thread_count, "threads:", round(operations_per_second), "operations/sec,",
+              "oversold" if oversold else "no overselling")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Author: Alan Tort
+# Date: 8/9/2021
+# Description: A client and load generator for StoreServer
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from StoreServer import LINE_LIMIT
+
+
+class StoreServerError(Exception):
+    """Raised when the server answers a request with an error. Has the name of the error raised on the
+    server and its message."""
+
+    def __init__(self, error_name, message):
+        """Init method"""
+        super().__init__(error_name + ": " + message)
+        self.error_name = error_name
+
+
+class StoreClient:
+    """A connection to a StoreServer. Its methods send one request and wait for the response."""
+
+    def __init__(self, reader, writer):
+        """Init method. Use connect to open a connection."""
+        self._reader = reader
+        self._writer = writer
+        self._next_request_id = 0
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8462, path=None):
+        """Returns a client connected to the server at host and port, or at the Unix socket path"""
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path, limit=LINE_LIMIT)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+        return cls(reader, writer)
+
+    async def close(self):
+        """Closes the connection"""
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def call(self, method, *params):
+        """Sends a request and returns its result, raising StoreServerError if the server sent an error"""
+        self._next_request_id += 1
+        request = {"id": self._next_request_id, "method": method, "params": params}
+        self._writer.write(json.dumps(request).encode() + b"\n")
+        await self._writer.drain()
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("the server closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise StoreServerError(response["error"], response["message"])
+        return response["result"]
+
+    async def product_search(self, search):
+        """Returns the server's product_search results"""
+        return await self.call("product_search", search)
+
+    async def add_product_to_member_cart(self, product_id, customer_id, quantity=1):
+        """Returns the server's add_product_to_member_cart result"""
+        return await self.call("add_product_to_member_cart", product_id, customer_id, quantity)
+
+    async def check_out_member(self, customer_id):
+        """Returns the server's check_out_member charge"""
+        return await self.call("check_out_member", customer_id)
+
+    async def get_stats(self):
+        """Returns the server's request stats"""
+        return await self.call("stats")
+
+
+def get_percentile(sorted_values, fraction):
+    """Returns the value at the given fraction of a sorted list"""
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def run_client(connect_arguments, customer_id, request_count, mix, searches, product_count, latencies,
+                     random_generator):
+    """Sends request_count requests from one connection, adding each one's latency in seconds to latencies"""
+    client = await StoreClient.connect(*connect_arguments)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    try:
+        for kind in random_generator.choices(kinds, weights, k=request_count):
+            start = time.perf_counter()
+            if kind == "search":
+                await client.product_search(random_generator.choice(searches))
+            elif kind == "add":
+                await client.add_product_to_member_cart("P" + str(random_generator.randrange(product_count)),
+                                                        customer_id)
+            else:
+                await client.check_out_member(customer_id)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        await client.close()
+
+
+async def run_load(connect_arguments, connections, requests_per_connection, mix, searches, product_count, seed=0):
+    """Runs connections clients at once against a server and returns a dict of requests/sec and latency
+    percentiles in milliseconds, plus the server's stats"""
+    random_generator = random.Random(seed)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(connect_arguments, "C" + str(number), requests_per_connection, mix, searches,
+                                      product_count, latencies, random.Random(random_generator.random()))
+                           for number in range(connections)])
+    elapsed = time.perf_counter() - start
+
+    client = await StoreClient.connect(*connect_arguments)
+    server_stats = await client.get_stats()
+    await client.close()
+
+    latencies.sort()
+    return {"requests": len(latencies),
+            "requests_per_sec": len(latencies) / elapsed,
+            "p50_ms": get_percentile(latencies, 0.5) * 1000,
+            "p99_ms": get_percentile(latencies, 0.99) * 1000,
+            "p999_ms": get_percentile(latencies, 0.999) * 1000,
+            "max_ms": latencies[-1] * 1000 if latencies else 0,
+            "server": server_stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures a StoreServer's throughput and latency")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8462)
+    parser.add_argument("--path", help="Unix socket to connect to instead of TCP")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per connection")
+    parser.add_argument("--mix", default="search=0.6,add=0.3,checkout=0.1",
+                        help="comma-separated kind=weight pairs for search, add and checkout")
+    parser.add_argument("--products", type=int, default=10000, help="how many products the server has")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mix = dict()
+    for pair in args.mix.split(","):
+        kind, weight = pair.split("=")
+        mix[kind] = float(weight)
+    # A few popular searches, so concurrent clients often send the same one
+    searches = ["product 12", "category 7", "category 42", "duct 99", "product 500"]
+    results = asyncio.run(run_load((args.host, args.port, args.path), args.connections, args.requests, mix,
+                                   searches, args.products, args.seed))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
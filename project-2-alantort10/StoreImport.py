@@ -0,0 +1,174 @@
+# Author: Alan Tort
+# Date: 8/4/2021
+# Description: Streaming bulk import of products and members into a Store
+
+import csv
+import json
+import os
+from itertools import islice
+from Store import Product
+from Store import Customer
+
+# The fields of a product or customer row, in the order their init methods take them
+PRODUCT_FIELDS = ("product_id", "title", "description", "price", "quantity_available")
+CUSTOMER_FIELDS = ("name", "customer_id", "premium_member")
+
+PREMIUM_MEMBER_VALUES = {"true": True, "yes": True, "1": True, "false": False, "no": False, "0": False}
+
+
+def get_file_format(path, file_format=None):
+    """Returns "csv" or "jsonl" for the given file, going by its extension if no format is given"""
+    if file_format is None:
+        file_format = os.path.splitext(path)[1].lower().lstrip(".")
+        if file_format == "json":
+            file_format = "jsonl"
+    if file_format not in ("csv", "jsonl"):
+        raise ValueError("unknown import format: " + repr(file_format))
+    return file_format
+
+
+def read_rows(path, fields, file_format=None):
+    """Yields (line number, values) for each row of a CSV file with a header row or of a JSON Lines file,
+    with values in the order of fields. A row that can't be read has an error message instead of values."""
+    with open(path, newline="", encoding="utf-8") as import_file:
+        if get_file_format(path, file_format) == "csv":
+            reader = csv.reader(import_file)
+            header = next(reader, [])
+            missing = [field for field in fields if field not in header]
+            if missing:
+                raise ValueError("CSV header is missing " + ", ".join(missing))
+            columns = [header.index(field) for field in fields]
+            for row in reader:
+                if len(row) != len(header):
+                    # Case where the row is blank
+                    if not row:
+                        continue
+                    yield reader.line_num, "expected " + str(len(header)) + " columns, got " + str(len(row))
+                else:
+                    yield reader.line_num, [row[column] for column in columns]
+        else:
+            for line_number, line in enumerate(import_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    yield line_number, [record[field] for field in fields]
+                except ValueError as error:
+                    yield line_number, "invalid JSON: " + str(error)
+                except KeyError as error:
+                    yield line_number, "missing field " + str(error)
+                except TypeError:
+                    yield line_number, "expected a JSON object"
+
+
+def parse_price(value):
+    """Returns an int or float price from a CSV string or a JSON number"""
+    if type(value) is str:
+        # Checking for digits is much cheaper than letting int() fail on prices with cents
+        if value.isdigit():
+            return int(value)
+        return float(value)
+    if type(value) is not int and type(value) is not float:
+        raise ValueError("price is not a number: " + repr(value))
+    return value
+
+
+def parse_quantity(value):
+    """Returns an int quantity from a CSV string or a JSON number"""
+    if type(value) is str:
+        return int(value)
+    if type(value) is not int:
+        raise ValueError("quantity available is not a whole number: " + repr(value))
+    return value
+
+
+def is_hashable(value):
+    """Returns whether a value can be used as a product or customer ID"""
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def parse_products(rows, on_error):
+    """Takes (line number, values) rows and yields a Product for each valid one, calling
+    on_error(line number, message) for the others"""
+    for line_number, values in rows:
+        if isinstance(values, str):
+            on_error(line_number, values)
+            continue
+        product_id, title, description, price, quantity_available = values
+        if not is_hashable(product_id):
+            on_error(line_number, "product_id can't be a " + type(product_id).__name__)
+            continue
+        if type(title) is not str or type(description) is not str:
+            on_error(line_number, "title and description must be text")
+            continue
+        try:
+            price = parse_price(price)
+            quantity_available = parse_quantity(quantity_available)
+        except ValueError as error:
+            on_error(line_number, str(error))
+            continue
+        if not price >= 0 or quantity_available < 0:
+            on_error(line_number, "price and quantity available must not be negative")
+            continue
+        yield Product(product_id, title, description, price, quantity_available)
+
+
+def parse_customers(rows, on_error):
+    """Takes (line number, values) rows and yields a Customer for each valid one, calling
+    on_error(line number, message) for the others"""
+    for line_number, values in rows:
+        if isinstance(values, str):
+            on_error(line_number, values)
+            continue
+        name, customer_id, premium_member = values
+        if not is_hashable(customer_id):
+            on_error(line_number, "customer_id can't be a " + type(customer_id).__name__)
+            continue
+        if not isinstance(premium_member, bool):
+            premium_member = PREMIUM_MEMBER_VALUES.get(str(premium_member).strip().lower())
+            if premium_member is None:
+                on_error(line_number, "premium_member must be true or false, got " + repr(values[2]))
+                continue
+        yield Customer(name, customer_id, premium_member)
+
+
+def import_rows(add_all, objects, chunk_size):
+    """Passes objects to add_all chunk_size at a time and returns how many were added"""
+    imported = 0
+    while True:
+        chunk = list(islice(objects, chunk_size))
+        if not chunk:
+            return imported
+        imported += add_all(chunk)
+
+
+def import_products(store, path, file_format=None, chunk_size=10000, on_error=None, build_index=True):
+    """Streams Products from a CSV or JSON Lines file into the Store's inventory, chunk_size at a time so
+    only one chunk of rows is held in memory. Rows with errors are skipped and passed to
+    on_error(line number, message), or collected if on_error is None. The imported products are added to
+    the search index at the end, unless build_index is False, such as when several files are imported
+    one after another and Store.index_now is called after the last. Returns the number of products
+    imported and the list of collected errors."""
+    errors = []
+    if on_error is None:
+        on_error = lambda line_number, message: errors.append((line_number, message))
+    products = parse_products(read_rows(path, PRODUCT_FIELDS, file_format), on_error)
+    imported = import_rows(store.add_products, products, chunk_size)
+    if build_index:
+        store.index_now()
+    return imported, errors
+
+
+def import_members(store, path, file_format=None, chunk_size=10000, on_error=None):
+    """Streams Customers from a CSV or JSON Lines file into the Store's membership, the same way
+    import_products does for products. Returns the number of members imported and the list of collected
+    errors."""
+    errors = []
+    if on_error is None:
+        on_error = lambda line_number, message: errors.append((line_number, message))
+    customers = parse_customers(read_rows(path, CUSTOMER_FIELDS, file_format), on_error)
+    return import_rows(store.add_members, customers, chunk_size), errors
@@ -0,0 +1,255 @@
+# Author: Alan Tort
+# Date: 8/12/2021
+# Description: An append-only log of Store orders that can rebuild the inventory's quantities
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+
+def get_baseline_path(directory):
+    """Returns the path of the baseline quantities file in an order log directory"""
+    return os.path.join(directory, "baseline.json")
+
+
+def get_log_path(directory, generation):
+    """Returns the path of the log for the given generation in an order log directory"""
+    return os.path.join(directory, "orders." + str(generation) + ".log")
+
+
+def read_baseline(directory):
+    """Returns the generation and the product ID -> quantity dict of an order log's baseline"""
+    with open(get_baseline_path(directory), encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    return baseline["generation"], {product_id: quantity for product_id, quantity in baseline["quantities"]}
+
+
+def write_baseline(directory, generation, quantities):
+    """Replaces an order log's baseline, writing it under a temporary name first so a crash never leaves
+    a partial baseline"""
+    temporary_path = get_baseline_path(directory) + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as baseline_file:
+        json.dump({"generation": generation, "quantities": list(quantities.items())}, baseline_file)
+        baseline_file.flush()
+        os.fsync(baseline_file.fileno())
+    os.replace(temporary_path, get_baseline_path(directory))
+
+
+def read_orders(path):
+    """Yields each complete order event in a log file, stopping at a partly written last line"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as log_file:
+        for line in log_file:
+            # Case where the process stopped partway through writing the last event
+            if not line.endswith(b"\n"):
+                break
+            yield json.loads(line)
+
+
+def get_complete_length(path):
+    """Returns the length of a log file up to the end of its last complete line"""
+    with open(path, "rb") as log_file:
+        position = log_file.seek(0, os.SEEK_END)
+        # Read back from the end a block at a time until a newline turns up
+        while position > 0:
+            start = max(0, position - 65536)
+            log_file.seek(start)
+            newline = log_file.read(position - start).rfind(b"\n")
+            if newline != -1:
+                return start + newline + 1
+            position = start
+    return 0
+
+
+def open_log(path):
+    """Opens a log file for appending, first cutting off a partly written last line left by a crash so new
+    orders start on a line of their own"""
+    if os.path.exists(path):
+        complete_length = get_complete_length(path)
+        if complete_length < os.path.getsize(path):
+            os.truncate(path, complete_length)
+    return open(path, "a", encoding="utf-8")
+
+
+def get_generations(directory):
+    """Returns the generations of the logs in an order log directory, oldest first"""
+    generations = []
+    for file_name in os.listdir(directory):
+        if file_name.startswith("orders.") and file_name.endswith(".log"):
+            generations.append(int(file_name[len("orders."):-len(".log")]))
+    return sorted(generations)
+
+
+def replay_orders(directory, before_generation=None):
+    """Returns the product ID -> quantity dict from an order log's baseline with every logged order since
+    taken out, or only those in logs older than before_generation. Products that are not in the baseline
+    start at 0."""
+    generation, quantities = read_baseline(directory)
+    for log_generation in get_generations(directory):
+        # Case where a compaction stopped before removing a log it had already folded into the baseline
+        if log_generation < generation:
+            continue
+        if before_generation is not None and log_generation >= before_generation:
+            break
+        for order in read_orders(get_log_path(directory, log_generation)):
+            for product_id, quantity in order["products"]:
+                quantities[product_id] = quantities.get(product_id, 0) - quantity
+    return quantities
+
+
+def fold_logs(directory, generation):
+    """Writes a baseline for the given generation that includes every order in older logs, then removes
+    those logs"""
+    write_baseline(directory, generation, replay_orders(directory, generation))
+    for log_generation in get_generations(directory):
+        if log_generation < generation:
+            os.remove(get_log_path(directory, log_generation))
+
+
+def restore_inventory(store, directory):
+    """Sets the quantity available of each of the Store's products to what replaying the order log gives"""
+    for product_id, quantity in replay_orders(directory).items():
+        product = store.lookup_product_from_id(product_id)
+        if product is not None:
+            product.decrease_quantity(product.get_quantity_available() - quantity)
+
+
+class OrderLog:
+    """An append-only log of a Store's orders, kept in a directory next to a baseline of product quantities.
+    Recording an order only queues it; a background thread writes everything queued since its last write
+    as one group, with a single flush (and fsync when sync is set), so checkouts don't wait on the disk.
+    If the writer fails, its error is raised by the next call to record, flush or close.
+    Every compact_every orders, and whenever compact is called, the logged orders are folded into the
+    baseline and a new, empty log is started."""
+
+    def __init__(self, directory, initial_quantities=None, sync=False, compact_every=None):
+        """Init method. A new directory gets a baseline of initial_quantities, a product ID -> quantity dict,
+        such as the Store's quantities when logging starts."""
+        self._directory = directory
+        self._sync = sync
+        self._compact_every = compact_every
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(get_baseline_path(directory)):
+            write_baseline(directory, 0, initial_quantities or dict())
+
+        # Orders go on after the newest log, in case a compaction stopped partway through
+        generations = get_generations(directory)
+        self._generation = max(generations + [read_baseline(directory)[0]])
+        self._log = open_log(get_log_path(directory, self._generation))
+        self._orders_since_compaction = 0
+
+        self._queue = queue.SimpleQueue()
+        self._recorded = 0
+        self._written = 0
+        self._writer_error = None  # what stopped the writer thread, if anything did
+        self._count_lock = threading.Lock()
+        self._written_condition = threading.Condition()
+        self._file_lock = threading.Lock()  # held while writing or switching logs
+        self._compaction_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._run_writer, daemon=True)
+        self._writer.start()
+
+    def record(self, customer_id, products, charge, premium_member):
+        """Queues an order event: the member, a product ID -> quantity dict of what they bought, the charge
+        and whether they are a premium member"""
+        if self._writer_error is not None:
+            raise self._writer_error
+        self._queue.put({"customer_id": customer_id, "products": list(products.items()), "charge": charge,
+                         "premium_member": premium_member, "time": time.time()})
+        with self._count_lock:
+            self._recorded += 1
+
+    def flush(self):
+        """Waits until every order recorded so far has been written"""
+        with self._count_lock:
+            recorded = self._recorded
+        with self._written_condition:
+            while self._written < recorded and self._writer_error is None:
+                self._written_condition.wait()
+            if self._written < recorded:
+                raise self._writer_error
+
+    def close(self):
+        """Writes every recorded order, then stops the writer thread and closes the log"""
+        self._queue.put(None)
+        self._writer.join()
+        self._log.close()
+        if self._writer_error is not None:
+            raise self._writer_error
+
+    def compact(self):
+        """Folds every logged order into the baseline and starts a new, empty log"""
+        self.flush()
+        self._compact()
+
+    def _compact(self):
+        """Switches to the next generation's log, then writes a baseline covering the older ones"""
+        with self._compaction_lock:
+            with self._file_lock:
+                self._log.close()
+                self._generation += 1
+                self._orders_since_compaction = 0
+                self._log = open_log(get_log_path(self._directory, self._generation))
+
+            # The closed logs can be folded in while new orders go to the new one
+            fold_logs(self._directory, self._generation)
+
+    def _run_writer(self):
+        """Runs the writer thread, keeping any error that stops it and waking whoever is waiting on a flush"""
+        try:
+            self._write_orders()
+        except BaseException as error:
+            with self._written_condition:
+                self._writer_error = error
+                self._written_condition.notify_all()
+
+    def _write_orders(self):
+        """Runs in the writer thread, writing queued orders a group at a time until close is called"""
+        while True:
+            # Everything queued while the last group was being written goes in the next group
+            orders = [self._queue.get()]
+            while True:
+                try:
+                    orders.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = orders[-1] is None
+            if closing:
+                orders.pop()
+
+            if orders:
+                with self._file_lock:
+                    self._log.write("".join(json.dumps(order) + "\n" for order in orders))
+                    self._log.flush()
+                    if self._sync:
+                        os.fsync(self._log.fileno())
+                    self._orders_since_compaction += len(orders)
+                with self._written_condition:
+                    self._written += len(orders)
+                    self._written_condition.notify_all()
+                if self._compact_every is not None and self._orders_since_compaction >= self._compact_every:
+                    self._compact()
+            if closing:
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays or compacts a Store order log")
+    parser.add_argument("command", choices=["replay", "compact"],
+                        help="replay prints the rebuilt quantities as JSON; compact folds the logs into the baseline")
+    parser.add_argument("directory")
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        print(json.dumps(list(replay_orders(args.directory).items())))
+    else:
+        # The logs must not be in use, since orders written during compaction would be lost
+        fold_logs(args.directory, max(get_generations(args.directory) + [read_baseline(args.directory)[0]]) + 1)
+
+
+if __name__ == "__main__":
+    main()
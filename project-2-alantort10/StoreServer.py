@@ -0,0 +1,183 @@
+# Author: Alan Tort
+# Date: 8/9/2021
+# Description: An asyncio server that lets clients use a Store over a socket
+
+import argparse
+import asyncio
+import json
+from Store import Product
+from Store import Customer
+from Store import Store
+
+# Methods clients can call, and whether each one changes carts or stock
+STORE_METHODS = {"product_search": False, "add_product_to_member_cart": True, "check_out_member": True}
+
+# Longest request or response line in bytes, which must fit a search that matches the whole catalog
+LINE_LIMIT = 2 ** 26
+
+
+class StoreServer:
+    """Serves a Store over TCP or a Unix socket with a line-delimited JSON protocol. Each request is a line
+    like {"id": 1, "method": "product_search", "params": ["xbox"]} and is answered with a line like
+    {"id": 1, "result": [...]} or, if the Store raised, {"id": 1, "error": "InvalidCheckoutError",
+    "message": ""}. The "stats" method returns get_stats().
+
+    Requests are not run as they arrive. Everything that arrives during one pass of the event loop is run
+    together on the next pass: identical searches (ignoring case) are run only once and share the result,
+    and cart changes and checkouts are applied as one batch in the order they arrived. Each connection's
+    requests are answered in order, one at a time."""
+
+    def __init__(self, store):
+        """Init method"""
+        self._store = store
+        self._pending_searches = dict()  # lowercase search string -> future for its result
+        self._pending_changes = []  # (method name, params, future) in the order they arrived
+        self._flush_scheduled = False
+        self._stats = {"requests": 0, "searches": 0, "search_runs": 0, "changes": 0, "change_batches": 0,
+                       "errors": 0}
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        """Starts listening on the given host and port, or on a Unix socket at path if one is given, and
+        returns the asyncio server. Port 0 picks a free port."""
+        if path is not None:
+            return await asyncio.start_unix_server(self._handle_connection, path, limit=LINE_LIMIT)
+        return await asyncio.start_server(self._handle_connection, host, port, limit=LINE_LIMIT)
+
+    def get_stats(self):
+        """Returns a dict of how many requests, searches, search runs, cart changes, change batches and
+        errors there have been"""
+        return dict(self._stats)
+
+    async def handle_request(self, request):
+        """Takes a request dict and returns the response dict"""
+        self._stats["requests"] += 1
+        request_id = None
+        try:
+            request_id = request.get("id")
+            method = request["method"]
+            params = list(request.get("params", []))
+            if method == "stats":
+                return {"id": request_id, "result": self.get_stats()}
+            if method not in STORE_METHODS:
+                raise ValueError("unknown method: " + repr(method))
+            if STORE_METHODS[method]:
+                future = self._add_change(method, params)
+            else:
+                future = self._add_search(params)
+            # A search's future is shared, so a disconnecting client must not cancel it for the others
+            result = await asyncio.shield(future)
+        except Exception as error:
+            self._stats["errors"] += 1
+            return {"id": request_id, "error": type(error).__name__, "message": str(error)}
+        return {"id": request_id, "result": result}
+
+    async def _handle_connection(self, reader, writer):
+        """Answers one client's requests until it disconnects"""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    response = {"id": None, "error": "ValueError", "message": "invalid JSON: " + str(error)}
+                else:
+                    if isinstance(request, dict):
+                        response = await self.handle_request(request)
+                    else:
+                        response = {"id": None, "error": "ValueError", "message": "expected a JSON object"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _add_search(self, params):
+        """Returns a future for the results of a search, joining an identical pending search if there is one"""
+        if len(params) != 1 or not isinstance(params[0], str):
+            raise ValueError("product_search takes one search string")
+        self._stats["searches"] += 1
+        search = params[0].lower()
+        if search not in self._pending_searches:
+            self._pending_searches[search] = asyncio.get_running_loop().create_future()
+            self._schedule_flush()
+        return self._pending_searches[search]
+
+    def _add_change(self, method, params):
+        """Returns a future for the result of a cart change or checkout, which is queued for the next batch"""
+        self._stats["changes"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending_changes.append((method, params, future))
+        self._schedule_flush()
+        return future
+
+    def _schedule_flush(self):
+        """Arranges for pending requests to be run on the next pass of the event loop"""
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        """Runs every pending search once and applies the pending cart changes in order"""
+        self._flush_scheduled = False
+        searches = self._pending_searches
+        changes = self._pending_changes
+        self._pending_searches = dict()
+        self._pending_changes = []
+
+        for search, future in searches.items():
+            self._stats["search_runs"] += 1
+            self._run(future, self._store.product_search, [search])
+        if changes:
+            self._stats["change_batches"] += 1
+        for method, params, future in changes:
+            self._run(future, getattr(self._store, method), params)
+
+    def _run(self, future, method, params):
+        """Calls a Store method and sets the future to its result or to the exception it raised"""
+        try:
+            result = method(*params)
+        except Exception as error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+def make_demo_store(product_count, member_count):
+    """Returns a Store with generated products and members to serve"""
+    myStore = Store()
+    myStore.add_products(Product("P" + str(number), "Product " + str(number), "category " + str(number % 100),
+                                 number % 50 + 1, 1000000) for number in range(product_count))
+    myStore.add_members(Customer("Customer " + str(number), "C" + str(number), number % 2 == 0)
+                        for number in range(member_count))
+    myStore.index_now()  # so the first client's search doesn't wait for the whole catalog to be indexed
+    return myStore
+
+
+async def serve(store, host, port, path):
+    """Serves the store until the process is stopped"""
+    server = await StoreServer(store).start(host, port, path)
+    async with server:
+        for sock in server.sockets:
+            print("serving on", sock.getsockname())
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a Store with generated products and members")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8462)
+    parser.add_argument("--path", help="Unix socket to listen on instead of TCP")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--members", type=int, default=1000)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(make_demo_store(args.products, args.members), args.host, args.port, args.path))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
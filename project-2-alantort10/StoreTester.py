@@ -2,11 +2,28 @@
 # Date: 6/22/2021
 # Description: Unit testing for Store.py
 
+import asyncio
+import os
+import random
+import tempfile
+import threading
 import unittest
 from Store import Product
 from Store import Customer
 from Store import Store
 from Store import InvalidCheckoutError
+from Store import InsufficientStockError
+from Store import numpy
+from Instrumentation import Instrumentation
+from StoreImport import import_products
+from StoreImport import import_members
+from StoreServer import StoreServer
+from StoreClient import StoreClient
+from StoreClient import StoreServerError
+from StoreOrderLog import OrderLog
+from StoreOrderLog import replay_orders
+from StoreOrderLog import restore_inventory
+from StoreOrderLog import get_generations
 
 
 class test_store(unittest.TestCase):
@@ -72,6 +89,427 @@ class test_store(unittest.TestCase):
         self.assertEqual(chess_availability, 0)
         self.assertEqual(new_checkout, 25) # $25 dollars will be total since DEF is a premium member
 
+    def test_instrumentation(self):
+        """Testing that instrumentation records Store calls by outcome without changing results"""
+        myStore = Store()
+        myStore.add_product(Product(641, "chess", "game", 25, 1))
+        myStore.add_member(Customer("Eric", "DEF", True))
+        instrumentation = Instrumentation()
+        instrumentation.instrument(myStore)
+        self.assertEqual(myStore.add_product_to_member_cart(641, "DEF"), "product added to cart")
+        self.assertEqual(myStore.check_out_member("DEF"), 25)
+        myStore.add_product_to_member_cart(641, "DEF")
+        self.assertRaises(InvalidCheckoutError, myStore.check_out_member, "XYZ")
+
+        stats = instrumentation.snapshot()
+        self.assertEqual(stats["Store.add_product_to_member_cart"]["outcomes"],
+                         {"product added to cart": 1, "product out of stock": 1})
+        self.assertEqual(stats["Store.check_out_member"]["outcomes"], {"ok": 1, "InvalidCheckoutError": 1})
+        self.assertEqual(stats["Store.check_out_member"]["calls"], 2)
+        instrumentation.uninstrument()
+        self.assertEqual(myStore.product_search("chess"), [641])
+        self.assertNotIn("Store.product_search", instrumentation.snapshot())
+
+    def test_product_search_matches_scan(self):
+        """Testing that the indexed product_search gives the same results as scanning every product"""
+        generator = random.Random(162)
+        words = ["Xbox", "console", "Series", "chess", "GAME", "board", "wood", "Woodchuck", "e", "xb"]
+        myStore = Store()
+        products = dict()
+        for number in range(300):
+            title = " ".join(generator.sample(words, 2))
+            description = " ".join(generator.sample(words, 3))
+            product = Product("P" + str(generator.randrange(250)), title, description, 10, 1)
+            myStore.add_product(product)
+            products[product.get_product_id()] = product
+
+        # short titles and descriptions are indexed whole, and replacing them drops them from the index
+        short_products = [[Product("S1", "Xb", "e", 10, 1), Product("S2", "o", "", 10, 1),
+                           Product("P0", "wO", "d", 1, 1)],
+                          [Product("S2", "zq", "", 10, 1)]]
+        for replacements in short_products:
+            for product in replacements:
+                myStore.add_product(product)
+                products[product.get_product_id()] = product
+
+            for search in ["", "x", "E", "xb", "o", "wo", "d", "zq", "q", "ser", "xbox", "series", "ODCH", "chess game",
+                           "e c", "zzz", "Woodchuck", "box s"]:
+                expected = sorted(product_id for product_id, product in products.items()
+                                  if search.lower() in product.get_title().lower()
+                                  or search.lower() in product.get_description().lower())
+                self.assertEqual(myStore.product_search(search), expected)
+
+    def test_product_search_cache(self):
+        """Testing the search cache's hits, evictions and invalidation when products are added"""
+        myStore = Store(search_cache_size=2)
+        myStore.add_product(Product("BCA", "Xbox Series X", "console", 500, 2))
+        myStore.add_product(Product("XYZ", "Sony Playstation 5", "console", 500, 0))
+        results = myStore.product_search("Xbox")
+        results.append("changed by caller")
+        self.assertEqual(myStore.product_search("xbox"), ["BCA"])
+        self.assertEqual(myStore.product_search("sony"), ["XYZ"])
+
+        myStore.add_product(Product("ABC", "Xbox Series-S", "console", 300, 5))  # only changes "xbox"
+        self.assertEqual(myStore.get_search_cache_stats(),
+                         {"hits": 1, "misses": 2, "evictions": 0, "invalidations": 1, "size": 1})
+        self.assertEqual(myStore.product_search("xbox"), ["ABC", "BCA"])
+        self.assertEqual(myStore.product_search("SONY"), ["XYZ"])
+        myStore.product_search("console")
+        self.assertEqual(myStore.get_search_cache_stats(),
+                         {"hits": 2, "misses": 4, "evictions": 1, "invalidations": 1, "size": 2})
+
+    def test_product_search_pages(self):
+        """Testing that paging through search results gives the same IDs in the same order"""
+        myStore = Store()
+        for number in range(60):
+            if number % 3 == 0:
+                title = "Xbox " + str(number)
+            else:
+                title = "Chess " + str(number)
+            myStore.add_product(Product("P" + str(number).zfill(2), title, "game", 10, 1))
+
+        # small pages of rare matches go through the index's lists, and large ones walk every ID in order
+        for search in ["", "xbox", "chess 1", "game", "ch", "nothing", "x", "1", "s 1", "5", "zq"]:
+            for page_size in [1, 7, 30]:
+                pages = []
+                page = myStore.product_search_page(search, page_size)
+                while page:
+                    pages.extend(page)
+                    page = myStore.product_search_page(search, page_size, page[-1])
+                self.assertEqual(pages, myStore.product_search(search))
+            self.assertEqual(list(myStore.iter_product_search(search, 4)), myStore.product_search(search))
+        self.assertEqual(myStore.product_search_page("xbox", 2, "P10"), ["P12", "P15"])
+
+    def test_cart_quantities(self):
+        """Testing that carts hold quantities and checkout only buys what is in stock"""
+        checkers = Product(926, "checkers", "game", 50, 5)
+        chess = Product(641, "chess", "game", 25, 2)
+        customer = Customer("Eric", "DEF", True)
+        myStore = Store()
+        myStore.add_member(customer)
+        myStore.add_product(checkers)
+        myStore.add_product(chess)
+        myStore.add_product_to_member_cart(641, "DEF")
+        myStore.add_product_to_member_cart(926, "DEF", 3)
+        myStore.add_product_to_member_cart(641, "DEF", 2)
+        self.assertEqual(customer.get_cart(), {641: 3, 926: 3})
+        self.assertEqual(myStore.check_out_member("DEF"), 200)  # 2 chess (only 2 in stock) and 3 checkers
+        self.assertEqual(chess.get_quantity_available(), 0)
+        self.assertEqual(checkers.get_quantity_available(), 2)
+        self.assertEqual(customer.get_cart(), {})
+
+        # the price is multiplied by the quantity, which can differ in the last bit from adding it per unit
+        myStore.add_product(Product(105, "dice", "game", 0.1, 20))
+        myStore.add_product_to_member_cart(105, "DEF", 10)
+        self.assertAlmostEqual(myStore.check_out_member("DEF"), 1.0)
+        self.assertEqual(myStore.lookup_product_from_id(105).get_quantity_available(), 10)
+        for quantity in [0, -5, 2.5, "2", True]:
+            self.assertRaises(ValueError, myStore.add_product_to_member_cart, 105, "DEF", quantity)
+        self.assertEqual(customer.get_cart(), {})
+
+    def test_reservations(self):
+        """Testing that reservations hold stock, time out, and make checkout all-or-nothing"""
+        now = [0]
+        myStore = Store(reservation_timeout=60, clock=lambda: now[0])
+        chess = Product(641, "chess", "game", 25, 2)
+        checkers = Product(926, "checkers", "game", 50, 5)
+        myStore.add_product(chess)
+        myStore.add_product(checkers)
+        myStore.add_member(Customer("Alan", "ABC", True))
+        myStore.add_member(Customer("Eric", "DEF", True))
+
+        self.assertEqual(myStore.add_product_to_member_cart(641, "ABC", 2), "product added to cart")
+        self.assertEqual(myStore.add_product_to_member_cart(641, "DEF"), "product out of stock")
+        myStore.add_product_to_member_cart(926, "ABC")
+        self.assertEqual(chess.get_quantity_available(), 0)
+
+        # Alan's reservations run out and Eric takes one chess set
+        now[0] = 61
+        self.assertEqual(myStore.release_expired_reservations(), 2)
+        self.assertEqual(chess.get_quantity_available(), 2)
+        myStore.add_product_to_member_cart(641, "DEF")
+        self.assertRaises(InsufficientStockError, myStore.check_out_member, "ABC")
+        self.assertEqual(checkers.get_quantity_available(), 5)  # nothing was bought
+
+        self.assertEqual(myStore.lookup_member_from_id("ABC").get_cart(), {641: 2, 926: 1})
+
+        # Eric's reservation is checked out and Alan can't be sold two chess sets any more
+        self.assertEqual(myStore.check_out_member("DEF"), 25)
+        self.assertEqual(chess.get_quantity_available(), 1)
+        self.assertRaises(InsufficientStockError, myStore.check_out_member, "ABC")
+        self.assertEqual(chess.get_quantity_available(), 1)
+
+        # a bad quantity is turned away before any stock is taken
+        for quantity in [-5, 0]:
+            self.assertRaises(ValueError, myStore.add_product_to_member_cart, 641, "DEF", quantity)
+        self.assertEqual(chess.get_quantity_available(), 1)
+
+    def test_reserved_during_checkout(self):
+        """Testing that products reserved while a checkout is being charged stay in the cart"""
+        myStore = Store(reservation_timeout=60, clock=lambda: 0)
+        customer = Customer("Eric", "DEF", True)
+        myStore.add_member(customer)
+
+        class RacingProduct(Product):
+            """A product whose price lookup reserves another chess set, standing in for a concurrent add"""
+
+            def get_price(self):
+                if not added:
+                    added.append(myStore.add_product_to_member_cart(641, "DEF"))
+                return super().get_price()
+
+        added = []
+        chess = Product(641, "chess", "game", 25, 5)
+        myStore.add_product(chess)
+        myStore.add_product(RacingProduct(926, "checkers", "game", 50, 5))
+        myStore.add_product_to_member_cart(926, "DEF")
+        myStore.add_product_to_member_cart(641, "DEF", 2)
+        self.assertEqual(myStore.check_out_member("DEF"), 100)
+        self.assertEqual(added, ["product added to cart"])
+        self.assertEqual(customer.get_cart(), {641: 1})
+        self.assertEqual(chess.get_quantity_available(), 2)
+        self.assertEqual(myStore.check_out_member("DEF"), 25)
+        self.assertEqual(chess.get_quantity_available(), 2)
+
+    def test_double_checkout(self):
+        """Testing that a second checkout of the same cart while the first is being charged buys nothing"""
+        myStore = Store(reservation_timeout=60, clock=lambda: 0)
+        customer = Customer("Eric", "DEF", True)
+        myStore.add_member(customer)
+
+        class RacingProduct(Product):
+            """A product whose price lookup checks the same customer out again, standing in for a resubmit"""
+
+            def get_price(self):
+                if not charges:
+                    charges.append(myStore.check_out_member("DEF"))
+                return super().get_price()
+
+        charges = []
+        chess = RacingProduct(641, "chess", "game", 25, 5)
+        myStore.add_product(chess)
+        myStore.add_product_to_member_cart(641, "DEF", 2)
+        self.assertEqual(myStore.check_out_member("DEF"), 50)
+        self.assertEqual(charges, [0])
+        self.assertEqual(chess.get_quantity_available(), 3)
+        self.assertEqual(customer.get_cart(), {})
+
+    def test_concurrent_reserved_checkouts(self):
+        """Testing that concurrent checkouts with reservations never sell more than the stock"""
+        myStore = Store(reservation_timeout=60)
+        console = Product("BCA", "Xbox Series X", "console", 500, 100)
+        myStore.add_product(console)
+        sold = []
+
+        def shop(customer_id):
+            myStore.add_member(Customer("Name", customer_id, True))
+            for attempt in range(50):
+                if myStore.add_product_to_member_cart("BCA", customer_id, 3) == "product added to cart":
+                    sold.append(myStore.check_out_member(customer_id) // 500)
+
+        threads = [threading.Thread(target=shop, args=("C" + str(number),)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(sold), 99)  # 33 carts of 3, with 1 left over
+        self.assertEqual(console.get_quantity_available(), 1)
+
+    def test_add_products(self):
+        """Testing that bulk-added products are searchable, including replacements within the batch"""
+        myStore = Store(search_cache_size=4)
+        myStore.add_product(Product("BCA", "Xbox Series X", "console", 500, 2))
+        self.assertEqual(myStore.product_search("xbox"), ["BCA"])
+        products = [Product("ABC", "Xbox Series-S", "console", 300, 5),
+                    Product("XYZ", "Sony Playstation 5", "console", 500, 0),
+                    Product("ABC", "Nintendo Switch", "console", 300, 5)]
+        self.assertEqual(myStore.add_products(products), 3)
+        self.assertEqual(myStore.product_search("xbox"), ["BCA"])
+        myStore.add_products([Product("GHI", "Steam Deck", "handheld console", 400, 1)])
+        myStore.index_now()
+        self.assertEqual(myStore.product_search("steam"), ["GHI"])
+        self.assertEqual(myStore.product_search("handheld"), ["GHI"])
+        self.assertEqual(myStore.product_search("console"), ["ABC", "BCA", "GHI", "XYZ"])
+        self.assertEqual(myStore.product_search("switch"), ["ABC"])
+        self.assertEqual(myStore.lookup_product_from_id("ABC").get_title(), "Nintendo Switch")
+
+        # a product without a text title is turned away before it is added
+        self.assertRaises(AttributeError, myStore.add_products, [Product("JKL", None, "console", 100, 1)])
+        self.assertIsNone(myStore.lookup_product_from_id("JKL"))
+
+    def test_import(self):
+        """Testing that CSV and JSON Lines imports load every valid row and report the rest"""
+        with tempfile.TemporaryDirectory() as directory:
+            products_path = os.path.join(directory, "products.csv")
+            with open(products_path, "w", newline="") as products_file:
+                products_file.write("product_id,title,description,price,quantity_available\n"
+                                    "BCA,Xbox Series X,console,500,2\n"
+                                    "ABC,\"Xbox Series-S, white\",console,299.99,5\n"
+                                    "XYZ,Sony Playstation 5,console,five hundred,0\n"
+                                    "DEF,Nintendo Switch\n"
+                                    "GHI,Steam Deck,handheld,400,1,extra\n")
+            members_path = os.path.join(directory, "members.jsonl")
+            with open(members_path, "w") as members_file:
+                members_file.write('{"name": "Alan", "customer_id": "ABC", "premium_member": true}\n'
+                                   '{"name": "Eric", "customer_id": "DEF", "premium_member": "no"}\n'
+                                   '{"name": "Sam", "customer_id": "GHI"}\n'
+                                   '{"name": "Jo"\n'
+                                   '{"name": "Kim", "customer_id": ["JKL"], "premium_member": true}\n')
+            jsonl_path = os.path.join(directory, "products.jsonl")
+            with open(jsonl_path, "w") as jsonl_file:
+                jsonl_file.write('{"product_id": "JKL", "title": null, "description": "console", "price": 1, '
+                                 '"quantity_available": 1}\n'
+                                 '{"product_id": ["MNO"], "title": "Wii", "description": "console", "price": 1, '
+                                 '"quantity_available": 1}\n'
+                                 '{"product_id": "PQR", "title": "Wii U", "description": "console", "price": 1, '
+                                 '"quantity_available": 1}\n')
+
+            myStore = Store()
+            self.assertEqual(import_products(myStore, products_path, chunk_size=1),
+                             (2, [(4, "could not convert string to float: 'five hundred'"),
+                                  (5, "expected 5 columns, got 2"),
+                                  (6, "expected 5 columns, got 6")]))
+            self.assertEqual(myStore.lookup_product_from_id("ABC").get_price(), 299.99)
+            self.assertEqual(myStore.product_search("white"), ["ABC"])
+
+            reported = []
+            self.assertEqual(import_members(myStore, members_path,
+                                            on_error=lambda line, message: reported.append(line)), (2, []))
+            self.assertEqual(reported, [3, 4, 5])
+            self.assertFalse(myStore.lookup_member_from_id("DEF").is_premium_member())
+
+            # rows with fields of the wrong type are reported without stopping the import
+            self.assertEqual(import_products(myStore, jsonl_path),
+                             (1, [(1, "title and description must be text"), (2, "product_id can't be a list")]))
+            self.assertIsNone(myStore.lookup_product_from_id("JKL"))
+            self.assertEqual(myStore.product_search("wii"), ["PQR"])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_columnar_store(self):
+        """Testing that a columnar Store gives the same totals and checkouts as a regular one"""
+        stores = [Store(), Store(columnar=True)]
+        for myStore in stores:
+            for number in range(100):
+                myStore.add_product(Product(number, "Product " + str(number), "thing", number % 7 + 0.25, number % 5))
+            for number in range(10):
+                myStore.add_member(Customer("Customer " + str(number), number, number % 3 == 0))
+                for product_id in range(number, 100, 9):
+                    myStore.add_product_to_member_cart(product_id, number, number % 4 + 1)
+
+        regular, columnar = stores
+        self.assertAlmostEqual(columnar.get_total_stock_value(), regular.get_total_stock_value())
+        self.assertEqual(columnar.get_products_below(2), regular.get_products_below(2))
+        for columnar_total, regular_total in zip(columnar.get_cart_totals(range(10)),
+                                                 regular.get_cart_totals(range(10))):
+            self.assertAlmostEqual(columnar_total, regular_total)
+        self.assertRaises(InvalidCheckoutError, columnar.get_cart_totals, [10])
+
+        self.assertAlmostEqual(columnar.check_out_member(4), regular.check_out_member(4))
+        self.assertEqual(columnar.lookup_product_from_id(13).get_quantity_available(),
+                         regular.lookup_product_from_id(13).get_quantity_available())
+        self.assertEqual(columnar.get_products_below(1), regular.get_products_below(1))
+        self.assertEqual(columnar.product_search("product 13"), regular.product_search("product 13"))
+
+    def test_store_server(self):
+        """Testing that the server answers clients, runs identical concurrent searches once, and batches carts"""
+        myStore = Store()
+        myStore.add_product(Product("BCA", "Xbox Series X", "console", 500, 2))
+        myStore.add_product(Product("ABC", "Xbox Series-S", "console", 300, 5))
+        myStore.add_member(Customer("Alan", "ABC", True))
+        myStore.add_member(Customer("Eric", "DEF", False))
+        server = StoreServer(myStore)
+
+        async def run_clients():
+            listener = await server.start()
+            port = listener.sockets[0].getsockname()[1]
+            clients = [await StoreClient.connect(port=port) for number in range(4)]
+            searches = await asyncio.gather(*[client.product_search("XBOX") for client in clients])
+            adds = await asyncio.gather(clients[0].add_product_to_member_cart("BCA", "ABC", 2),
+                                        clients[1].add_product_to_member_cart("BCA", "DEF"),
+                                        clients[2].add_product_to_member_cart("ABC", "DEF"))
+            charge = await clients[0].check_out_member("ABC")
+            with self.assertRaises(StoreServerError) as context:
+                await clients[3].check_out_member("XYZ")
+            stats = await clients[3].get_stats()
+            for client in clients:
+                await client.close()
+            listener.close()
+            await listener.wait_closed()
+            return searches, adds, charge, context.exception.error_name, stats
+
+        searches, adds, charge, error_name, stats = asyncio.run(run_clients())
+        self.assertEqual(searches, [["ABC", "BCA"]] * 4)
+        self.assertEqual(adds, ["product added to cart"] * 3)
+        self.assertEqual(charge, 1000)
+        self.assertEqual(error_name, "InvalidCheckoutError")
+        self.assertEqual(stats["searches"], 4)
+        self.assertEqual(stats["search_runs"], 1)
+        self.assertEqual(stats["changes"], 5)
+        self.assertEqual(stats["change_batches"], 3)
+
+    def test_order_log(self):
+        """Testing that logged checkouts rebuild the inventory's quantities, before and after compaction"""
+        with tempfile.TemporaryDirectory() as directory:
+            products = [Product(number, "Product " + str(number), "thing", 10, 20) for number in range(5)]
+            order_log = OrderLog(directory, {number: 20 for number in range(5)}, compact_every=7)
+            myStore = Store(order_log=order_log)
+            myStore.add_products(products)
+            for number in range(10):
+                myStore.add_member(Customer("Customer " + str(number), number, number % 2 == 0))
+                myStore.add_product_to_member_cart(number % 5, number, 3)
+                myStore.add_product_to_member_cart((number + 1) % 5, number)
+                myStore.check_out_member(number)
+            order_log.flush()
+            quantities = {number: products[number].get_quantity_available() for number in range(5)}
+            self.assertEqual(replay_orders(directory), quantities)
+
+            order_log.compact()
+            self.assertEqual(len(get_generations(directory)), 1)
+            myStore.add_product_to_member_cart(0, 0, 25)  # more than there is
+            myStore.check_out_member(0)
+            order_log.close()
+            quantities[0] = 0
+            self.assertEqual(replay_orders(directory), quantities)
+
+            # A partly written order is ignored, and a fresh Store gets the logged quantities
+            with open(os.path.join(directory, "orders." + str(get_generations(directory)[-1]) + ".log"),
+                      "a") as log_file:
+                log_file.write('{"customer_id": 1, "products": [[1, 5]')
+            restoredStore = Store()
+            restoredStore.add_products(Product(number, "Product " + str(number), "thing", 10, 20)
+                                       for number in range(5))
+            restore_inventory(restoredStore, directory)
+            for number in range(5):
+                self.assertEqual(restoredStore.lookup_product_from_id(number).get_quantity_available(),
+                                 quantities[number])
+
+            # Reopening the log cuts off the partial order, so the next one is written on a line of its own
+            order_log = OrderLog(directory)
+            order_log.record(1, {1: 5}, 50, False)
+            order_log.close()
+            quantities[1] -= 5
+            self.assertEqual(replay_orders(directory), quantities)
+
+            # An order the writer can't write is raised to the caller instead of hanging flush
+            order_log = OrderLog(directory)
+            order_log.record(1, {1: 1}, object(), False)
+            self.assertRaises(TypeError, order_log.flush)
+            self.assertRaises(TypeError, order_log.record, 1, {1: 1}, 10, False)
+            self.assertRaises(TypeError, order_log.close)
+            self.assertEqual(replay_orders(directory), quantities)
+
+            # A checkout the failed log can't record leaves the stock and the cart as they were
+            for myStore in [Store(order_log=order_log), Store(reservation_timeout=60, order_log=order_log)]:
+                chess = Product(641, "chess", "game", 25, 5)
+                myStore.add_product(chess)
+                myStore.add_member(Customer("Eric", "DEF", True))
+                myStore.add_product_to_member_cart(641, "DEF", 2)
+                stock = chess.get_quantity_available()
+                for attempt in range(2):
+                    self.assertRaises(TypeError, myStore.check_out_member, "DEF")
+                    self.assertEqual(chess.get_quantity_available(), stock)
+                    self.assertEqual(myStore.lookup_member_from_id("DEF").get_cart(), {641: 2})
+
 
 if __name__ == "__main__":
     unittest.main()
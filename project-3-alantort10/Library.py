@@ -2,10 +2,48 @@
 # Date: 6/29/2021
 # Description: Project 3: Library Simulator
 
+import heapq
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from bisect import insort
+from collections.abc import Mapping
+from contextlib import nullcontext
+
+# Status codes returned by Library.apply_batch; STATUS_MESSAGES holds the string for each code
+CHECK_OUT_SUCCESSFUL = 0
+RETURN_SUCCESSFUL = 1
+REQUEST_SUCCESSFUL = 2
+PATRON_NOT_FOUND = 3
+ITEM_NOT_FOUND = 4
+ITEM_ALREADY_CHECKED_OUT = 5
+ITEM_ON_HOLD_BY_OTHER_PATRON = 6
+ITEM_ALREADY_IN_LIBRARY = 7
+ITEM_ALREADY_ON_HOLD = 8
+STATUS_MESSAGES = ("check out successful", "return successful", "request successful", "patron not found",
+                   "item not found", "item already checked out", "item on hold by other patron",
+                   "item already in library", "item already on hold")
+
+# A thread safe Library spreads its item and patron locks over this many locks of each kind
+LOCK_STRIPES = 1024
+NO_LOCK = nullcontext()  # stands in for a lock when a Library is not thread safe
+
+# Most keys a FineIndex bucket holds before it is split in two
+FINE_BUCKET_SIZE = 512
+
+# Fields that Library.search can look in
+SEARCH_FIELDS = ("title", "author", "artist", "director")
+
+
 class LibraryItem:
     """Represents a library item in the library with characteristics
     to be shared amongst the books, albums, and movies"""
 
+    # slots instead of an instance __dict__ keep large catalogs compact
+    __slots__ = ("_library_item_id", "_title", "_location", "_checked_out_by", "_requested_by",
+                 "_date_checked_out")
+
     def __init__(self, library_item_id, title):
         """Init method"""
         self._library_item_id = library_item_id  # unique identifier for a LibraryItem
@@ -60,11 +98,13 @@ class LibraryItem:
 class Book(LibraryItem):
     """Represents a book LibraryItem that contains an author attribute and a check out length of 21 days"""
 
+    __slots__ = ("_author",)
+    _check_out_length = 21  # shared by every Book
+
     def __init__(self, library_item_id, title, author):
         """Init method"""
         super().__init__(library_item_id, title)
         self._author = author
-        self._check_out_length = 21
 
     def get_author(self):
         """Gets the author of Book"""
@@ -78,11 +118,13 @@ class Book(LibraryItem):
 class Album(LibraryItem):
     """Represents an album LibraryItem that contains an artist attribute and a check out length of 14 days"""
 
+    __slots__ = ("_artist",)
+    _check_out_length = 14  # shared by every Album
+
     def __init__(self, library_item_id, title, artist):
         """Init method"""
         super().__init__(library_item_id, title)
         self._artist = artist
-        self._check_out_length = 14
 
     def get_artist(self):
         """Gets the artist of the Album"""
@@ -96,11 +138,13 @@ class Album(LibraryItem):
 class Movie(LibraryItem):
     """Represents a movie LibraryItem that contains a director attribute and a check out length of 7 days"""
 
+    __slots__ = ("_director",)
+    _check_out_length = 7  # shared by every Movie
+
     def __init__(self, library_item_id, title, director):
         """Init method"""
         super().__init__(library_item_id, title)
         self._director = director
-        self._check_out_length = 7
 
     def get_director(self):
         """Gets the director of the Movie"""
@@ -112,58 +156,465 @@ class Movie(LibraryItem):
 
 
 class Patron:
-    """Represents a library patron with a unique ID, name, list of items checked out
+    """Represents a library patron with a unique ID, name, collection of items checked out
     and late fine amount."""
 
     def __init__(self, patron_id, name):
         """Init method"""
         self._patron_id = patron_id
         self._name = name
-        self._checked_out_items = []
-        self._fine_amount = 0
+        self._checked_out_items = dict()  # library item ID -> LibraryItem, in the order they were checked out
+        self._checked_out_counts = {Book: 0, Album: 0, Movie: 0}  # number of checked out items of each type
+        self._fine_cents = 0  # kept in whole cents so daily 10 cent charges add up exactly
+        self._fine_listener = None  # called with the patron whenever its fine changes
+
+    def __getstate__(self):
+        """Leaves out the fine listener, which belongs to the library the patron is in."""
+        state = self.__dict__.copy()
+        state["_fine_listener"] = None
+        return state
 
     def get_fine_amount(self):
-        """Gets the patron's fine amount."""
-        return self._fine_amount
+        """Gets the patron's fine amount in dollars."""
+        return self._fine_cents / 100
+
+    def get_fine_cents(self):
+        """Gets the patron's fine amount in cents."""
+        return self._fine_cents
 
     def add_library_item(self, library_item):
         """Adds the specified LibraryItem to checked out items."""
-        self._checked_out_items.append(library_item)
+        self._checked_out_items[library_item.get_library_item_id()] = library_item
+        item_type = self._get_item_type(library_item)
+        if item_type is not None:
+            self._checked_out_counts[item_type] += 1
 
     def remove_library_item(self, library_item):
         """Removes the specified LibraryItem from checked out items."""
-        self._checked_out_items.remove(library_item)
+        del self._checked_out_items[library_item.get_library_item_id()]
+        item_type = self._get_item_type(library_item)
+        if item_type is not None:
+            self._checked_out_counts[item_type] -= 1
+
+    def _get_item_type(self, library_item):
+        """Returns which of Book, Album or Movie the LibraryItem is, or None if it is none of them."""
+        for item_type in self._checked_out_counts:
+            if isinstance(library_item, item_type):
+                return item_type
+        return None
 
     def amend_fine(self, amount):
         """Increases or decreases the current fine amount by a certain amount."""
         # negative amount will decrease it, positive amount will increase
-        self._fine_amount += amount
+        self.amend_fine_cents(round(amount * 100))
+
+    def amend_fine_cents(self, cents):
+        """Increases or decreases the current fine amount by a whole number of cents."""
+        self._fine_cents += cents
+        if self._fine_listener is not None:
+            self._fine_listener(self)
+
+    def set_fine_listener(self, listener):
+        """Sets the function called with the patron whenever its fine changes."""
+        self._fine_listener = listener
 
     def get_patron_id(self):
         """Returns the patron ID"""
         return self._patron_id
 
+    def get_name(self):
+        """Returns the patron's name"""
+        return self._name
+
     def get_checked_out_items(self):
-        """Gets the library items the patron has checked out."""
-        return self._checked_out_items
+        """Gets a view of the library items the patron has checked out."""
+        return self._checked_out_items.values()
 
+    def get_checked_out_count(self):
+        """Gets the number of library items the patron has checked out."""
+        return len(self._checked_out_items)
+
+    def get_book_count(self):
+        """Gets the number of Books the patron has checked out."""
+        return self._checked_out_counts[Book]
+
+    def get_album_count(self):
+        """Gets the number of Albums the patron has checked out."""
+        return self._checked_out_counts[Album]
+
+    def get_movie_count(self):
+        """Gets the number of Movies the patron has checked out."""
+        return self._checked_out_counts[Movie]
+
+
+class ColumnarLibraryItem:
+    """Mixin for lightweight LibraryItem views whose data lives in a ColumnarHoldings store"""
+
+    __slots__ = ()
+
+    def __init__(self, holdings, slot, library_item_id):
+        """Init method"""
+        self._holdings = holdings
+        self._slot = slot
+        self._library_item_id = library_item_id
+
+    def __eq__(self, other):
+        """Views of the same slot in the same store are equal"""
+        if not isinstance(other, ColumnarLibraryItem):
+            return NotImplemented
+        return self._holdings is other._holdings and self._slot == other._slot
+
+    def __hash__(self):
+        """Hashes by store and slot"""
+        return hash((id(self._holdings), self._slot))
+
+    def get_title(self):
+        """Gets the library item's title"""
+        return self._holdings._get_title(self._slot)
+
+    def get_location(self):
+        """Gets the LibraryItem's location"""
+        return ColumnarHoldings.LOCATIONS[self._holdings._locations[self._slot]]
+
+    def set_location(self, location):
+        """Sets the LibraryItem's location to the given location"""
+        self._holdings._locations[self._slot] = ColumnarHoldings.LOCATIONS.index(location)
+
+    def get_checked_out_by(self):
+        """Gets the Patron who has checked out the LibraryItem or None"""
+        return self._holdings._get_patron(self._holdings._checked_out_by[self._slot])
+
+    def set_checked_out_by(self, patron):
+        """Sets who the LibraryItem was checked out by to the given patron"""
+        self._holdings._checked_out_by[self._slot] = self._holdings._get_patron_number(patron)
+
+    def get_requested_by(self):
+        """Gets the patron who has requested the LibraryItem or None"""
+        return self._holdings._get_patron(self._holdings._requested_by[self._slot])
+
+    def set_requested_by(self, patron):
+        """Sets who the LibraryItem was requested by to the given patron"""
+        self._holdings._requested_by[self._slot] = self._holdings._get_patron_number(patron)
+
+    def get_date_checked_out(self):
+        """Gets the date the LibraryItem was checked out"""
+        date = self._holdings._dates_checked_out[self._slot]
+        if date == -1:
+            return None
+        return date
+
+    def set_date_checked_out(self, date):
+        """Sets which day the LibraryItem was checked out"""
+        if date is None:
+            date = -1
+        self._holdings._dates_checked_out[self._slot] = date
+
+
+class ColumnarBook(ColumnarLibraryItem, Book):
+    """A Book view into a ColumnarHoldings store"""
+
+    __slots__ = ("_holdings", "_slot")
+
+    def get_author(self):
+        """Gets the author of Book"""
+        return self._holdings._get_creator(self._slot)
+
+
+class ColumnarAlbum(ColumnarLibraryItem, Album):
+    """An Album view into a ColumnarHoldings store"""
+
+    __slots__ = ("_holdings", "_slot")
+
+    def get_artist(self):
+        """Gets the artist of the Album"""
+        return self._holdings._get_creator(self._slot)
+
+
+class ColumnarMovie(ColumnarLibraryItem, Movie):
+    """A Movie view into a ColumnarHoldings store"""
+
+    __slots__ = ("_holdings", "_slot")
+
+    def get_director(self):
+        """Gets the director of the Movie"""
+        return self._holdings._get_creator(self._slot)
 
-class Library:
-    """Represents a library with holdings, members, and the current date."""
+
+class ColumnarHoldings(Mapping):
+    """A compact mapping of library item ID -> LibraryItem that keeps each item's fields in typed arrays
+    indexed by slot. Titles are UTF-8 encoded one after another in a single buffer, and creators are
+    interned, so each item is stored as a few numbers rather than as Python objects. Looking up an item
+    returns a lightweight view with the usual LibraryItem methods."""
+
+    LOCATIONS = ("ON_SHELF", "ON_HOLD_SHELF", "CHECKED_OUT")
+    ITEM_TYPES = (Book, Album, Movie)
+    VIEW_TYPES = (ColumnarBook, ColumnarAlbum, ColumnarMovie)
 
     def __init__(self):
         """Init method"""
-        self._holdings = dict()
+        self._slots = dict()  # library item ID -> slot, in the order they were added
+        self._text = bytearray()  # every title, UTF-8 encoded; a replaced item's old title stays behind
+        self._title_starts = array("q")  # offset of the title in _text
+        self._title_ends = array("q")
+        self._creators = array("l")  # creator number of the author, artist or director
+        self._creator_names = []  # creator number -> creator
+        self._creator_numbers = dict()  # creator -> creator number
+        self._item_types = array("b")  # index into ITEM_TYPES
+        self._locations = array("b")  # index into LOCATIONS
+        self._checked_out_by = array("q")  # patron number or -1
+        self._requested_by = array("q")  # patron number or -1
+        self._dates_checked_out = array("q")  # date or -1
+        self._patrons = []  # patron number -> Patron
+        self._patron_numbers = dict()  # Patron -> patron number
+        self._patron_numbers_lock = threading.Lock()
+
+    def __setitem__(self, library_item_id, library_item):
+        """Copies the given LibraryItem into the store under the given ID"""
+        for type_number, item_type in enumerate(self.ITEM_TYPES):
+            if isinstance(library_item, item_type):
+                break
+        else:
+            raise TypeError("ColumnarHoldings can only hold Books, Albums and Movies")
+
+        if type_number == 0:
+            creator = library_item.get_author()
+        elif type_number == 1:
+            creator = library_item.get_artist()
+        else:
+            creator = library_item.get_director()
+
+        # Case where the ID is new, so every column grows by one slot
+        if library_item_id not in self._slots:
+            self._slots[library_item_id] = len(self._item_types)
+            self._title_starts.append(0)
+            self._title_ends.append(0)
+            self._creators.append(0)
+            self._item_types.append(0)
+            self._locations.append(0)
+            self._checked_out_by.append(-1)
+            self._requested_by.append(-1)
+            self._dates_checked_out.append(-1)
+
+        slot = self._slots[library_item_id]
+        self._title_starts[slot] = len(self._text)
+        self._text += library_item.get_title().encode()
+        self._title_ends[slot] = len(self._text)
+        if creator not in self._creator_numbers:
+            self._creator_numbers[creator] = len(self._creator_names)
+            self._creator_names.append(creator)
+        self._creators[slot] = self._creator_numbers[creator]
+        self._item_types[slot] = type_number
+        view = self.VIEW_TYPES[type_number](self, slot, library_item_id)
+        view.set_location(library_item.get_location())
+        view.set_checked_out_by(library_item.get_checked_out_by())
+        view.set_requested_by(library_item.get_requested_by())
+        view.set_date_checked_out(library_item.get_date_checked_out())
+
+    def __getitem__(self, library_item_id):
+        """Returns a view of the LibraryItem with the given ID"""
+        slot = self._slots[library_item_id]
+        return self.VIEW_TYPES[self._item_types[slot]](self, slot, library_item_id)
+
+    def __contains__(self, library_item_id):
+        """Returns whether an item with the given ID is in the store"""
+        return library_item_id in self._slots
+
+    def __iter__(self):
+        """Iterates over the library item IDs in the order they were added"""
+        return iter(self._slots)
+
+    def __len__(self):
+        """Returns the number of items in the store"""
+        return len(self._slots)
+
+    def _get_title(self, slot):
+        """Decodes the title of the item in the given slot"""
+        return self._text[self._title_starts[slot]:self._title_ends[slot]].decode()
+
+    def _get_creator(self, slot):
+        """Returns the creator of the item in the given slot"""
+        return self._creator_names[self._creators[slot]]
+
+    def _get_patron(self, patron_number):
+        """Returns the Patron with the given patron number, or None for -1"""
+        if patron_number == -1:
+            return None
+        return self._patrons[patron_number]
+
+    def _get_patron_number(self, patron):
+        """Returns the patron number of the given Patron, or -1 for None"""
+        if patron is None:
+            return -1
+        if patron not in self._patron_numbers:
+            with self._patron_numbers_lock:
+                if patron not in self._patron_numbers:
+                    self._patrons.append(patron)
+                    self._patron_numbers[patron] = len(self._patrons) - 1
+        return self._patron_numbers[patron]
+
+
+class FineIndex:
+    """Keeps patrons ordered by fine as a list of sorted buckets of (fine in cents, -patron number) keys,
+    so an update only shifts one small bucket and the highest fines are read straight off the end.
+    Patrons with the same fine are ordered by when they were first added."""
+
+    def __init__(self):
+        """Init method"""
+        self._buckets = []  # sorted lists of keys, each holding keys greater than the bucket before
+        self._maxes = []  # the last key in each bucket
+        self._keys = dict()  # Patron -> its key
+        self._patrons = dict()  # patron number -> Patron
+        self._next_number = 0
+
+    def update(self, patron):
+        """Adds the patron, or moves it to match its current fine."""
+        fine_cents = patron.get_fine_cents()
+        key = self._keys.get(patron)
+        if key is None:
+            number = self._next_number
+            self._next_number += 1
+            self._patrons[number] = patron
+        elif key[0] == fine_cents:
+            return
+        else:
+            self._remove_key(key)
+            number = -key[1]
+        key = (fine_cents, -number)
+        self._keys[patron] = key
+        self._insert_key(key)
+
+    def remove(self, patron):
+        """Removes the patron if it is in the index."""
+        key = self._keys.pop(patron, None)
+        if key is not None:
+            self._remove_key(key)
+            del self._patrons[-key[1]]
+
+    def get_highest(self, count, over_cents):
+        """Returns up to count patrons (all of them if count is None) with fines over over_cents,
+        highest fine first."""
+        patrons = []
+        for bucket in reversed(self._buckets):
+            for key in reversed(bucket):
+                if key[0] <= over_cents or len(patrons) == count:
+                    return patrons
+                patrons.append(self._patrons[-key[1]])
+        return patrons
+
+    def _insert_key(self, key):
+        """Inserts a key into the bucket it belongs in, splitting the bucket if it has grown too big"""
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+        # Case where the key is greater than every key so far, so it goes at the end of the last bucket
+        position = min(bisect_left(self._maxes, key), len(self._maxes) - 1)
+        bucket = self._buckets[position]
+        insort(bucket, key)
+        self._maxes[position] = bucket[-1]
+        if len(bucket) > 2 * FINE_BUCKET_SIZE:
+            self._buckets.insert(position + 1, bucket[FINE_BUCKET_SIZE:])
+            del bucket[FINE_BUCKET_SIZE:]
+            self._maxes[position] = bucket[-1]
+            self._maxes.insert(position + 1, self._buckets[position + 1][-1])
+
+    def _remove_key(self, key):
+        """Removes a key from its bucket, dropping the bucket if it is left empty"""
+        position = bisect_left(self._maxes, key)
+        bucket = self._buckets[position]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[position] = bucket[-1]
+        else:
+            del self._buckets[position]
+            del self._maxes[position]
+
+
+class Library:
+    """Represents a library with holdings, members, and the current date."""
+
+    def __init__(self, columnar=False, thread_safe=False):
+        """Init method. A columnar library keeps its holdings in a compact ColumnarHoldings store.
+        A thread safe library can be used from several threads at once."""
+        if columnar:
+            self._holdings = ColumnarHoldings()
+        else:
+            self._holdings = dict()
         self._members = dict()
         self._current_date = 0
+        self._due_dates = []  # min-heap of (due date, loan number, library item ID) for loans not yet overdue
+        self._loan_numbers = dict()  # library item ID -> loan number of its entry in _due_dates
+        self._next_loan_number = 0
+        self._overdue_items = dict()  # library item ID -> Patron who has it checked out past its due date
+        self._overdue_counts = dict()  # Patron -> number of overdue items they have checked out
+
+        self._fine_index = FineIndex()  # members ordered by fine, kept up to date by their fine listeners
+
+        # Locks are always taken in the order item, then patron, then due date, status or fine
+        if thread_safe:
+            self._item_locks = [threading.Lock() for i in range(LOCK_STRIPES)]
+            self._patron_locks = [threading.Lock() for i in range(LOCK_STRIPES)]
+            self._due_date_lock = threading.Lock()
+            self._status_lock = threading.Lock()
+            self._fine_lock = threading.Lock()
+        else:
+            self._item_locks = None
+            self._patron_locks = None
+            self._due_date_lock = NO_LOCK
+            self._status_lock = NO_LOCK
+            self._fine_lock = NO_LOCK
+
+        # location -> library item IDs there, and patron ID -> library item IDs they have requested;
+        # dicts with None values are used as insertion-ordered sets
+        self._location_index = {"ON_SHELF": dict(), "ON_HOLD_SHELF": dict(), "CHECKED_OUT": dict()}
+        self._holds = dict()
+
+        self._search_index = dict()  # search field -> token -> set of library item IDs
+        self._sorted_tokens = dict()  # search field -> sorted list of tokens, for prefix matching
+        self._new_tokens = dict()  # search field -> tokens not yet merged into _sorted_tokens
+        for field in SEARCH_FIELDS:
+            self._search_index[field] = dict()
+            self._sorted_tokens[field] = []
+            self._new_tokens[field] = []
 
     def add_library_item(self, library_item):
         """Adds the specified library item to the library's holdings."""
-        self._holdings[library_item.get_library_item_id()] = library_item
+        library_item_id = library_item.get_library_item_id()
+
+        # Case where an item with the same ID is being replaced
+        if library_item_id in self._holdings:
+            old_library_item = self._holdings[library_item_id]
+            for field, token in self._get_search_tokens(old_library_item):
+                matches = self._search_index[field][token]
+                matches.discard(library_item_id)
+                if not matches:
+                    del self._search_index[field][token]
+            with self._status_lock:
+                del self._location_index[old_library_item.get_location()][library_item_id]
+                self._remove_hold(old_library_item.get_requested_by(), library_item_id)
+
+        self._holdings[library_item_id] = library_item
+        with self._status_lock:
+            self._location_index[library_item.get_location()][library_item_id] = None
+            self._add_hold(library_item.get_requested_by(), library_item_id)
+        for field, token in self._get_search_tokens(library_item):
+            index = self._search_index[field]
+            if token not in index:
+                index[token] = set()
+                self._new_tokens[field].append(token)
+            index[token].add(library_item_id)
 
     def add_patron(self, patron):
         """Adds the specified patron to the library's members."""
-        self._members[patron.get_patron_id()] = patron
+        patron_id = patron.get_patron_id()
+        with self._fine_lock:
+            # Case where a patron with the same ID is being replaced
+            if patron_id in self._members:
+                self._members[patron_id].set_fine_listener(None)
+                self._fine_index.remove(self._members[patron_id])
+            self._members[patron_id] = patron
+            patron.set_fine_listener(self._update_fine_index)
+            self._fine_index.update(patron)
 
     def get_library_item_from_id(self, library_item_id):
         """Returns the LibraryItem object corresponding to the ID given or none."""
@@ -179,90 +630,339 @@ class Library:
         else:
             return None
 
+    def search(self, query, fields=SEARCH_FIELDS, item_type=None):
+        """Returns a sorted list of the IDs of library items where every word in the query starts a word
+        in one of the given fields. The search is case-insensitive. If item_type is given, only items of
+        that type (such as Book) are returned."""
+        query_tokens = re.findall(r"\w+", query.lower())
+        if not query_tokens:
+            return []
+
+        results = None
+        for query_token in query_tokens:
+            matches = set()
+            for field in fields:
+                index = self._search_index[field]
+                sorted_tokens = self._get_sorted_tokens(field)
+
+                # Tokens starting with the query token are next to each other in sorted order
+                position = bisect_left(sorted_tokens, query_token)
+                while position < len(sorted_tokens) and sorted_tokens[position].startswith(query_token):
+                    # Case where the token was removed when its last item was replaced
+                    if sorted_tokens[position] in index:
+                        matches.update(index[sorted_tokens[position]])
+                    position += 1
+
+            if results is None:
+                results = matches
+            else:
+                results &= matches
+            if not results:
+                return []
+
+        if item_type is not None:
+            results = [library_item_id for library_item_id in results
+                       if isinstance(self._holdings[library_item_id], item_type)]
+        return sorted(results)
+
+    def _get_sorted_tokens(self, field):
+        """Returns the sorted tokens of a search field, merging in any new ones first"""
+        sorted_tokens = self._sorted_tokens[field]
+        if self._new_tokens[field]:
+            sorted_tokens.extend(self._new_tokens[field])
+            sorted_tokens.sort()
+            self._new_tokens[field] = []
+        return sorted_tokens
+
+    def _get_search_tokens(self, library_item):
+        """Returns a set of (field, token) pairs for the words in a LibraryItem's searchable fields"""
+        texts = [("title", library_item.get_title())]
+        if isinstance(library_item, Book):
+            texts.append(("author", library_item.get_author()))
+        elif isinstance(library_item, Album):
+            texts.append(("artist", library_item.get_artist()))
+        elif isinstance(library_item, Movie):
+            texts.append(("director", library_item.get_director()))
+
+        tokens = set()
+        for field, text in texts:
+            for token in re.findall(r"\w+", text.lower()):
+                tokens.add((field, token))
+        return tokens
+
+    def items_in_location(self, location):
+        """Returns a list of the LibraryItems in the given location: "ON_SHELF", "ON_HOLD_SHELF"
+        or "CHECKED_OUT"."""
+        with self._status_lock:
+            library_item_ids = list(self._location_index[location])
+        return [self._holdings[library_item_id] for library_item_id in library_item_ids]
+
+    def overdue_items(self):
+        """Returns a list of the LibraryItems that are checked out past their due date."""
+        with self._due_date_lock:
+            library_item_ids = list(self._overdue_items)
+        return [self._holdings[library_item_id] for library_item_id in library_item_ids]
+
+    def holds_for_patron(self, patron_id):
+        """Returns a list of the LibraryItems the patron with the given ID has requested."""
+        with self._status_lock:
+            library_item_ids = list(self._holds.get(patron_id, ()))
+        return [self._holdings[library_item_id] for library_item_id in library_item_ids]
+
     def check_out_library_item(self, patron_id, library_item_id):
         """Attempts to check out the patron with the specified library item."""
-        # Case where the patron is not in the library's members
-        if patron_id not in self._members:
-            return "patron not found"
-
-        # Case where the item is not in the holdings
-        if library_item_id not in self._holdings:
-            return "item not found"
-
-        library_item = self.get_library_item_from_id(library_item_id)
-        patron = self.get_patron_from_id(patron_id)
-
-        # Case where item is already checked out
-        if library_item.get_checked_out_by() is not None:
-            return "item already checked out"
-
-        # Case where the item is on hold
-        if library_item.get_requested_by() is not None and library_item.get_requested_by() != patron:
-            return "item on hold by other patron"
-
-        # Successful check out
-        library_item.set_checked_out_by(patron)
-        library_item.set_date_checked_out(self._current_date)
-        library_item.set_location("CHECKED_OUT")
-
-        # Case where the item was requested by this patron
-        if library_item.get_requested_by() == patron:
-            library_item.set_requested_by(None)
-
-        patron.add_library_item(library_item)
-        return "check out successful"
+        status = self._check_out(self._members.get(patron_id), self._holdings.get(library_item_id))
+        return STATUS_MESSAGES[status]
 
     def return_library_item(self, library_item_id):
         """Takes a library item ID and attempts to return the specified library item."""
-        # Case where the item is not in the holdings
-        if library_item_id not in self._holdings:
-            return "item not found"
-
-        # Case where the library item is not checked out
-        library_item = self.get_library_item_from_id(library_item_id)
-        if library_item.get_checked_out_by() is None:
-            return "item already in library"
-
-        # Successful return
-        patron = library_item.get_checked_out_by()
-        patron.remove_library_item(library_item)
-
-        # Update location
-        # Case where another patron has it requested
-        if library_item.get_requested_by() is not None:
-            library_item.set_location("ON_HOLD_SHELF")
-
-        # Case where it is not requested
-        else:
-            library_item.set_location("ON_SHELF")
-
-        library_item.set_checked_out_by(None)
-        return "return successful"
+        status = self._return(library_item_id, self._holdings.get(library_item_id))
+        return STATUS_MESSAGES[status]
 
     def request_library_item(self, patron_id, library_item_id):
         """Takes a patron ID and library item ID and attempts to return that item."""
+        status = self._request(self._members.get(patron_id), self._holdings.get(library_item_id))
+        return STATUS_MESSAGES[status]
+
+    def apply_batch(self, operations):
+        """Takes an iterable of operations and applies them in order with the same results as the single
+        operation methods. Each operation is ("check_out", patron ID, library item ID), ("return", library
+        item ID) or ("request", patron ID, library item ID). Returns an array of status codes, one per
+        operation; STATUS_MESSAGES gives the string for each code."""
+        operations = list(operations)
+
+        # Check every operation and gather the distinct IDs before anything is changed
+        patron_ids = set()
+        library_item_ids = set()
+        for operation in operations:
+            kind = operation[0]
+            if kind == "return":
+                library_item_ids.add(operation[1])
+            elif kind == "check_out" or kind == "request":
+                patron_ids.add(operation[1])
+                library_item_ids.add(operation[2])
+            else:
+                raise ValueError("unknown library operation: " + repr(kind))
+
+        # Look up each distinct ID once; IDs that are not found map to None
+        get_patron = self._members.get
+        get_library_item = self._holdings.get
+        patrons = {patron_id: get_patron(patron_id) for patron_id in patron_ids}
+        library_items = {library_item_id: get_library_item(library_item_id) for library_item_id in library_item_ids}
+
+        if self._item_locks is None:
+            return self._apply_batch_unlocked(operations, patrons, library_items)
+
+        statuses = array("b")
+        for operation in operations:
+            kind = operation[0]
+            if kind == "check_out":
+                statuses.append(self._check_out(patrons[operation[1]], library_items[operation[2]]))
+            elif kind == "return":
+                statuses.append(self._return(operation[1], library_items[operation[1]]))
+            else:
+                statuses.append(self._request(patrons[operation[1]], library_items[operation[2]]))
+        return statuses
+
+    def _apply_batch_unlocked(self, operations, patrons, library_items):
+        """Applies checked operations for apply_batch in a library that is not thread safe. Does the same
+        steps as _check_out, _return and _request, _set_location and the due date methods, but inline and
+        without entering any locks, with everything the loop uses held in locals."""
+        statuses = array("b")
+        append_status = statuses.append
+        on_shelf = self._location_index["ON_SHELF"]
+        on_hold_shelf = self._location_index["ON_HOLD_SHELF"]
+        checked_out = self._location_index["CHECKED_OUT"]
+        location_index = self._location_index
+        due_dates = self._due_dates
+        loan_numbers = self._loan_numbers
+        overdue_items = self._overdue_items
+        overdue_counts = self._overdue_counts
+        current_date = self._current_date
+        heappush = heapq.heappush
+
+        for operation in operations:
+            kind = operation[0]
+            if kind == "check_out":
+                patron = patrons[operation[1]]
+                library_item = library_items[operation[2]]
+                if patron is None:
+                    append_status(PATRON_NOT_FOUND)
+                    continue
+                if library_item is None:
+                    append_status(ITEM_NOT_FOUND)
+                    continue
+                if library_item.get_checked_out_by() is not None:
+                    append_status(ITEM_ALREADY_CHECKED_OUT)
+                    continue
+                requested_by = library_item.get_requested_by()
+                if requested_by is not None and requested_by != patron:
+                    append_status(ITEM_ON_HOLD_BY_OTHER_PATRON)
+                    continue
+
+                library_item_id = operation[2]
+                library_item.set_checked_out_by(patron)
+                del location_index[library_item.get_location()][library_item_id]
+                checked_out[library_item_id] = None
+                library_item.set_location("CHECKED_OUT")
+                if requested_by == patron:
+                    library_item.set_requested_by(None)
+                    self._remove_hold(patron, library_item_id)
+                patron.add_library_item(library_item)
+
+                # Same as _schedule_due_date for a loan starting today
+                library_item.set_date_checked_out(current_date)
+                loan_number = self._next_loan_number
+                self._next_loan_number = loan_number + 1
+                loan_numbers[library_item_id] = loan_number
+                heappush(due_dates, (current_date + library_item.get_check_out_length(), loan_number,
+                                     library_item_id))
+                append_status(CHECK_OUT_SUCCESSFUL)
+
+            elif kind == "return":
+                library_item_id = operation[1]
+                library_item = library_items[library_item_id]
+                if library_item is None:
+                    append_status(ITEM_NOT_FOUND)
+                    continue
+                patron = library_item.get_checked_out_by()
+                if patron is None:
+                    append_status(ITEM_ALREADY_IN_LIBRARY)
+                    continue
+
+                patron.remove_library_item(library_item)
+
+                # Same as _clear_due_date
+                if library_item_id in loan_numbers:
+                    del loan_numbers[library_item_id]
+                elif overdue_items.pop(library_item_id, None) is not None:
+                    overdue_counts[patron] -= 1
+                    if overdue_counts[patron] == 0:
+                        del overdue_counts[patron]
+
+                del checked_out[library_item_id]
+                if library_item.get_requested_by() is not None:
+                    on_hold_shelf[library_item_id] = None
+                    library_item.set_location("ON_HOLD_SHELF")
+                else:
+                    on_shelf[library_item_id] = None
+                    library_item.set_location("ON_SHELF")
+                library_item.set_checked_out_by(None)
+                append_status(RETURN_SUCCESSFUL)
+
+            else:
+                patron = patrons[operation[1]]
+                library_item = library_items[operation[2]]
+                if patron is None:
+                    append_status(PATRON_NOT_FOUND)
+                    continue
+                if library_item is None:
+                    append_status(ITEM_NOT_FOUND)
+                    continue
+                if library_item.get_requested_by() is not None:
+                    append_status(ITEM_ALREADY_ON_HOLD)
+                    continue
+
+                library_item_id = operation[2]
+                library_item.set_requested_by(patron)
+                self._add_hold(patron, library_item_id)
+                if library_item.get_location() == "ON_SHELF":
+                    del on_shelf[library_item_id]
+                    on_hold_shelf[library_item_id] = None
+                    library_item.set_location("ON_HOLD_SHELF")
+                append_status(REQUEST_SUCCESSFUL)
+        return statuses
+
+    def _check_out(self, patron, library_item):
+        """Attempts to check out the library item to the patron, where either one is None if it was not
+        found, and returns a status code."""
+        # Case where the patron is not in the library's members
+        if patron is None:
+            return PATRON_NOT_FOUND
+
+        # Case where the item is not in the holdings
+        if library_item is None:
+            return ITEM_NOT_FOUND
+
+        with self._get_item_lock(library_item.get_library_item_id()), self._get_patron_lock(patron.get_patron_id()):
+            # Case where item is already checked out
+            if library_item.get_checked_out_by() is not None:
+                return ITEM_ALREADY_CHECKED_OUT
+
+            # Case where the item is on hold
+            requested_by = library_item.get_requested_by()
+            if requested_by is not None and requested_by != patron:
+                return ITEM_ON_HOLD_BY_OTHER_PATRON
+
+            # Successful check out
+            library_item.set_checked_out_by(patron)
+            self._set_location(library_item, "CHECKED_OUT")
+
+            # Case where the item was requested by this patron
+            if requested_by == patron:
+                library_item.set_requested_by(None)
+                with self._status_lock:
+                    self._remove_hold(patron, library_item.get_library_item_id())
+
+            patron.add_library_item(library_item)
+            self._schedule_due_date(library_item)
+            return CHECK_OUT_SUCCESSFUL
+
+    def _return(self, library_item_id, library_item):
+        """Attempts to return the library item, which is None if it was not found, and returns a status code."""
+        # Case where the item is not in the holdings
+        if library_item is None:
+            return ITEM_NOT_FOUND
+
+        with self._get_item_lock(library_item_id):
+            # Case where the library item is not checked out
+            patron = library_item.get_checked_out_by()
+            if patron is None:
+                return ITEM_ALREADY_IN_LIBRARY
+
+            # Successful return
+            with self._get_patron_lock(patron.get_patron_id()):
+                patron.remove_library_item(library_item)
+            self._clear_due_date(library_item_id)
+
+            # Update location
+            # Case where another patron has it requested
+            if library_item.get_requested_by() is not None:
+                self._set_location(library_item, "ON_HOLD_SHELF")
+
+            # Case where it is not requested
+            else:
+                self._set_location(library_item, "ON_SHELF")
+
+            library_item.set_checked_out_by(None)
+            return RETURN_SUCCESSFUL
+
+    def _request(self, patron, library_item):
+        """Attempts to place a hold on the library item for the patron, where either one is None if it was
+        not found, and returns a status code."""
         # Case where patron is not a member
-        if patron_id not in self._members:
-            return "patron not found"
+        if patron is None:
+            return PATRON_NOT_FOUND
 
         # Case where the library item is not in the holdings
-        if library_item_id not in self._holdings:
-            return "item not found"
+        if library_item is None:
+            return ITEM_NOT_FOUND
 
-        # Case where the item is already requested
-        library_item = self.get_library_item_from_id(library_item_id)
-        patron = self.get_patron_from_id(patron_id)
-        if library_item.get_requested_by() is not None:
-            return "item already on hold"
+        with self._get_item_lock(library_item.get_library_item_id()):
+            # Case where the item is already requested
+            if library_item.get_requested_by() is not None:
+                return ITEM_ALREADY_ON_HOLD
 
-        # Successful request
-        library_item.set_requested_by(patron)
+            # Successful request
+            library_item.set_requested_by(patron)
+            with self._status_lock:
+                self._add_hold(patron, library_item.get_library_item_id())
 
-        # Update the location if it is on the shelf
-        if library_item.get_location() == "ON_SHELF":
-            library_item.set_location("ON_HOLD_SHELF")
+            # Update the location if it is on the shelf
+            if library_item.get_location() == "ON_SHELF":
+                self._set_location(library_item, "ON_HOLD_SHELF")
 
-        return "request successful"
+            return REQUEST_SUCCESSFUL
 
     def pay_fine(self, patron_id, amount):
         """Takes a patron ID and dollar amount and attempts to pay their overdue fine."""
@@ -271,19 +971,132 @@ class Library:
 
         patron = self.get_patron_from_id(patron_id)
         amount = -amount
-        patron.amend_fine(amount)
+        with self._get_patron_lock(patron_id):
+            patron.amend_fine(amount)
         return "payment successful"
 
+    def top_fined_patrons(self, count):
+        """Returns up to count patrons who owe a fine, the highest fine first."""
+        with self._fine_lock:
+            return self._fine_index.get_highest(count, 0)
+
+    def patrons_with_fine_over(self, threshold):
+        """Returns the patrons whose fine is over the dollar threshold, the highest fine first."""
+        with self._fine_lock:
+            return self._fine_index.get_highest(None, round(threshold * 100))
+
     def increment_current_date(self):
         """Increments the current date and increases each patron's fines by 10 cents
         for each overdue item they have checked out."""
-        self._current_date += 1
-
-        # Check for overdue items
-        for patron in self._members.values():
-            for library_item in patron.get_checked_out_items():
-                if self._current_date - library_item.get_date_checked_out() > library_item.get_check_out_length():
-                    patron.amend_fine(0.1)
+        self.advance_days(1)
+
+    def advance_days(self, days):
+        """Advances the current date by the given number of days. Fines come out the same as
+        calling increment_current_date that many times, but only overdue items are visited."""
+        if days <= 0:
+            return
+
+        # Work out the fines while holding the due date lock, then charge them one patron at a time
+        charges = []
+        with self._due_date_lock:
+            self._current_date += days
+
+            # Items that were already overdue are charged 10 cents for every day that passed
+            for patron, count in self._overdue_counts.items():
+                charges.append((patron, 10 * count * days))
+
+            # Items that came due along the way are charged for each day after their due date
+            while self._due_dates and self._due_dates[0][0] < self._current_date:
+                due_date, loan_number, library_item_id = heapq.heappop(self._due_dates)
+
+                # Case where the item was returned before it became overdue
+                if self._loan_numbers.get(library_item_id) != loan_number:
+                    continue
+
+                del self._loan_numbers[library_item_id]
+                patron = self._holdings[library_item_id].get_checked_out_by()
+                charges.append((patron, 10 * (self._current_date - due_date)))
+                self._overdue_items[library_item_id] = patron
+                self._overdue_counts[patron] = self._overdue_counts.get(patron, 0) + 1
+
+        for patron, cents in charges:
+            with self._get_patron_lock(patron.get_patron_id()):
+                patron.amend_fine_cents(cents)
+
+    def _schedule_due_date(self, library_item, date_checked_out=None):
+        """Sets a checked out item's check out date, today unless an earlier date is given, and adds it to
+        the due date heap. An item already past its due date goes straight to the overdue items instead,
+        without being charged for the days already passed."""
+        with self._due_date_lock:
+            if date_checked_out is None:
+                date_checked_out = self._current_date
+            library_item.set_date_checked_out(date_checked_out)
+            due_date = date_checked_out + library_item.get_check_out_length()
+
+            # Case where a loan restored from saved state is already overdue
+            if due_date < self._current_date:
+                patron = library_item.get_checked_out_by()
+                self._overdue_items[library_item.get_library_item_id()] = patron
+                self._overdue_counts[patron] = self._overdue_counts.get(patron, 0) + 1
+                return
+
+            loan_number = self._next_loan_number
+            self._next_loan_number += 1
+            self._loan_numbers[library_item.get_library_item_id()] = loan_number
+            heapq.heappush(self._due_dates, (due_date, loan_number, library_item.get_library_item_id()))
+
+    def _clear_due_date(self, library_item_id):
+        """Stops tracking the due date of a returned item."""
+        with self._due_date_lock:
+            # Case where the item was not overdue yet; its heap entry is skipped when popped
+            if library_item_id in self._loan_numbers:
+                del self._loan_numbers[library_item_id]
+                return
+
+            # Case where the item was overdue
+            patron = self._overdue_items.pop(library_item_id, None)
+            if patron is not None:
+                self._overdue_counts[patron] -= 1
+                if self._overdue_counts[patron] == 0:
+                    del self._overdue_counts[patron]
+
+    def _set_location(self, library_item, location):
+        """Sets a LibraryItem's location and moves it to that location's index"""
+        library_item_id = library_item.get_library_item_id()
+        with self._status_lock:
+            del self._location_index[library_item.get_location()][library_item_id]
+            self._location_index[location][library_item_id] = None
+        library_item.set_location(location)
+
+    def _add_hold(self, patron, library_item_id):
+        """Adds a library item to a patron's holds, if there is a patron; the status lock must be held"""
+        if patron is not None:
+            self._holds.setdefault(patron.get_patron_id(), dict())[library_item_id] = None
+
+    def _remove_hold(self, patron, library_item_id):
+        """Removes a library item from a patron's holds, if there is a patron; the status lock must be held"""
+        if patron is not None:
+            holds = self._holds[patron.get_patron_id()]
+            del holds[library_item_id]
+            if not holds:
+                del self._holds[patron.get_patron_id()]
+
+    def _update_fine_index(self, patron):
+        """Moves a patron whose fine has changed to its new place in the fine index"""
+        with self._fine_lock:
+            self._fine_index.update(patron)
+
+    def _get_item_lock(self, library_item_id):
+        """Returns the lock guarding the library item with the given ID"""
+        if self._item_locks is None:
+            return NO_LOCK
+        return self._item_locks[hash(library_item_id) % LOCK_STRIPES]
+
+    def _get_patron_lock(self, patron_id):
+        """Returns the lock guarding the patron with the given ID"""
+        if self._patron_locks is None:
+            return NO_LOCK
+        return self._patron_locks[hash(patron_id) % LOCK_STRIPES]
 
 
 def main():
@@ -312,7 +1125,7 @@ def main():
     print("Adding Patron 2")
 
     print("Patron 2 checking out Album:", lib.check_out_library_item("bcd", "456"))
-    print("Patron 2's checked out items:", p2.get_checked_out_items())
+    print("Patron 2's checked out items:", list(p2.get_checked_out_items()))
     loc = a1.get_location()
     print("item location:", loc)
     print("Patron 1 requesting same Album:", lib.request_library_item("abc", "456"))
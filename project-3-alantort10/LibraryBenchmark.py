@@ -0,0 +1,239 @@
+# Author: Alan Tort
+# Date: 7/9/2021
+# Description: Benchmarks for Library.py
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from Library import Book
+from Library import Album
+from Library import Movie
+from Library import Patron
+from Library import Library
+from Library import ColumnarHoldings
+
+
+def make_library_item(number):
+    """Returns a Book, Album or Movie with an ID and text based on the given number"""
+    library_item_id = "item" + str(number)
+    if number % 3 == 0:
+        return Book(library_item_id, "Title " + str(number), "Author " + str(number % 1000))
+    elif number % 3 == 1:
+        return Album(library_item_id, "Title " + str(number), "Artist " + str(number % 1000))
+    else:
+        return Movie(library_item_id, "Title " + str(number), "Director " + str(number % 1000))
+
+
+def measure_holdings_memory(item_count, columnar):
+    """Returns how many bytes a library's holdings take up after adding item_count items, leaving out
+    the library's search and location indexes"""
+    tracemalloc.start()
+    if columnar:
+        holdings = ColumnarHoldings()
+    else:
+        holdings = dict()
+    for number in range(item_count):
+        library_item = make_library_item(number)
+        holdings[library_item.get_library_item_id()] = library_item
+    used, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return used
+
+
+def compare_holdings_memory(item_count):
+    """Prints the memory used per item by the object and columnar holdings layouts"""
+    for columnar in [False, True]:
+        used = measure_holdings_memory(item_count, columnar)
+        if columnar:
+            layout = "columnar"
+        else:
+            layout = "objects"
+        print(layout, "holdings:", used, "bytes,", round(used / item_count, 1), "bytes per item")
+
+
+def make_circulation_library(item_count, patron_count):
+    """Returns a library with item_count items and patron_count patrons"""
+    lib = Library()
+    for number in range(item_count):
+        lib.add_library_item(make_library_item(number))
+    for number in range(patron_count):
+        lib.add_patron(Patron("patron" + str(number), "Patron " + str(number)))
+    return lib
+
+
+def generate_workload(catalog_size, patron_count, days, operations_per_day, mix=None, seed=0):
+    """Returns a reproducible list of operations for a library made by make_circulation_library. Each day
+    has operations_per_day check outs, returns and requests chosen according to mix, a dict of operation
+    kind -> weight, followed by an ("increment_current_date",) operation. Returns are mostly of items
+    the workload checked out earlier."""
+    if mix is None:
+        mix = {"check_out": 0.45, "return": 0.4, "request": 0.15}
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    generator = random.Random(seed)
+    checked_out = []  # item IDs the workload has tried to check out and not yet returned
+    operations = []
+    for day in range(days):
+        for kind in generator.choices(kinds, weights, k=operations_per_day):
+            if kind == "return":
+                # Case where there is an earlier check out to return, swapping it to the end to pop it
+                if checked_out:
+                    position = generator.randrange(len(checked_out))
+                    checked_out[position], checked_out[-1] = checked_out[-1], checked_out[position]
+                    library_item_id = checked_out.pop()
+                else:
+                    library_item_id = "item" + str(generator.randrange(catalog_size))
+                operations.append(("return", library_item_id))
+            else:
+                library_item_id = "item" + str(generator.randrange(catalog_size))
+                patron_id = "patron" + str(generator.randrange(patron_count))
+                operations.append((kind, patron_id, library_item_id))
+                if kind == "check_out":
+                    checked_out.append(library_item_id)
+        operations.append(("increment_current_date",))
+    return operations
+
+
+def apply_operation(lib, operation):
+    """Applies one workload operation to the library"""
+    if operation[0] == "check_out":
+        lib.check_out_library_item(operation[1], operation[2])
+    elif operation[0] == "return":
+        lib.return_library_item(operation[1])
+    elif operation[0] == "request":
+        lib.request_library_item(operation[1], operation[2])
+    else:
+        lib.increment_current_date()
+
+
+def get_percentile(sorted_values, fraction):
+    """Returns the value at the given fraction of the way through a sorted list"""
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_benchmark(catalog_size, patron_count, days, operations_per_day, mix=None, seed=0):
+    """Runs a generated workload and returns a dict of operation kind -> results, where the results are
+    the count, throughput in ops/sec, p50 and p99 latency in microseconds, and the largest number of bytes
+    a single operation allocated at its peak."""
+    operations = generate_workload(catalog_size, patron_count, days, operations_per_day, mix, seed)
+
+    # First pass times every operation
+    latencies = dict()
+    lib = make_circulation_library(catalog_size, patron_count)
+    for operation in operations:
+        start = time.perf_counter_ns()
+        apply_operation(lib, operation)
+        latencies.setdefault(operation[0], []).append(time.perf_counter_ns() - start)
+
+    # Second pass repeats the workload with allocation tracing, which would skew the timings
+    peak_memory = dict()
+    lib = make_circulation_library(catalog_size, patron_count)
+    tracemalloc.start()
+    for operation in operations:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        apply_operation(lib, operation)
+        peak = tracemalloc.get_traced_memory()[1] - before
+        peak_memory[operation[0]] = max(peak_memory.get(operation[0], 0), peak)
+    tracemalloc.stop()
+
+    results = dict()
+    for kind, kind_latencies in latencies.items():
+        kind_latencies.sort()
+        results[kind] = {"count": len(kind_latencies),
+                         "ops_per_sec": len(kind_latencies) / (sum(kind_latencies) / 1e9),
+                         "p50_us": get_percentile(kind_latencies, 0.5) / 1000,
+                         "p99_us": get_percentile(kind_latencies, 0.99) / 1000,
+                         "peak_bytes": peak_memory[kind]}
+    return results
+
+
+def print_results(results, baseline=None, tolerance=0.1):
+    """Prints benchmark results. With a baseline from an earlier run, also prints how each measurement
+    changed and marks throughput drops and latency rises beyond the tolerance as regressions."""
+    for kind, kind_results in results.items():
+        print(kind)
+        for measurement, value in kind_results.items():
+            line = "  " + measurement + ": " + str(round(value, 2))
+            if baseline is not None and kind in baseline and baseline[kind].get(measurement):
+                change = value / baseline[kind][measurement] - 1
+                line += " (" + format(change, "+.1%") + " vs baseline)"
+                if measurement == "ops_per_sec" and change < -tolerance:
+                    line += " REGRESSION"
+                elif measurement in ("p50_us", "p99_us", "peak_bytes") and change > tolerance:
+                    line += " REGRESSION"
+            print(line)
+
+
+def compare_batch_throughput(operation_count, runs=5):
+    """Prints operations per second for single operation calls and for apply_batch, taking the fastest of
+    several runs of each on a fresh library"""
+    catalog_size = operation_count // 10
+    patron_count = operation_count // 100
+    operations = generate_workload(catalog_size, patron_count, 1, operation_count)[:-1]
+
+    single_seconds = None
+    batch_seconds = None
+    for run in range(runs):
+        lib = make_circulation_library(catalog_size, patron_count)
+        start = time.perf_counter()
+        for operation in operations:
+            apply_operation(lib, operation)
+        seconds = time.perf_counter() - start
+        if single_seconds is None or seconds < single_seconds:
+            single_seconds = seconds
+
+        lib = make_circulation_library(catalog_size, patron_count)
+        start = time.perf_counter()
+        lib.apply_batch(operations)
+        seconds = time.perf_counter() - start
+        if batch_seconds is None or seconds < batch_seconds:
+            batch_seconds = seconds
+
+    print("single operations:", round(operation_count / single_seconds), "ops/sec")
+    print("apply_batch:", round(operation_count / batch_seconds), "ops/sec",
+          "(" + format(single_seconds / batch_seconds, ".2f") + "x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the Library simulator on a generated workload")
+    parser.add_argument("--catalog-size", type=int, default=100000)
+    parser.add_argument("--patrons", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--operations-per-day", type=int, default=5000)
+    parser.add_argument("--mix", default="check_out=0.45,return=0.4,request=0.15",
+                        help="comma separated kind=weight pairs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="JSON file of earlier results to compare against")
+    parser.add_argument("--save", help="JSON file to save these results to, for use as a baseline")
+    parser.add_argument("--layouts", action="store_true",
+                        help="compare holdings memory layouts and batch throughput instead")
+    args = parser.parse_args()
+
+    if args.layouts:
+        print("Memory for", args.catalog_size, "library items")
+        compare_holdings_memory(args.catalog_size)
+        print("\nThroughput for", args.catalog_size, "circulation operations")
+        compare_batch_throughput(args.catalog_size)
+        return
+
+    mix = dict()
+    for pair in args.mix.split(","):
+        kind, weight = pair.split("=")
+        mix[kind] = float(weight)
+    results = run_benchmark(args.catalog_size, args.patrons, args.days, args.operations_per_day, mix, args.seed)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
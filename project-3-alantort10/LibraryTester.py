@@ -2,6 +2,10 @@
 # Date: 7/2/2021
 # Description: Unit Testing for Library.py
 
+import random
+import sys
+import tempfile
+import threading
 import unittest
 from Library import LibraryItem
 from Library import Book
@@ -9,6 +13,10 @@ from Library import Album
 from Library import Movie
 from Library import Patron
 from Library import Library
+from Library import STATUS_MESSAGES
+from Instrumentation import Instrumentation
+from PersistentLibrary import PersistentLibrary
+from ShardedLibrary import ShardedLibrary
 
 
 class test_library(unittest.TestCase):
@@ -19,4 +27,404 @@ class test_library(unittest.TestCase):
         id = new_library_item.get_library_item_id()
         title = new_library_item.get_title()
         self.assertEqual(id, 123) # should be True
-        self.assertEqual(title, "Title")  # should be True
\ No newline at end of file
+        self.assertEqual(title, "Title")  # should be True
+
+    def test_advance_days(self):
+        """Testing that advance_days charges the same fines as repeated increment_current_date"""
+        libraries = []
+        for i in range(2):
+            lib = Library()
+            lib.add_library_item(Book("345", "Phantom Tollbooth", "Juster"))
+            lib.add_library_item(Album("456", "...And His Orchestra", "The Fastbacks"))
+            lib.add_library_item(Movie("567", "Laputa", "Miyazaki"))
+            lib.add_patron(Patron("abc", "Felicity"))
+            lib.add_patron(Patron("bcd", "Waldo"))
+            lib.check_out_library_item("abc", "345")
+            lib.check_out_library_item("bcd", "456")
+            lib.check_out_library_item("bcd", "567")
+            libraries.append(lib)
+
+        stepped, advanced = libraries
+        for day in range(10):
+            stepped.increment_current_date()
+        advanced.advance_days(10)
+        stepped.return_library_item("567")
+        advanced.return_library_item("567")
+        for day in range(50):
+            stepped.increment_current_date()
+        advanced.advance_days(50)
+
+        for patron_id in ["abc", "bcd"]:
+            self.assertEqual(stepped.get_patron_from_id(patron_id).get_fine_amount(),
+                             advanced.get_patron_from_id(patron_id).get_fine_amount())
+        self.assertEqual(advanced.get_patron_from_id("abc").get_fine_amount(), 3.9)  # 39 days past 21
+        self.assertEqual(advanced.get_patron_from_id("bcd").get_fine_amount(), 4.9)  # 46 days past 14, 3 past 7
+
+    def test_patron_checked_out_items(self):
+        """Testing that Patron keeps its checked out items in order along with counts of each type"""
+        book = Book("345", "Phantom Tollbooth", "Juster")
+        album = Album("456", "...And His Orchestra", "The Fastbacks")
+        movie = Movie("567", "Laputa", "Miyazaki")
+        patron = Patron("abc", "Felicity")
+        patron.add_library_item(movie)
+        patron.add_library_item(book)
+        patron.add_library_item(album)
+        patron.remove_library_item(book)
+        self.assertEqual(list(patron.get_checked_out_items()), [movie, album])
+        self.assertEqual(patron.get_checked_out_count(), 2)
+        self.assertEqual(patron.get_book_count(), 0)
+        self.assertEqual(patron.get_album_count(), 1)
+        self.assertEqual(patron.get_movie_count(), 1)
+
+    def test_columnar_library(self):
+        """Testing that a columnar library behaves the same as the default one"""
+        results = []
+        for columnar in [False, True]:
+            lib = Library(columnar)
+            lib.add_library_item(Book("345", "Phantom Tollbooth", "Juster"))
+            lib.add_library_item(Album("456", "...And His Orchestra", "The Fastbacks"))
+            lib.add_patron(Patron("abc", "Felicity"))
+            lib.add_patron(Patron("bcd", "Waldo"))
+            statuses = [lib.check_out_library_item("bcd", "456"),
+                        lib.request_library_item("abc", "456"),
+                        lib.check_out_library_item("abc", "456"),
+                        lib.request_library_item("bcd", "345")]
+            lib.advance_days(30)
+            statuses.append(lib.return_library_item("456"))
+            album = lib.get_library_item_from_id("456")
+            book = lib.get_library_item_from_id("345")
+            results.append((statuses, album.get_location(), album.get_requested_by().get_patron_id(),
+                            album.get_artist(), book.get_location(), book.get_date_checked_out(),
+                            lib.get_patron_from_id("bcd").get_fine_amount()))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[1][1], "ON_HOLD_SHELF")
+
+        # text fields come back from the columnar buffer, including after an item is replaced
+        lib = Library(columnar=True)
+        lib.add_library_item(Book("345", "Phantom Tollbooth", "Juster"))
+        lib.add_library_item(Movie("567", "Laputa: Castle in the Sky – 天空の城", "Miyazaki"))
+        lib.add_library_item(Book("345", "The Phantom Tollbooth", "Norton Juster"))
+        book = lib.get_library_item_from_id("345")
+        movie = lib.get_library_item_from_id("567")
+        self.assertEqual((book.get_library_item_id(), book.get_title(), book.get_author()),
+                         ("345", "The Phantom Tollbooth", "Norton Juster"))
+        self.assertEqual((movie.get_library_item_id(), movie.get_title(), movie.get_director()),
+                         ("567", "Laputa: Castle in the Sky – 天空の城", "Miyazaki"))
+
+    def test_apply_batch(self):
+        """Testing that apply_batch gives the same results as the single operation methods"""
+        operations = [("check_out", "bcd", "456"), ("request", "abc", "456"), ("check_out", "abc", "456"),
+                      ("return", "456"), ("return", "456"), ("check_out", "abc", "456"), ("check_out", "xyz", "345"),
+                      ("request", "abc", "999"), ("request", "bcd", "345"), ("request", "abc", "345")]
+        libraries = []
+        for i in range(2):
+            lib = Library()
+            lib.add_library_item(Book("345", "Phantom Tollbooth", "Juster"))
+            lib.add_library_item(Album("456", "...And His Orchestra", "The Fastbacks"))
+            lib.add_patron(Patron("abc", "Felicity"))
+            lib.add_patron(Patron("bcd", "Waldo"))
+            libraries.append(lib)
+
+        single, batched = libraries
+        expected = []
+        for operation in operations:
+            if operation[0] == "check_out":
+                expected.append(single.check_out_library_item(operation[1], operation[2]))
+            elif operation[0] == "return":
+                expected.append(single.return_library_item(operation[1]))
+            else:
+                expected.append(single.request_library_item(operation[1], operation[2]))
+        statuses = batched.apply_batch(operations)
+        self.assertEqual([STATUS_MESSAGES[status] for status in statuses], expected)
+        self.assertEqual(batched.get_library_item_from_id("456").get_location(), "CHECKED_OUT")
+        self.assertRaises(ValueError, batched.apply_batch, [("renew", "456")])
+
+    def test_apply_batch_workload(self):
+        """Testing that apply_batch keeps every library layout in the same state as the single operation methods"""
+        generator = random.Random(4)
+        days = []
+        for day in range(40):
+            operations = []
+            for i in range(30):
+                kind = generator.choice(["check_out", "return", "request"])
+                library_item_id = str(generator.randrange(12))
+                if kind == "return":
+                    operations.append((kind, library_item_id))
+                else:
+                    operations.append((kind, generator.choice(["p0", "p1", "p2", "nobody"]), library_item_id))
+            days.append(operations)
+
+        for columnar, thread_safe in [(False, False), (True, False), (False, True), (True, True)]:
+            libraries = []
+            for i in range(2):
+                lib = Library(columnar, thread_safe)
+                for number in range(10):
+                    lib.add_library_item([Book, Album, Movie][number % 3](str(number), "Title", "Creator"))
+                for number in range(3):
+                    lib.add_patron(Patron("p" + str(number), "Patron"))
+                libraries.append(lib)
+
+            single, batched = libraries
+            for operations in days:
+                expected = []
+                for operation in operations:
+                    if operation[0] == "check_out":
+                        expected.append(single.check_out_library_item(operation[1], operation[2]))
+                    elif operation[0] == "return":
+                        expected.append(single.return_library_item(operation[1]))
+                    else:
+                        expected.append(single.request_library_item(operation[1], operation[2]))
+                statuses = batched.apply_batch(operations)
+                self.assertEqual([STATUS_MESSAGES[status] for status in statuses], expected)
+                days_passed = generator.randrange(4)
+                single.advance_days(days_passed)
+                batched.advance_days(days_passed)
+
+            for location in ["ON_SHELF", "ON_HOLD_SHELF", "CHECKED_OUT"]:
+                self.assertEqual(sorted(item.get_library_item_id() for item in batched.items_in_location(location)),
+                                 sorted(item.get_library_item_id() for item in single.items_in_location(location)))
+            self.assertEqual(sorted(item.get_library_item_id() for item in batched.overdue_items()),
+                             sorted(item.get_library_item_id() for item in single.overdue_items()))
+            for number in range(3):
+                patron_id = "p" + str(number)
+                self.assertEqual(batched.get_patron_from_id(patron_id).get_fine_cents(),
+                                 single.get_patron_from_id(patron_id).get_fine_cents())
+                self.assertEqual([item.get_library_item_id() for item in batched.holds_for_patron(patron_id)],
+                                 [item.get_library_item_id() for item in single.holds_for_patron(patron_id)])
+
+    def test_persistent_library(self):
+        """Testing that a PersistentLibrary comes back the same after a restart"""
+        with tempfile.TemporaryDirectory() as directory:
+            lib = PersistentLibrary(directory)
+            lib.add_library_item(Book("345", "Phantom Tollbooth", "Juster"))
+            lib.add_library_item(Album("456", "...And His Orchestra", "The Fastbacks"))
+            lib.add_library_item(Movie("567", "Laputa", "Miyazaki"))
+            lib.add_patron(Patron("abc", "Felicity"))
+            lib.add_patron(Patron("bcd", "Waldo"))
+            lib.check_out_library_item("bcd", "456")
+            lib.request_library_item("abc", "456")
+            lib.advance_days(3)
+            lib.check_out_library_item("bcd", "567")
+            lib.advance_days(20)
+            lib.snapshot()
+            lib.pay_fine("bcd", 0.25)
+            lib.check_out_library_item("abc", "345")
+            lib.request_library_item("bcd", "345")
+            lib.advance_days(2)
+            lib.close()
+
+            restarted = PersistentLibrary(directory)
+            self.assertEqual(restarted.get_patron_from_id("bcd").get_fine_amount(),
+                             lib.get_patron_from_id("bcd").get_fine_amount())
+            self.assertEqual(restarted.get_library_item_from_id("345").get_requested_by().get_patron_id(), "bcd")
+            self.assertEqual(restarted.get_library_item_from_id("456").get_date_checked_out(), 0)
+            self.assertEqual([library_item.get_library_item_id() for library_item in
+                              restarted.get_patron_from_id("bcd").get_checked_out_items()], ["456", "567"])
+            restarted.advance_days(5)
+            self.assertEqual(restarted.get_patron_from_id("bcd").get_fine_amount(), 3.35)  # 2.35 + 2 items * 5 days
+
+            # the snapshot keeps a loan that is not due yet next to the overdue ones
+            restarted.snapshot()
+            restarted.close()
+            restarted = PersistentLibrary(directory)
+            self.assertEqual(sorted(library_item.get_library_item_id() for library_item in restarted.overdue_items()),
+                             ["456", "567"])
+            self.assertEqual(len(restarted.items_in_location("CHECKED_OUT")), 3)
+            restarted.advance_days(20)  # 345 was checked out on day 23, so it is due on day 44 and now 6 days late
+            self.assertEqual(restarted.get_patron_from_id("abc").get_fine_amount(), 0.6)
+            self.assertEqual(restarted.get_patron_from_id("bcd").get_fine_amount(), 7.35)
+            restarted.close()
+
+    def test_thread_safe_library(self):
+        """Testing that a thread safe library stays consistent with many threads checking out the same items"""
+        lib = Library(thread_safe=True)
+        for number in range(20):
+            lib.add_library_item(Movie(str(number), "Title", "Director"))
+        for number in range(8):
+            lib.add_patron(Patron("patron" + str(number), "Name"))
+        check_out_counts = [0] * 20
+
+        def circulate(patron_id):
+            for round_number in range(200):
+                for number in range(20):
+                    if lib.check_out_library_item(patron_id, str(number)) == "check out successful":
+                        check_out_counts[number] += 1  # only the patron holding the item gets here
+                        lib.return_library_item(str(number))
+                    lib.request_library_item(patron_id, str(number))
+                if patron_id == "patron0" and round_number % 50 == 0:
+                    lib.increment_current_date()  # 4 days in all, so nothing becomes overdue
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(0.00001)
+        threads = [threading.Thread(target=circulate, args=("patron" + str(number),)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(switch_interval)
+
+        # every checkout was followed by a return, so nothing is left checked out
+        for number in range(20):
+            library_item = lib.get_library_item_from_id(str(number))
+            self.assertIsNone(library_item.get_checked_out_by())
+            self.assertNotEqual(library_item.get_location(), "CHECKED_OUT")
+            self.assertGreater(check_out_counts[number], 0)
+        for number in range(8):
+            self.assertEqual(lib.get_patron_from_id("patron" + str(number)).get_checked_out_count(), 0)
+            self.assertEqual(lib.get_patron_from_id("patron" + str(number)).get_fine_amount(), 0)
+
+    def test_search(self):
+        """Testing searching the catalog by title, author, artist and director"""
+        lib = Library()
+        lib.add_library_item(Book("345", "Phantom Tollbooth", "Juster"))
+        lib.add_library_item(Album("456", "...And His Orchestra", "The Fastbacks"))
+        lib.add_library_item(Movie("567", "Laputa", "Miyazaki"))
+        lib.add_library_item(Movie("678", "Phantom Thread", "Anderson"))
+        self.assertEqual(lib.search("phantom"), ["345", "678"])
+        self.assertEqual(lib.search("PHAN t"), ["345", "678"])
+        self.assertEqual(lib.search("phantom", item_type=Movie), ["678"])
+        self.assertEqual(lib.search("the fast"), ["456"])
+        self.assertEqual(lib.search("the", fields=["title"]), [])
+        self.assertEqual(lib.search("miya"), ["567"])
+        self.assertEqual(lib.search("tollbooth juster"), ["345"])
+        self.assertEqual(lib.search("tollbooth miyazaki"), [])
+        lib.add_library_item(Movie("567", "Porco Rosso", "Miyazaki"))
+        self.assertEqual(lib.search("laputa"), [])
+        self.assertEqual(lib.search("porco"), ["567"])
+
+    def test_location_and_status_indexes(self):
+        """Testing the location, overdue and hold queries as items move around"""
+        lib = Library()
+        b1 = Book("345", "Phantom Tollbooth", "Juster")
+        a1 = Album("456", "...And His Orchestra", "The Fastbacks")
+        m1 = Movie("567", "Laputa", "Miyazaki")
+        for library_item in [b1, a1, m1]:
+            lib.add_library_item(library_item)
+        lib.add_patron(Patron("abc", "Felicity"))
+        lib.add_patron(Patron("bcd", "Waldo"))
+        self.assertEqual(lib.items_in_location("ON_SHELF"), [b1, a1, m1])
+
+        lib.check_out_library_item("bcd", "456")
+        lib.request_library_item("abc", "456")
+        lib.request_library_item("abc", "567")
+        self.assertEqual(lib.items_in_location("CHECKED_OUT"), [a1])
+        self.assertEqual(lib.items_in_location("ON_HOLD_SHELF"), [m1])
+        self.assertEqual(lib.holds_for_patron("abc"), [a1, m1])
+        self.assertEqual(lib.overdue_items(), [])
+
+        lib.advance_days(15)
+        self.assertEqual(lib.overdue_items(), [a1])
+        lib.return_library_item("456")
+        lib.check_out_library_item("abc", "567")
+        self.assertEqual(lib.overdue_items(), [])
+        self.assertEqual(lib.items_in_location("ON_HOLD_SHELF"), [a1])
+        self.assertEqual(lib.items_in_location("CHECKED_OUT"), [m1])
+        self.assertEqual(lib.holds_for_patron("abc"), [a1])
+        self.assertEqual(lib.holds_for_patron("bcd"), [])
+
+    def test_sharded_library(self):
+        """Testing that a sharded library gives the same results and fines as a single Library"""
+        operations = []
+        for number in range(12):
+            operations.append(("check_out", "abc", str(number)))
+            operations.append(("request", "bcd", str(number)))
+        operations.append(("return", "3"))
+        operations.append(("check_out", "bcd", "3"))
+
+        lib = Library()
+        with ShardedLibrary(3) as sharded:
+            for target in [lib, sharded]:
+                for number in range(12):
+                    target.add_library_item(Movie(str(number), "Title", "Director"))
+                target.add_patron(Patron("abc", "Felicity"))
+                target.add_patron(Patron("bcd", "Waldo"))
+            self.assertEqual(sharded.check_out_library_item("abc", "0"), lib.check_out_library_item("abc", "0"))
+            self.assertEqual(sharded.apply_batch(operations), lib.apply_batch(operations))
+            sharded.advance_days(10)
+            lib.advance_days(10)
+            sharded.pay_fine("abc", 1.5)
+            lib.pay_fine("abc", 1.5)
+            self.assertEqual(sharded.get_fine_amount("abc"), lib.get_patron_from_id("abc").get_fine_amount())
+            self.assertEqual(sharded.get_fine_amount("bcd"), 0.3)
+            self.assertEqual(sorted(sharded.get_checked_out_item_ids("abc")), sorted(
+                [library_item.get_library_item_id() for library_item in lib.get_patron_from_id("abc").get_checked_out_items()]))
+            self.assertEqual(sharded.get_library_item_from_id("3").get_location(), "CHECKED_OUT")
+            self.assertIsNone(sharded.get_fine_amount("xyz"))
+            self.assertRaises(ValueError, sharded.apply_batch, [("renew", "3")])
+
+            # an error from the shards leaves no stale replies behind for the next call
+            self.assertRaises(TypeError, sharded.advance_days, "x")
+            self.assertEqual(sharded.get_fine_amount("bcd"), 0.3)
+
+            # a patron added with a fine owes it once, not once per shard
+            fined = Patron("cde", "Marta")
+            fined.amend_fine(5)
+            sharded.add_patron(fined)
+            self.assertEqual(sharded.get_fine_amount("cde"), 5.0)
+            sharded.pay_fine("cde", 2)
+            self.assertEqual(sharded.get_fine_amount("cde"), 3.0)
+
+    def test_instrumentation(self):
+        """Testing that instrumentation counts calls and outcomes without changing results"""
+        lib = Library()
+        lib.add_library_item(Album("456", "...And His Orchestra", "The Fastbacks"))
+        lib.add_patron(Patron("abc", "Felicity"))
+        lib.add_patron(Patron("bcd", "Waldo"))
+        instrumentation = Instrumentation()
+        instrumentation.instrument(lib)
+        lib.request_library_item("abc", "456")
+        self.assertEqual(lib.check_out_library_item("bcd", "456"), "item on hold by other patron")
+        self.assertEqual(lib.check_out_library_item("abc", "456"), "check out successful")
+        lib.increment_current_date()
+
+        stats = instrumentation.snapshot()
+        self.assertEqual(stats["Library.check_out_library_item"]["calls"], 2)
+        self.assertEqual(stats["Library.check_out_library_item"]["outcomes"],
+                         {"item on hold by other patron": 1, "check out successful": 1})
+        self.assertEqual(stats["Library.advance_days"]["outcomes"], {"ok": 1})
+        self.assertEqual(sum(stats["Library.request_library_item"]["latency_histogram"].values()), 1)
+
+        instrumentation.uninstrument()
+        lib.return_library_item("456")
+        self.assertNotIn("Library.return_library_item", instrumentation.snapshot())
+
+    def test_fine_leaderboard(self):
+        """Testing that the top fined patrons and those over a threshold follow every fine change"""
+        lib = Library()
+        lib.add_library_item(Book("345", "Phantom Tollbooth", "Juster"))
+        lib.add_library_item(Movie("567", "Laputa", "Miyazaki"))
+        lib.add_patron(Patron("abc", "Felicity"))
+        lib.add_patron(Patron("bcd", "Waldo"))
+        lib.add_patron(Patron("cde", "Ada"))
+        self.assertEqual(lib.top_fined_patrons(3), [])
+        lib.check_out_library_item("abc", "345")
+        lib.check_out_library_item("bcd", "567")
+        lib.advance_days(30)  # 9 days past 21 for abc, 23 past 7 for bcd
+        self.assertEqual([patron.get_patron_id() for patron in lib.top_fined_patrons(3)], ["bcd", "abc"])
+        self.assertEqual([patron.get_patron_id() for patron in lib.top_fined_patrons(1)], ["bcd"])
+        self.assertEqual([patron.get_patron_id() for patron in lib.patrons_with_fine_over(0.9)], ["bcd"])
+        lib.pay_fine("bcd", 2.0)
+        self.assertEqual([patron.get_patron_id() for patron in lib.top_fined_patrons(3)], ["abc", "bcd"])
+        lib.get_patron_from_id("cde").amend_fine(5)
+        self.assertEqual([patron.get_patron_id() for patron in lib.patrons_with_fine_over(0.3)], ["cde", "abc"])
+        replaced = lib.get_patron_from_id("cde")
+        lib.add_patron(Patron("cde", "Ada"))
+        replaced.amend_fine(1)
+        self.assertEqual([patron.get_patron_id() for patron in lib.top_fined_patrons(3)], ["abc", "bcd"])
+
+        # enough patrons to split the index into several buckets, checked against sorting every patron
+        random_generator = random.Random(0)
+        patrons = [Patron(str(number), "Name") for number in range(3000)]
+        for patron in patrons:
+            lib.add_patron(patron)
+        for change in range(20000):
+            patron = random_generator.choice(patrons)
+            if random_generator.random() < 0.3:
+                lib.pay_fine(patron.get_patron_id(), random_generator.randrange(100) / 100)
+            else:
+                patron.amend_fine_cents(random_generator.randrange(50))
+        members = [lib.get_patron_from_id(patron_id) for patron_id in ["abc", "bcd", "cde"]] + patrons
+        expected = sorted(members, key=lambda patron: -patron.get_fine_cents())
+        self.assertEqual(lib.top_fined_patrons(100), [patron for patron in expected[:100] if patron.get_fine_cents() > 0])
+        self.assertEqual(lib.patrons_with_fine_over(1.5), [patron for patron in expected if patron.get_fine_cents() > 150])
+        self.assertEqual(lib.patrons_with_fine_over(-1), [patron for patron in expected if patron.get_fine_cents() > -100])
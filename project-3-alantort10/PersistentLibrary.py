@@ -0,0 +1,242 @@
+# Author: Alan Tort
+# Date: 7/12/2021
+# Description: A Library that survives restarts using snapshots and a journal
+
+import json
+import mmap
+import os
+import pickle
+from Library import Book
+from Library import Album
+from Library import Movie
+from Library import Patron
+from Library import Library
+from Library import CHECK_OUT_SUCCESSFUL
+from Library import RETURN_SUCCESSFUL
+from Library import REQUEST_SUCCESSFUL
+
+ITEM_TYPES = {"Book": Book, "Album": Album, "Movie": Movie}
+
+
+def get_item_type_name(library_item):
+    """Returns "Book", "Album" or "Movie" for the given LibraryItem"""
+    for name, item_type in ITEM_TYPES.items():
+        if isinstance(library_item, item_type):
+            return name
+    raise TypeError("only Books, Albums and Movies can be saved")
+
+
+def get_item_creator(library_item):
+    """Returns the author, artist or director of the given LibraryItem"""
+    if isinstance(library_item, Book):
+        return library_item.get_author()
+    elif isinstance(library_item, Album):
+        return library_item.get_artist()
+    else:
+        return library_item.get_director()
+
+
+class PersistentLibrary(Library):
+    """A Library that saves its state in a directory. Every change is appended to a journal as it
+    happens, and every snapshot_interval journal entries the whole library is written to a compact
+    snapshot and the journal is started over. Creating a PersistentLibrary on an existing directory
+    loads the latest snapshot through a memory-mapped file and replays only the journal written since."""
+
+    def __init__(self, directory, columnar=False, snapshot_interval=100000, sync=False):
+        """Init method. With sync set, every journal entry is flushed to disk before returning."""
+        super().__init__(columnar)
+        self._directory = directory
+        self._snapshot_interval = snapshot_interval
+        self._sync = sync
+        self._generation = 0  # increases with each snapshot; names the journal that follows it
+        self._journal_entries = 0
+        self._replaying = True  # changes are not journaled while the saved state is being loaded
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._get_snapshot_path()):
+            self._load_snapshot()
+        self._replay_journal()
+
+        # Journals from before the latest snapshot are already covered by it
+        for file_name in os.listdir(directory):
+            if file_name.startswith("journal.") and file_name != os.path.basename(self._get_journal_path()):
+                os.remove(os.path.join(directory, file_name))
+        self._journal = open(self._get_journal_path(), "a", encoding="utf-8")
+        self._replaying = False
+
+    def close(self):
+        """Closes the journal"""
+        self._journal.close()
+
+    def add_library_item(self, library_item):
+        """Adds the specified library item to the library's holdings."""
+        super().add_library_item(library_item)
+        self._write_journal_entry(["add_library_item", get_item_type_name(library_item),
+                                   library_item.get_library_item_id(), library_item.get_title(),
+                                   get_item_creator(library_item)])
+
+    def add_patron(self, patron):
+        """Adds the specified patron to the library's members."""
+        super().add_patron(patron)
+        self._write_journal_entry(["add_patron", patron.get_patron_id(), patron.get_name()])
+
+    def pay_fine(self, patron_id, amount):
+        """Takes a patron ID and dollar amount and attempts to pay their overdue fine."""
+        status = super().pay_fine(patron_id, amount)
+        if status == "payment successful":
+            self._write_journal_entry(["pay_fine", patron_id, amount])
+        return status
+
+    def advance_days(self, days):
+        """Advances the current date by the given number of days."""
+        super().advance_days(days)
+        if days > 0:
+            self._write_journal_entry(["advance_days", days])
+
+    def _check_out(self, patron, library_item):
+        """Checks out the library item and journals it if successful."""
+        status = super()._check_out(patron, library_item)
+        if status == CHECK_OUT_SUCCESSFUL:
+            self._write_journal_entry(["check_out", patron.get_patron_id(), library_item.get_library_item_id()])
+        return status
+
+    def _return(self, library_item_id, library_item):
+        """Returns the library item and journals it if successful."""
+        status = super()._return(library_item_id, library_item)
+        if status == RETURN_SUCCESSFUL:
+            self._write_journal_entry(["return", library_item_id])
+        return status
+
+    def _request(self, patron, library_item):
+        """Requests the library item and journals it if successful."""
+        status = super()._request(patron, library_item)
+        if status == REQUEST_SUCCESSFUL:
+            self._write_journal_entry(["request", patron.get_patron_id(), library_item.get_library_item_id()])
+        return status
+
+    def snapshot(self):
+        """Writes the whole library to a new snapshot and starts a new, empty journal."""
+        patrons = []
+        for patron in self._members.values():
+            loans = []
+            for library_item in patron.get_checked_out_items():
+                loans.append(library_item.get_library_item_id())
+            patrons.append((patron.get_patron_id(), patron.get_name(), patron.get_fine_cents(), loans))
+
+        library_items = []
+        for library_item in self._holdings.values():
+            requested_by = library_item.get_requested_by()
+            if requested_by is not None:
+                requested_by = requested_by.get_patron_id()
+            library_items.append((get_item_type_name(library_item), library_item.get_library_item_id(),
+                                  library_item.get_title(), get_item_creator(library_item),
+                                  library_item.get_date_checked_out(), requested_by))
+
+        state = {"generation": self._generation + 1, "current_date": self._current_date,
+                 "patrons": patrons, "library_items": library_items}
+
+        # Write the snapshot under a temporary name first so a crash never leaves a partial snapshot
+        temporary_path = self._get_snapshot_path() + ".tmp"
+        with open(temporary_path, "wb") as snapshot_file:
+            pickle.dump(state, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary_path, self._get_snapshot_path())
+
+        # The old journal is covered by the snapshot, so start the next generation's journal
+        old_journal_path = self._get_journal_path()
+        self._journal.close()
+        self._generation += 1
+        self._journal_entries = 0
+        self._journal = open(self._get_journal_path(), "a", encoding="utf-8")
+        os.remove(old_journal_path)
+
+    def _get_snapshot_path(self):
+        """Returns the path of the snapshot file"""
+        return os.path.join(self._directory, "snapshot.bin")
+
+    def _get_journal_path(self):
+        """Returns the path of the journal for the current generation"""
+        return os.path.join(self._directory, "journal." + str(self._generation) + ".log")
+
+    def _write_journal_entry(self, entry):
+        """Appends an entry to the journal and takes a snapshot when the journal is long enough"""
+        if self._replaying:
+            return
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+        if self._sync:
+            os.fsync(self._journal.fileno())
+        self._journal_entries += 1
+        if self._journal_entries >= self._snapshot_interval:
+            self.snapshot()
+
+    def _load_snapshot(self):
+        """Rebuilds the library from the snapshot file, restoring the date, loans and fines directly"""
+        with open(self._get_snapshot_path(), "rb") as snapshot_file:
+            with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot_map:
+                state = pickle.loads(snapshot_map)
+        self._generation = state["generation"]
+        self._current_date = state["current_date"]
+
+        for patron_id, name, fine_cents, loans in state["patrons"]:
+            patron = Patron(patron_id, name)
+            patron.amend_fine_cents(fine_cents)
+            self.add_patron(patron)
+
+        dates_checked_out = dict()
+        requests = []
+        for type_name, library_item_id, title, creator, date_checked_out, requested_by in state["library_items"]:
+            self.add_library_item(ITEM_TYPES[type_name](library_item_id, title, creator))
+            dates_checked_out[library_item_id] = date_checked_out
+            if requested_by is not None:
+                requests.append((requested_by, library_item_id))
+
+        # Put the loans back in date order, keeping each patron's own order for items from the same day,
+        # so the due date heap and overdue items come out as they were
+        loans = []
+        for patron_id, name, fine_cents, patron_loans in state["patrons"]:
+            for library_item_id in patron_loans:
+                loans.append((patron_id, library_item_id))
+        loans.sort(key=lambda loan: dates_checked_out[loan[1]])
+        for patron_id, library_item_id in loans:
+            patron = self._members[patron_id]
+            library_item = self._holdings[library_item_id]
+            library_item.set_checked_out_by(patron)
+            self._set_location(library_item, "CHECKED_OUT")
+            patron.add_library_item(library_item)
+            self._schedule_due_date(library_item, dates_checked_out[library_item_id])
+
+        for patron_id, library_item_id in requests:
+            self.request_library_item(patron_id, library_item_id)
+
+    def _replay_journal(self):
+        """Applies every entry in the current generation's journal"""
+        if not os.path.exists(self._get_journal_path()):
+            return
+        with open(self._get_journal_path(), "rb") as journal:
+            complete_length = 0
+            for line in journal:
+                # Case where the process stopped partway through writing the last entry
+                if not line.endswith(b"\n"):
+                    break
+                complete_length += len(line)
+                entry = json.loads(line)
+                if entry[0] == "add_library_item":
+                    self.add_library_item(ITEM_TYPES[entry[1]](entry[2], entry[3], entry[4]))
+                elif entry[0] == "add_patron":
+                    self.add_patron(Patron(entry[1], entry[2]))
+                elif entry[0] == "check_out":
+                    self.check_out_library_item(entry[1], entry[2])
+                elif entry[0] == "return":
+                    self.return_library_item(entry[1])
+                elif entry[0] == "request":
+                    self.request_library_item(entry[1], entry[2])
+                elif entry[0] == "pay_fine":
+                    self.pay_fine(entry[1], entry[2])
+                elif entry[0] == "advance_days":
+                    self.advance_days(entry[1])
+                self._journal_entries += 1
+
+        # Drop any partial entry so new entries start on a fresh line
+        os.truncate(self._get_journal_path(), complete_length)
@@ -0,0 +1,200 @@
+# Author: Alan Tort
+# Date: 7/16/2021
+# Description: A Library spread over several worker processes
+
+import zlib
+from array import array
+from multiprocessing import Pipe
+from multiprocessing import Process
+from Library import Library
+from Library import Patron
+
+
+def get_patron_fine_cents(lib, patron_id):
+    """Returns the fine in cents that a shard holds for a patron, or None if the patron is not found"""
+    patron = lib.get_patron_from_id(patron_id)
+    if patron is None:
+        return None
+    return patron.get_fine_cents()
+
+
+def get_patron_item_ids(lib, patron_id):
+    """Returns the IDs of the library items a patron has checked out from a shard"""
+    patron = lib.get_patron_from_id(patron_id)
+    if patron is None:
+        return []
+    return [library_item.get_library_item_id() for library_item in patron.get_checked_out_items()]
+
+
+# Shard commands that are not plain Library methods
+SHARD_FUNCTIONS = {"get_patron_fine_cents": get_patron_fine_cents, "get_patron_item_ids": get_patron_item_ids}
+
+
+def run_shard(connection, columnar):
+    """Runs one shard: answers (command, arguments) messages with (succeeded, result or error) until it
+    receives None"""
+    lib = Library(columnar)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        command, arguments = message
+
+        # Errors are sent back to be raised in the calling process instead of stopping the shard
+        try:
+            if command in SHARD_FUNCTIONS:
+                result = SHARD_FUNCTIONS[command](lib, *arguments)
+            else:
+                result = getattr(lib, command)(*arguments)
+        except Exception as error:
+            connection.send((False, error))
+        else:
+            connection.send((True, result))
+    connection.close()
+
+
+class ShardedLibrary:
+    """Represents a library whose holdings are split across worker processes by library item ID. Every
+    shard knows every patron, so a check out, return or request only involves the shard that owns the
+    item. A patron's fines are the total of their fines on every shard, and a fine the patron had when
+    added and payments are kept on the shard that owns the patron ID. The date advances on all shards in parallel."""
+
+    def __init__(self, shard_count=4, columnar=False):
+        """Init method"""
+        self._connections = []
+        self._processes = []
+        for shard in range(shard_count):
+            connection, shard_connection = Pipe()
+            process = Process(target=run_shard, args=(shard_connection, columnar), daemon=True)
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    def __enter__(self):
+        """Returns the library for use in a with statement"""
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        """Stops the shards at the end of a with statement"""
+        self.close()
+
+    def close(self):
+        """Stops every shard process"""
+        for connection in self._connections:
+            connection.send(None)
+        for process in self._processes:
+            process.join()
+
+    def get_shard(self, key):
+        """Returns which shard owns the given library item or patron ID"""
+        return zlib.crc32(repr(key).encode()) % len(self._connections)
+
+    def add_library_item(self, library_item):
+        """Adds the specified library item to the shard that owns its ID."""
+        self._call(self.get_shard(library_item.get_library_item_id()), "add_library_item", library_item)
+
+    def add_patron(self, patron):
+        """Adds the specified patron to every shard. Only the shard that owns the patron ID gets the patron
+        as given, with any fine it already has; the other shards get a new Patron with the same ID and name,
+        so an existing fine is not counted once per shard."""
+        owner = self.get_shard(patron.get_patron_id())
+        for shard, connection in enumerate(self._connections):
+            if shard == owner:
+                connection.send(("add_patron", (patron,)))
+            else:
+                connection.send(("add_patron", (Patron(patron.get_patron_id(), patron.get_name()),)))
+        self._receive_all()
+
+    def get_library_item_from_id(self, library_item_id):
+        """Returns a copy of the LibraryItem with the given ID or None."""
+        return self._call(self.get_shard(library_item_id), "get_library_item_from_id", library_item_id)
+
+    def check_out_library_item(self, patron_id, library_item_id):
+        """Attempts to check out the patron with the specified library item."""
+        return self._call(self.get_shard(library_item_id), "check_out_library_item", patron_id, library_item_id)
+
+    def return_library_item(self, library_item_id):
+        """Takes a library item ID and attempts to return the specified library item."""
+        return self._call(self.get_shard(library_item_id), "return_library_item", library_item_id)
+
+    def request_library_item(self, patron_id, library_item_id):
+        """Takes a patron ID and library item ID and attempts to request that item."""
+        return self._call(self.get_shard(library_item_id), "request_library_item", patron_id, library_item_id)
+
+    def apply_batch(self, operations):
+        """Splits a batch of operations (see Library.apply_batch) by shard, applies each shard's part in
+        parallel and returns the status codes in the original order. Operations on the same item always
+        go to the same shard, so they are still applied in order."""
+        operations = list(operations)
+        shard_operations = [[] for connection in self._connections]
+        shard_positions = [[] for connection in self._connections]
+        for position, operation in enumerate(operations):
+            if operation[0] == "return":
+                shard = self.get_shard(operation[1])
+            elif operation[0] == "check_out" or operation[0] == "request":
+                shard = self.get_shard(operation[2])
+            else:
+                raise ValueError("unknown library operation: " + repr(operation[0]))
+            shard_operations[shard].append(operation)
+            shard_positions[shard].append(position)
+
+        for shard, connection in enumerate(self._connections):
+            connection.send(("apply_batch", (shard_operations[shard],)))
+        statuses = array("b", bytes(len(operations)))
+        for shard, shard_statuses in enumerate(self._receive_all()):
+            for position, status in zip(shard_positions[shard], shard_statuses):
+                statuses[position] = status
+        return statuses
+
+    def pay_fine(self, patron_id, amount):
+        """Takes a patron ID and dollar amount and attempts to pay their overdue fine."""
+        return self._call(self.get_shard(patron_id), "pay_fine", patron_id, amount)
+
+    def get_fine_amount(self, patron_id):
+        """Returns the patron's fine in dollars across every shard, or None if the patron is not found."""
+        fine_cents = self._call_all("get_patron_fine_cents", patron_id)
+        if fine_cents[0] is None:
+            return None
+        return sum(fine_cents) / 100
+
+    def get_checked_out_item_ids(self, patron_id):
+        """Returns the IDs of the library items the patron has checked out from every shard."""
+        library_item_ids = []
+        for shard_item_ids in self._call_all("get_patron_item_ids", patron_id):
+            library_item_ids.extend(shard_item_ids)
+        return library_item_ids
+
+    def increment_current_date(self):
+        """Increments the current date on every shard in parallel."""
+        self._call_all("advance_days", 1)
+
+    def advance_days(self, days):
+        """Advances the current date by the given number of days on every shard in parallel."""
+        self._call_all("advance_days", days)
+
+    def _call(self, shard, command, *arguments):
+        """Runs a command on one shard and returns its result"""
+        self._connections[shard].send((command, arguments))
+        return self._receive(self._connections[shard])
+
+    def _call_all(self, command, *arguments):
+        """Sends a command to every shard before waiting on any, and returns a list of their results"""
+        for connection in self._connections:
+            connection.send((command, arguments))
+        return self._receive_all()
+
+    def _receive(self, connection):
+        """Waits for a shard's reply and returns its result, raising any error the shard sent back"""
+        succeeded, result = connection.recv()
+        if not succeeded:
+            raise result
+        return result
+
+    def _receive_all(self):
+        """Waits for every shard's reply and returns a list of their results. Every reply is read before
+        any error a shard sent back is raised, so no reply is left behind to answer a later call."""
+        replies = [connection.recv() for connection in self._connections]
+        for succeeded, result in replies:
+            if not succeeded:
+                raise result
+        return [result for succeeded, result in replies]